@@ -3,7 +3,9 @@ from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.urls import reverse
 from django.utils.html import format_html
-from .models import User, ServiceCategory, ServiceProviderProfile, Booking, Review, ChatMessage
+from .authentication import invalidate_user_snapshot
+from .response_cache import invalidate_provider_details
+from .models import User, ServiceCategory, ServiceProviderProfile, Booking, Review, ChatMessage, ChatReadCursor, ChatRoomSummary, ProviderWorkingHours, ProviderBlockedInterval
 
 # --- Custom Action for Approving Providers ---
 @admin.action(description='Approve selected provider profiles')
@@ -15,14 +17,18 @@ def approve_profiles(modeladmin, request, queryset):
     # Filter out profiles that are already approved to avoid redundant operations
     pending_profiles = queryset.filter(status='PENDING')
     
+    # Get the user IDs before the update: afterwards the profiles are no longer PENDING
+    user_ids_to_approve = list(pending_profiles.values_list('user_id', flat=True))
+    
     # Update the status for the selected ServiceProviderProfile objects
     updated_profile_count = pending_profiles.update(status='APPROVED')
     
-    # Get the user IDs from the profiles that were just updated
-    user_ids_to_approve = pending_profiles.values_list('user_id', flat=True)
-    
     # Update the is_provider flag on the corresponding User objects
     User.objects.filter(id__in=user_ids_to_approve).update(is_provider=True)
+    # update() sends no signals, so drop the cached user snapshots and provider documents explicitly.
+    for user_id in user_ids_to_approve:
+        invalidate_user_snapshot(user_id)
+    invalidate_provider_details(user_ids_to_approve)
     
     if updated_profile_count > 0:
         modeladmin.message_user(request, f"{updated_profile_count} provider profiles were successfully approved.", messages.SUCCESS)
@@ -34,7 +40,7 @@ def approve_profiles(modeladmin, request, queryset):
 @admin.register(ServiceProviderProfile)
 class ServiceProviderProfileAdmin(admin.ModelAdmin):
     # This is the main list view for providers. It's the "notification center".
-    list_display = ('user_link', 'business_name', 'status', 'phone_number')
+    list_display = ('user_link', 'business_name', 'status', 'phone_number', 'average_rating', 'review_count')
 
     # This allows the admin to easily filter for 'PENDING' applications
     list_filter = ('status', 'services_offered')
@@ -101,4 +107,8 @@ admin.site.register(ServiceCategory)
 # You can add custom admin classes for these other models as well if you want to improve their display
 admin.site.register(Booking)
 admin.site.register(Review)
-admin.site.register(ChatMessage)
\ No newline at end of file
+admin.site.register(ChatMessage)
+admin.site.register(ChatReadCursor)
+admin.site.register(ChatRoomSummary)
+admin.site.register(ProviderWorkingHours)
+admin.site.register(ProviderBlockedInterval)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connects the model signal handlers (denormalized aggregates, caches, ...).
+        from . import signals  # noqa: F401
+        # Registers the configuration checks.
+        from . import checks  # noqa: F401
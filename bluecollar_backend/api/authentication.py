@@ -0,0 +1,126 @@
+# File: api/authentication.py
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .caching import bump_version, get_version
+from .db_routing import primary
+from .sync_executor import run_sync
+
+User = get_user_model()
+
+# Columns copied into a user snapshot. Changing one of them on a user invalidates it.
+USER_SNAPSHOT_FIELDS = ("id", "username", "is_active", "is_provider", "is_staff", "is_superuser")
+
+
+def snapshot_auth_enabled():
+    return getattr(settings, "JWT_AUTH_MODE", "database") == "snapshot"
+
+
+def _snapshot_version_name(user_id):
+    return f"user:{user_id}"
+
+
+def _load_user_snapshot(user_id):
+    # Cached under the user's current version, so never from a lagging replica.
+    with primary():
+        return User.objects.filter(pk=user_id).values(*USER_SNAPSHOT_FIELDS).first()
+
+
+def get_user_snapshot(user_id):
+    """
+    The user's current id, username and role flags, from the shared cache when possible.
+    Returns None if the user does not exist.
+
+    The cache key carries the user's version, and the version is read before the
+    database. A snapshot loaded while the user was being changed is therefore stored
+    under the superseded version and never served.
+    """
+    key = f"user-snapshot:{user_id}:v{get_version(_snapshot_version_name(user_id))}"
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = _load_user_snapshot(user_id)
+        if snapshot is None:
+            return None
+        cache.set(key, snapshot, getattr(settings, "USER_SNAPSHOT_CACHE_TIMEOUT", 300))
+    return snapshot
+
+
+def aget_user_snapshot(user_id):
+    return run_sync(get_user_snapshot, user_id)
+
+
+def invalidate_user_snapshot(user_id):
+    bump_version(_snapshot_version_name(user_id))
+
+
+class SnapshotUser:
+    """
+    Authenticated user built from a verified token and the user snapshot, without a
+    query on the user table. It has what the hot paths read (id, username, role and
+    status flags). Any other attribute, such as `provider_profile` or `email`, loads
+    the real User row once, on first access.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, snapshot):
+        self.id = self.pk = snapshot["id"]
+        self.username = snapshot["username"]
+        self.is_active = snapshot["is_active"]
+        self.is_provider = snapshot["is_provider"]
+        self.is_staff = snapshot["is_staff"]
+        self.is_superuser = snapshot["is_superuser"]
+
+    @cached_property
+    def instance(self):
+        return User.objects.get(pk=self.pk)
+
+    def __getattr__(self, name):
+        # Only called for attributes not set in __init__.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.instance, name)
+
+    def __eq__(self, other):
+        if isinstance(other, (SnapshotUser, User)):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.username
+
+
+def user_from_snapshot(snapshot):
+    """
+    Checks a snapshot the way simplejwt checks a User row and wraps it in a SnapshotUser.
+    """
+    if snapshot is None:
+        raise AuthenticationFailed(_("User not found"), code="user_not_found")
+    if not snapshot["is_active"]:
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+    return SnapshotUser(snapshot)
+
+
+class SnapshotJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the token's user from the user snapshot cache
+    instead of running `User.objects.get` on every request.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        return user_from_snapshot(get_user_snapshot(user_id))
@@ -0,0 +1,171 @@
+# File: api/availability.py
+
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.utils import timezone
+
+from .models import (
+    ACTIVE_BOOKING_STATUSES,
+    Booking,
+    ProviderBlockedInterval,
+    ProviderWorkingHours,
+    time_span,
+)
+
+# Name of the exclusion constraint on Booking that rejects overlapping active bookings.
+OVERLAP_CONSTRAINT = "booking_no_overlap"
+
+
+def overlapping(queryset, start_field, end_field, start, end):
+    """
+    Rows whose [start_field, end_field) range overlaps [start, end). The range is
+    built like the one in the GiST index / exclusion constraint, so they serve the
+    lookup.
+    """
+    return queryset.alias(span=time_span(start_field, end_field)).filter(
+        span__overlap=DateTimeTZRange(start, end, "[)")
+    )
+
+
+def active_bookings(provider_id, start, end):
+    queryset = Booking.objects.filter(provider_profile_id=provider_id, status__in=ACTIVE_BOOKING_STATUSES)
+    return overlapping(queryset, "booking_datetime", "booking_end_datetime", start, end)
+
+
+def blocked_intervals(provider_id, start, end):
+    queryset = ProviderBlockedInterval.objects.filter(provider_profile_id=provider_id)
+    return overlapping(queryset, "starts_at", "ends_at", start, end)
+
+
+def merge(spans):
+    """
+    Sorts (start, end) pairs and joins the ones that overlap or touch.
+    """
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def busy_intervals(provider_id, start, end):
+    """
+    Merged intervals overlapping [start, end) in which the provider is booked or blocked.
+    """
+    spans = list(active_bookings(provider_id, start, end).values_list("booking_datetime", "booking_end_datetime"))
+    spans += blocked_intervals(provider_id, start, end).values_list("starts_at", "ends_at")
+    return merge(spans)
+
+
+def working_windows(provider_id, start, end):
+    """
+    The provider's opening windows clipped to [start, end), with working hours read in
+    the site time zone. A provider without working hours is open the whole range.
+    """
+    hours = ProviderWorkingHours.objects.filter(provider_profile_id=provider_id).values_list(
+        "weekday", "start_time", "end_time"
+    )
+    by_weekday = {}
+    for weekday, start_time, end_time in hours:
+        by_weekday.setdefault(weekday, []).append((start_time, end_time))
+    if not by_weekday:
+        return [(start, end)]
+    tz = timezone.get_default_timezone()
+    day = timezone.localtime(start, tz).date()
+    last_day = timezone.localtime(end, tz).date()
+    windows = []
+    while day <= last_day:
+        for start_time, end_time in by_weekday.get(day.weekday(), ()):
+            window_start = max(datetime.combine(day, start_time, tzinfo=tz), start)
+            window_end = min(datetime.combine(day, end_time, tzinfo=tz), end)
+            if window_start < window_end:
+                windows.append((window_start, window_end))
+        day += timedelta(days=1)
+    return merge(windows)
+
+
+def subtract(windows, busy):
+    """
+    The parts of `windows` not covered by `busy` (both sorted and merged).
+    """
+    free = []
+    for window_start, window_end in windows:
+        cursor = window_start
+        for busy_start, busy_end in busy:
+            if busy_end <= cursor or busy_start >= window_end:
+                continue
+            if busy_start > cursor:
+                free.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+        if cursor < window_end:
+            free.append((cursor, window_end))
+    return free
+
+
+def free_intervals(provider_id, start, end, duration):
+    """
+    Intervals within [start, end), from now on, in which a booking of `duration`
+    fits: opening windows minus active bookings and blocked periods.
+    """
+    start = max(start, timezone.now())
+    if start >= end:
+        return []
+    free = subtract(working_windows(provider_id, start, end), busy_intervals(provider_id, start, end))
+    return [(free_start, free_end) for free_start, free_end in free if free_end - free_start >= duration]
+
+
+def unavailable_reason(provider_id, start, end):
+    """
+    Why [start, end) cannot be booked with the provider, or None. This only gives
+    clients a helpful message up front; the exclusion constraint still decides
+    between concurrent requests for the same slot.
+    """
+    if (start, end) not in working_windows(provider_id, start, end):
+        return "The provider does not work at this time."
+    if blocked_intervals(provider_id, start, end).exists():
+        return "The provider is not available at this time."
+    if active_bookings(provider_id, start, end).exists():
+        return "This time slot is already booked."
+    return None
+
+
+def is_slot_conflict(error):
+    """
+    True when an IntegrityError was raised by the booking overlap constraint.
+    """
+    return isinstance(error, IntegrityError) and OVERLAP_CONSTRAINT in str(error)
+
+
+def parse_availability_range(start_text, end_text, duration_text=None):
+    """
+    Parses `?start=YYYY-MM-DD&end=YYYY-MM-DD` (both days included) and `?duration=`
+    (hours). Returns (start, end, duration) as aware datetimes and a timedelta, or
+    raises ValueError with a message for the client.
+    """
+    options = settings.BOOKING_CALENDAR
+    try:
+        first_day = date.fromisoformat(start_text or "")
+        last_day = date.fromisoformat(end_text or "")
+    except ValueError:
+        raise ValueError("Expected 'start' and 'end' dates as YYYY-MM-DD.")
+    days = (last_day - first_day).days + 1
+    if not 0 < days <= options["MAX_RANGE_DAYS"]:
+        raise ValueError(f"'end' must be on or after 'start' and at most {options['MAX_RANGE_DAYS']} days later.")
+    if duration_text in (None, ""):
+        hours = options["DEFAULT_DURATION_HOURS"]
+    else:
+        try:
+            hours = float(duration_text)
+        except ValueError:
+            raise ValueError("'duration' must be a number of hours.")
+        if not 0 < hours <= 24:
+            raise ValueError("'duration' must be between 0 and 24 hours.")
+    tz = timezone.get_default_timezone()
+    start = datetime.combine(first_day, datetime.min.time(), tzinfo=tz)
+    end = datetime.combine(last_day + timedelta(days=1), datetime.min.time(), tzinfo=tz)
+    return start, end, timedelta(hours=hours)
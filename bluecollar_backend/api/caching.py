@@ -0,0 +1,96 @@
+# File: api/caching.py
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+
+class LRUCache:
+    """
+    Small thread-safe in-process LRU with a per-entry time to live.
+    Used as the first tier in front of the shared Django cache.
+    """
+
+    def __init__(self, maxsize=10000, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_where(self, predicate):
+        """
+        Drops every entry whose key matches `predicate`. O(n); meant for rare invalidations.
+        """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# --- Version counters in the shared cache ---
+# Cached entries embed the version of what they were built from; bumping the version
+# makes every process miss and rebuild, and a rebuild that raced with the bump is
+# stored under the old version where nobody reads it.
+
+VERSION_KEY_PREFIX = "version:"
+
+
+def get_version(name):
+    key = VERSION_KEY_PREFIX + name
+    version = cache.get(key)
+    if version is None:
+        # Start at 1; add() keeps a concurrent bump from being overwritten.
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def get_versions(names):
+    """
+    Versions of several names with a single cache round trip (for composite keys).
+    """
+    keys = {VERSION_KEY_PREFIX + name: name for name in names}
+    found = cache.get_many(list(keys))
+    return {name: found.get(key) or get_version(name) for key, name in keys.items()}
+
+
+def bump_version(name):
+    key = VERSION_KEY_PREFIX + name
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Not set yet (or evicted): any value different from what readers saw will do.
+        cache.set(key, int(time.time() * 1000), timeout=None)
+        return cache.get(key)
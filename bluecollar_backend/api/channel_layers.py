@@ -0,0 +1,114 @@
+# File: api/channel_layers.py
+
+import asyncio
+
+from channels.layers import InMemoryChannelLayer
+
+try:
+    from channels_redis.core import RedisChannelLayer
+except ImportError:  # channels_redis is only required when CHANNEL_REDIS_URL is configured.
+    RedisChannelLayer = None
+
+# Message type used to carry several coalesced group messages in one delivery.
+BATCH_MESSAGE_TYPE = "layer.batch"
+
+
+def unpack_batch(message):
+    """
+    Returns the individual messages carried by `message` (itself, if it is not a batch).
+    """
+    if message.get("type") == BATCH_MESSAGE_TYPE:
+        return message["messages"]
+    return [message]
+
+
+class _PendingBatch:
+    def __init__(self, loop):
+        self.messages = []
+        self.sent = loop.create_future()
+
+
+class GroupSendBatchingMixin:
+    """
+    Coalesces `group_send()` calls for the same group that arrive within
+    `group_send_batch_window` seconds into one "layer.batch" message, so a burst in a
+    busy room costs one broker round trip and one queued message per member instead
+    of one per chat message. A batch is flushed early once it holds
+    `group_send_batch_size` messages. Consumers unpack batches with `unpack_batch()`.
+
+    Each caller's `group_send()` returns once its batch has been handed to the
+    underlying layer, so errors still reach the sender.
+    """
+
+    def __init__(self, *args, group_send_batch_window=0.005, group_send_batch_size=50, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.group_send_batch_window = group_send_batch_window
+        self.group_send_batch_size = group_send_batch_size
+        # Keyed by (event loop, group): layers are shared by async_to_sync threads.
+        self._pending_batches = {}
+
+    async def group_send(self, group, message):
+        if self.group_send_batch_window <= 0:
+            return await super().group_send(group, message)
+        loop = asyncio.get_running_loop()
+        key = (loop, group)
+        batch = self._pending_batches.get(key)
+        if batch is None:
+            batch = self._pending_batches[key] = _PendingBatch(loop)
+            loop.call_later(self.group_send_batch_window, self._schedule_flush, key, batch)
+        batch.messages.append(message)
+        if len(batch.messages) >= self.group_send_batch_size:
+            await self._flush(key, batch)
+        await asyncio.shield(batch.sent)
+
+    def _schedule_flush(self, key, batch):
+        if self._pending_batches.get(key) is batch:
+            key[0].create_task(self._flush(key, batch))
+
+    async def _flush(self, key, batch):
+        if self._pending_batches.get(key) is not batch:
+            return
+        del self._pending_batches[key]
+        messages = batch.messages
+        if len(messages) == 1:
+            envelope = messages[0]
+        else:
+            envelope = {"type": BATCH_MESSAGE_TYPE, "messages": messages}
+        try:
+            await super().group_send(key[1], envelope)
+        except Exception as exc:
+            batch.sent.set_exception(exc)
+        else:
+            batch.sent.set_result(None)
+
+    @property
+    def pending_group_messages(self):
+        """
+        Number of group messages waiting in open batches (exposed as a metric).
+        """
+        return sum(len(batch.messages) for batch in self._pending_batches.values())
+
+    @property
+    def queued_messages(self):
+        """
+        Messages delivered to this process's channels but not yet received by a consumer
+        (exposed as a metric).
+        """
+        queues = getattr(self, "receive_buffer", None)  # channels_redis
+        if queues is None:
+            queues = getattr(self, "channels", {})  # in-memory layer
+        return sum(queue.qsize() for queue in list(queues.values()))
+
+
+class BatchingInMemoryChannelLayer(GroupSendBatchingMixin, InMemoryChannelLayer):
+    """
+    Single-process layer for local development; same batching as the Redis layer.
+    """
+
+
+if RedisChannelLayer is not None:
+    class BatchingRedisChannelLayer(GroupSendBatchingMixin, RedisChannelLayer):
+        """
+        Redis-backed layer that delivers group messages across worker processes and nodes.
+        `capacity`, `expiry` and `group_expiry` are the channels_redis limits.
+        """
@@ -0,0 +1,283 @@
+# File: api/chat_persistence.py
+
+import asyncio
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError, connection, transaction
+from django.utils import timezone
+
+from .metrics import CHAT_WRITE_BEHIND_FAILURES
+from .models import ChatMessage, ChatRoomSummary
+from .sync_executor import run_sync
+
+logger = logging.getLogger(__name__)
+
+
+def reserve_chat_message_ids(count):
+    """
+    Takes `count` ids from the chat message id sequence in one round trip.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [ChatMessage._meta.db_table, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def save_chat_message(message):
+    """
+    Inserts one message and moves its room summary forward in the same transaction.
+    """
+    with transaction.atomic():
+        message.save(force_insert=True)
+        ChatRoomSummary.record_messages([message])
+    return message
+
+
+def _is_transient_db_error(error):
+    """
+    True for errors that say nothing about the rows themselves (lost connection,
+    server shutting down, ...), where writing the same rows again later can succeed.
+    """
+    return isinstance(error, (OperationalError, InterfaceError))
+
+
+def write_chat_messages(messages):
+    """
+    Inserts already-identified messages with one bulk INSERT, and updates their room
+    summaries in the same transaction. If the database rejects the batch (e.g. a
+    booking was deleted meanwhile, or a message holds a NUL character) the rows are
+    retried one by one so only the offending messages are lost. Transient errors are
+    raised to the caller, which keeps the messages for a later attempt.
+    """
+    try:
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create(messages)
+            ChatRoomSummary.record_messages(messages)
+        return len(messages)
+    except DatabaseError as e:
+        if _is_transient_db_error(e):
+            raise
+    written = 0
+    for message in messages:
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create([message])
+                ChatRoomSummary.record_messages([message])
+            written += 1
+        except DatabaseError as e:
+            if _is_transient_db_error(e):
+                raise
+            logger.warning("Dropped chat message %s in room '%s': %s", message.id, message.room_identifier, e)
+    return written
+
+
+class _LoopQueue:
+    """
+    The part of a ChatMessageWriter bound to one event loop: the messages enqueued
+    from it, the asyncio primitives its sockets wait on and the task writing them.
+    asyncio primitives belong to the loop that first uses them, so each loop gets
+    its own.
+    """
+
+    def __init__(self, loop, max_queue, buffer):
+        self.loop = loop
+        self.buffer = buffer
+        self.slots = asyncio.Semaphore(max(max_queue - len(buffer), 0))
+        self.wakeup = asyncio.Event()
+        self.written_cond = asyncio.Condition()
+        self.enqueued_total = len(buffer)
+        self.written_total = 0
+        self.flush_requested = False
+        self.failures = 0
+        self.task = None
+
+
+class ChatMessageWriter:
+    """
+    Write-behind buffer for chat messages (CHAT_PERSISTENCE_MODE = "write_behind").
+
+    `enqueue()` gives a message its id and timestamp immediately, so the consumer can
+    broadcast it straight away, and a background task inserts buffered messages with
+    `bulk_create`. A batch is written once it holds `batch_size` messages or
+    `flush_interval` seconds after its first message, whichever comes first. At most
+    `max_queue` messages may be waiting; further `enqueue()` calls wait for room, which
+    pushes back on the sockets instead of growing memory. `flush()` waits (up to
+    `flush_timeout` seconds) until every message enqueued so far is written (used on
+    disconnect) and `flush_sync()` writes what is left at interpreter shutdown.
+
+    A batch that fails with a transient error (OperationalError, InterfaceError) goes
+    back to the head of the queue and is retried after `retry_delay` seconds, doubling
+    up to `max_retry_delay`. Its slots stay taken, so during a database outage the
+    sockets are pushed back on instead of messages being lost. Rows the database
+    rejects are dropped by write_chat_messages; any other error drops the batch, since
+    retrying it would stall the queue behind it forever. Each failure is logged and
+    counted in chat_write_behind_failures_total.
+    """
+
+    def __init__(
+        self, batch_size=200, flush_interval=0.05, max_queue=5000, id_block_size=20,
+        retry_delay=0.5, max_retry_delay=30, flush_timeout=10,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.id_block_size = id_block_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.flush_timeout = flush_timeout
+        self._ids = []
+        self._queues = {}
+        self._sync_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return sum(len(queue.buffer) for queue in list(self._queues.values()))
+
+    def _queue(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queues.get(loop)
+        if queue is None:
+            # Messages left behind by loops that have since closed are written by this one.
+            inherited = []
+            with self._sync_lock:
+                for old_loop in [old_loop for old_loop in self._queues if old_loop.is_closed()]:
+                    inherited.extend(self._queues.pop(old_loop).buffer)
+                queue = self._queues[loop] = _LoopQueue(loop, self.max_queue, inherited)
+            if inherited:
+                self._ensure_running(queue)
+        return queue
+
+    async def enqueue(self, message):
+        """
+        Assigns id and timestamp to an unsaved ChatMessage and schedules its INSERT.
+        """
+        queue = self._queue()
+        await queue.slots.acquire()
+        if not self._ids:
+            self._ids.extend(await run_sync(reserve_chat_message_ids, self.id_block_size))
+        message.id = self._ids.pop(0)
+        message.timestamp = timezone.now()
+        queue.buffer.append(message)
+        queue.enqueued_total += 1
+        if len(queue.buffer) == 1 or len(queue.buffer) >= self.batch_size:
+            queue.wakeup.set()
+        self._ensure_running(queue)
+        return message
+
+    async def flush(self):
+        """
+        Returns False if the messages were not all written within flush_timeout; they
+        stay queued and keep being retried.
+        """
+        queue = self._queue()
+        target = queue.enqueued_total
+        if queue.written_total >= target:
+            return True
+        queue.flush_requested = True
+        queue.wakeup.set()
+        self._ensure_running(queue)
+        try:
+            async with queue.written_cond:
+                await asyncio.wait_for(
+                    queue.written_cond.wait_for(lambda: queue.written_total >= target), self.flush_timeout,
+                )
+        except asyncio.TimeoutError:
+            logger.warning("Chat messages still unwritten after %ss; they remain queued", self.flush_timeout)
+            return False
+        return True
+
+    def flush_sync(self):
+        # Runs from atexit, after the event loops have stopped.
+        with self._sync_lock:
+            for queue in self._queues.values():
+                batch, queue.buffer = queue.buffer, []
+                if batch:
+                    write_chat_messages(batch)
+
+    def _ensure_running(self, queue):
+        if queue.task is None or queue.task.done():
+            queue.task = queue.loop.create_task(self._run(queue))
+
+    async def _run(self, queue):
+        while True:
+            if not queue.buffer:
+                queue.wakeup.clear()
+                await queue.wakeup.wait()
+            if len(queue.buffer) < self.batch_size and not queue.flush_requested:
+                # Give the batch up to flush_interval to fill.
+                queue.wakeup.clear()
+                try:
+                    await asyncio.wait_for(queue.wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = queue.buffer[: self.batch_size]
+            del queue.buffer[: len(batch)]
+            if not batch:
+                continue
+            try:
+                await run_sync(self._write_batch, batch)
+            except (OperationalError, InterfaceError):
+                queue.failures += 1
+                delay = min(self.retry_delay * 2 ** (queue.failures - 1), self.max_retry_delay)
+                CHAT_WRITE_BEHIND_FAILURES.inc()
+                logger.exception(
+                    "Failed to write %d chat messages (attempt %d); retrying in %.1fs",
+                    len(batch), queue.failures, delay,
+                )
+                queue.buffer[:0] = batch
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                CHAT_WRITE_BEHIND_FAILURES.inc()
+                logger.exception("Dropped %d chat messages that could not be written", len(batch))
+            queue.failures = 0
+            if not queue.buffer:
+                queue.flush_requested = False
+            for _ in batch:
+                queue.slots.release()
+            async with queue.written_cond:
+                queue.written_total += len(batch)
+                queue.written_cond.notify_all()
+
+    def _write_batch(self, batch):
+        with self._sync_lock:
+            write_chat_messages(batch)
+
+
+_writer = None
+
+
+def get_chat_message_writer():
+    """
+    The process-wide writer, created on first use from settings.CHAT_WRITE_BEHIND.
+    """
+    global _writer
+    if _writer is None:
+        options = getattr(settings, "CHAT_WRITE_BEHIND", {})
+        _writer = ChatMessageWriter(
+            batch_size=options.get("BATCH_SIZE", 200),
+            flush_interval=options.get("FLUSH_INTERVAL", 0.05),
+            max_queue=options.get("MAX_QUEUE", 5000),
+            id_block_size=options.get("ID_BLOCK_SIZE", 20),
+            retry_delay=options.get("RETRY_DELAY", 0.5),
+            max_retry_delay=options.get("MAX_RETRY_DELAY", 30),
+            flush_timeout=options.get("FLUSH_TIMEOUT", 10),
+        )
+        atexit.register(_writer.flush_sync)
+    return _writer
+
+
+def pending_chat_messages():
+    """
+    Messages waiting in this process's writer (0 if write-behind is not in use).
+    """
+    return _writer.pending if _writer is not None else 0
+
+
+def write_behind_enabled():
+    return getattr(settings, "CHAT_PERSISTENCE_MODE", "sync") == "write_behind"
@@ -0,0 +1,109 @@
+# File: api/chat_rooms.py
+
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import LRUCache, bump_version, get_version
+from .models import Booking
+
+BOOKING_ROOM_RE = re.compile(r'^booking_(\d+)$')
+# "chat_user_" followed by digits, another "_user_", and more digits.
+DIRECT_ROOM_RE = re.compile(r'^chat_user_(\d+)_user_(\d+)$')
+
+# Result of a room authorization check. `booking_id` is set for booking rooms so the
+# consumer can link messages without loading the booking again.
+RoomAccess = namedtuple('RoomAccess', ['authorized', 'booking_id', 'participant_ids'])
+DENIED = RoomAccess(False, None, ())
+
+
+def parse_booking_room(room_name):
+    match = BOOKING_ROOM_RE.match(room_name)
+    return int(match.group(1)) if match else None
+
+
+def room_type(room_name):
+    """
+    "booking", "direct" or "other"; a low-cardinality label for metrics.
+    """
+    if BOOKING_ROOM_RE.match(room_name):
+        return "booking"
+    if DIRECT_ROOM_RE.match(room_name):
+        return "direct"
+    return "other"
+
+
+def resolve_room_access(user, room_name):
+    """
+    Authorizes `user` for `room_name` against the database. Booking rooms admit the
+    booking's customer and its provider; direct rooms admit the two users named in
+    the room. Anything else is denied.
+    """
+    booking_id = parse_booking_room(room_name)
+    if booking_id is not None:
+        participants = Booking.objects.filter(pk=booking_id).values_list('customer_id', 'provider_profile_id').first()
+        if participants is None:
+            return DENIED
+        customer_id, provider_id = participants
+        is_customer = user.id == customer_id
+        is_provider = user.is_provider and user.id == provider_id
+        return RoomAccess(is_customer or is_provider, booking_id, (customer_id, provider_id))
+    match = DIRECT_ROOM_RE.match(room_name)
+    if match:
+        participant_ids = (int(match.group(1)), int(match.group(2)))
+        return RoomAccess(user.id in participant_ids, None, participant_ids)
+    return DENIED
+
+
+class RoomAccessCache:
+    """
+    Two-tier cache of room authorization results keyed by (user id, room).
+
+    Tier one is a bounded in-process LRU whose entries live `local_ttl` seconds; tier two
+    is the shared Django cache, keyed by the room's version. `invalidate_room()` bumps
+    that version (every process misses in the shared tier from then on) and evicts the
+    room from this process's LRU; other processes drop their local entries within
+    `local_ttl` seconds.
+    """
+
+    def __init__(self, maxsize=10000, local_ttl=30.0, shared_ttl=3600):
+        self.local = LRUCache(maxsize=maxsize, ttl=local_ttl)
+        self.shared_ttl = shared_ttl
+
+    def get_local(self, user_id, room_name):
+        return self.local.get((user_id, room_name))
+
+    def get(self, user, room_name):
+        """
+        Blocking lookup (shared cache, then database); call from a sync context.
+        """
+        key = (user.id, room_name)
+        access = self.local.get(key)
+        if access is not None:
+            return access
+        if parse_booking_room(room_name) is None:
+            # Direct rooms are authorized from the room name alone.
+            access = resolve_room_access(user, room_name)
+        else:
+            shared_key = f"chat:room-access:{room_name}:v{get_version(self._version_name(room_name))}:{user.id}"
+            cached = cache.get(shared_key)
+            if cached is not None:
+                access = RoomAccess(*cached)
+            else:
+                access = resolve_room_access(user, room_name)
+                cache.set(shared_key, tuple(access), self.shared_ttl)
+        self.local.set(key, access)
+        return access
+
+    def invalidate_room(self, room_name):
+        bump_version(self._version_name(room_name))
+        self.local.discard_where(lambda key: key[1] == room_name)
+
+    @staticmethod
+    def _version_name(room_name):
+        return f"chat-room:{room_name}"
+
+
+room_access_cache = RoomAccessCache(**getattr(settings, 'CHAT_ROOM_ACCESS_CACHE', {}))
@@ -0,0 +1,49 @@
+# File: api/checks.py
+
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+from .authentication import snapshot_auth_enabled
+from .presence import presence_enabled
+
+# Cache backends whose entries are private to one process.
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.security, Tags.caches)
+def check_snapshot_auth_cache(app_configs, **kwargs):
+    """
+    Snapshot authentication invalidates users through the cache; with a per-process
+    cache a deactivated user or a revoked role stays valid on the other workers until
+    the snapshot expires.
+    """
+    if not snapshot_auth_enabled() or settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Error(
+            'JWT_AUTH_MODE "snapshot" needs a cache shared by every worker.',
+            hint='Set CACHE_REDIS_URL, or use JWT_AUTH_MODE "database".',
+            id="api.E001",
+        )
+    ]
+
+
+@register(Tags.caches)
+def check_presence_cache(app_configs, **kwargs):
+    """
+    Presence entries and the count of a user's open sockets live in the cache; with a
+    per-process cache each worker sees only its own sockets and announces users
+    offline while they are still connected elsewhere.
+    """
+    if not presence_enabled() or settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Error(
+            "Chat presence needs a cache shared by every worker.",
+            hint="Set CACHE_REDIS_URL, or CHAT_PRESENCE_ENABLED=0.",
+            id="api.E002",
+        )
+    ]
@@ -1,71 +1,332 @@
 # File: api/consumers.py
-import re # Regular Expression modul
+import asyncio
 import json
-import traceback # Import traceback to print full error details
+import logging
+import re
+from collections import Counter
+from functools import partial
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from .models import ChatMessage, Booking
+from channels.db import aclose_old_connections
+from django.conf import settings
+from django.db.models import Q, Subquery
+from .channel_layers import unpack_batch
+from .chat_persistence import get_chat_message_writer, save_chat_message, write_behind_enabled
+from . import metrics, presence
+from .chat_rooms import room_access_cache, room_type
+from .models import ChatMessage, ChatReadCursor
+from .sync_executor import run_sync
 
-User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# Number of messages sent on connect and per "load_older" request.
+HISTORY_PAGE_SIZE = 50
+
+# Rooms one multiplexed socket may be subscribed to at the same time.
+MAX_SUBSCRIPTIONS = 200
+
+# Room names as accepted by the per-room route (api/routing.py).
+ROOM_NAME_RE = re.compile(r'^[\w\-]{1,255}$')
+
+
+def room_group(room_name):
+    return f'chat_{room_name}'
+
+
+# Largest value of the bigint message id column.
+MAX_MESSAGE_ID = 2 ** 63 - 1
+
+
+def is_message_id(value):
+    return isinstance(value, int) and not isinstance(value, bool) and 0 < value <= MAX_MESSAGE_ID
+
+
+async def authorize_room(user, room_name):
+    """
+    Looks `user` up for `room_name` in the two-tier room access cache and returns the
+    RoomAccess. A hit in the in-process LRU is answered on the event loop without a
+    thread hop; a miss runs on the sync executor (cache client and ORM are both sync
+    there).
+    """
+    access = room_access_cache.get_local(user.id, room_name)
+    if access is None:
+        access = await run_sync(room_access_cache.get, user, room_name)
+    return access
+
+
+async def fetch_message_history(user, room_name, before_id=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Returns up to `limit` messages of the room older than message `before_id` (the
+    newest ones when None), oldest first, plus whether even older messages exist.
+    Walks the (room_identifier, timestamp, id) index and reads plain value rows; the
+    sender's username comes from a primary-key join in the same query, so a page
+    costs one trip to the database thread.
+    """
+    messages = ChatMessage.objects.filter(room_identifier=room_name)
+    if before_id is not None:
+        anchor = Subquery(
+            ChatMessage.objects.filter(pk=before_id, room_identifier=room_name).values('timestamp')
+        )
+        messages = messages.filter(
+            Q(timestamp__lt=anchor) | Q(timestamp=anchor, id__lt=before_id),
+            timestamp__lte=anchor,
+        )
+    rows = [row async for row in messages.order_by('-timestamp', '-id').values(
+        'id', 'sender_id', 'sender__username', 'message_content', 'timestamp', 'room_identifier'
+    )[:limit + 1]]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    history_data = [{'id': row['id'], 'type': 'chat_message', 'sender_id': row['sender_id'],
+        'sender_username': row['sender__username'], 'message': row['message_content'],
+        'timestamp': row['timestamp'].isoformat(), 'is_self': row['sender_id'] == user.id,
+        'room_name': row['room_identifier']} for row in reversed(rows)]
+    return history_data, has_more
+
+
+class ChatSocketConsumer(AsyncWebsocketConsumer):
+    """
+    What the per-room and the multiplexed chat sockets share: the channel-layer event
+    handlers, message broadcasts, and presence and typing (api/presence.py; nothing
+    there touches the database).
+    """
+
+    async def layer_batch(self, event):
+        # Several group messages coalesced by the channel layer (api/channel_layers.py).
+        for message in unpack_batch(event):
+            await self.dispatch(message)
+
+    async def chat_message_broadcast(self, event):
+        # ... (Your chat_message_broadcast method is fine as is)
+        await self.send(text_data=json.dumps({
+            'type': 'chat_message', 'id': event['id'], 'message': event['message'],
+            'sender_id': event['sender_id'], 'sender_username': event['sender_username'],
+            'timestamp': event['timestamp'], 'room_name': event.get('room_name'),
+            'is_self': event['sender_id'] == self.user.id
+        }))
+
+    async def send_error_message(self, error_message_text, room_name=None):
+        # ... (Your send_error_message method is fine as is)
+        error = { 'type': 'error', 'message': error_message_text }
+        if room_name is not None:
+            error['room_name'] = room_name
+        await self.send(text_data=json.dumps(error))
+
+    async def broadcast_chat_message(self, saved_chat_message_obj, room_name, room_type_label):
+        with metrics.WS_BROADCAST_LATENCY.time(room_type_label):
+            await self.channel_layer.group_send(
+                room_group(room_name),
+                {
+                    'type': 'chat_message_broadcast',
+                    'id': saved_chat_message_obj.id,
+                    'message': saved_chat_message_obj.message_content,
+                    'sender_id': self.user.id,
+                    'sender_username': self.user.username,
+                    'timestamp': saved_chat_message_obj.timestamp.isoformat(),
+                    'room_name': room_name
+                }
+            )
+
+    async def release_connections(self):
+        if write_behind_enabled():
+            # Make sure this socket's messages are in the database before it goes away.
+            await get_chat_message_writer().flush()
+        # The async ORM calls skip Django's per-request connection cleanup; let the
+        # shared connection expire (CONN_MAX_AGE) or be replaced after errors here.
+        await aclose_old_connections()
+
+    # --- Presence ---
+
+    async def start_presence(self):
+        """
+        Announces the user online. Called once per socket, after accept.
+        """
+        self.presence_status = presence.ONLINE
+        self.last_heartbeat = asyncio.get_running_loop().time()
+        # Watched user id -> number of this socket's rooms they are a participant of.
+        self.watch_counts = Counter()
+        self.presence_joined = False
+        if not presence.presence_enabled():
+            return
+        await presence.asocket_opened(self.user.id)
+        self.presence_joined = True
+        await self.announce_presence(await presence.arecord(self.user.id, presence.ONLINE))
+
+    async def stop_presence(self):
+        for user_id in list(self.watch_counts):
+            await self.channel_layer.group_discard(presence.presence_group(user_id), self.channel_name)
+        self.watch_counts.clear()
+        if await presence.asocket_closed(self.user.id) == 0:
+            await self.announce_presence(await presence.arecord(self.user.id, presence.OFFLINE))
+
+    async def watch(self, participant_ids):
+        """
+        Subscribes the socket to the presence of a room's other participants and sends
+        the current state of those it was not already watching.
+        """
+        if not presence.presence_enabled():
+            return
+        user_ids = [user_id for user_id in dict.fromkeys(participant_ids) if user_id != self.user.id]
+        new_ids = [user_id for user_id in user_ids if not self.watch_counts[user_id]]
+        self.watch_counts.update(user_ids)
+        for user_id in new_ids:
+            await self.channel_layer.group_add(presence.presence_group(user_id), self.channel_name)
+        if new_ids:
+            for user_id, event in (await presence.alookup(new_ids)).items():
+                await self.send(text_data=json.dumps({'type': 'presence', 'user_id': user_id, **event}))
+
+    async def unwatch(self, participant_ids):
+        for user_id in dict.fromkeys(participant_ids):
+            if user_id == self.user.id or not self.watch_counts[user_id]:
+                continue
+            self.watch_counts[user_id] -= 1
+            if not self.watch_counts[user_id]:
+                del self.watch_counts[user_id]
+                await self.channel_layer.group_discard(presence.presence_group(user_id), self.channel_name)
+
+    async def heartbeat(self, status):
+        """
+        Answers a `{"type": "heartbeat", "status": "online" | "away"}` frame, sent by
+        clients every HEARTBEAT_INTERVAL seconds (status defaults to the current one).
+        Heartbeats arriving faster than every half interval without a status change
+        are ignored.
+        """
+        status = status or self.presence_status
+        if status not in presence.CLIENT_STATUSES:
+            await self.send_error_message("heartbeat 'status' must be 'online' or 'away'.")
+            return
+        if not presence.presence_enabled():
+            return
+        now = asyncio.get_running_loop().time()
+        if status == self.presence_status and now - self.last_heartbeat < settings.CHAT_PRESENCE["HEARTBEAT_INTERVAL"] / 2:
+            metrics.WS_EPHEMERAL_EVENTS.inc('presence', 'coalesced')
+            return
+        self.presence_status, self.last_heartbeat = status, now
+        await self.announce_presence(await presence.arecord(self.user.id, status))
+
+    async def announce_presence(self, event):
+        metrics.WS_EPHEMERAL_EVENTS.inc('presence', 'broadcast')
+        await self.channel_layer.group_send(
+            presence.presence_group(self.user.id),
+            {'type': 'presence_broadcast', 'user_id': self.user.id, **event},
+        )
+
+    async def presence_broadcast(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'presence', 'user_id': event['user_id'], 'status': event['status'],
+            'last_seen': event['last_seen'], 'expires_in': event['expires_in'],
+        }))
+
+    # --- Typing ---
+
+    def typing_coalescer(self, room_name):
+        config = settings.CHAT_PRESENCE
+        return presence.TypingCoalescer(
+            partial(self.send_typing, room_name), config["TYPING_INTERVAL"], config["TYPING_TTL"] / 2,
+        )
+
+    async def update_typing(self, coalescer, is_typing, room_name=None):
+        """
+        Answers a `{"type": "typing", "is_typing": true | false}` frame. Clients may
+        send one per keystroke; the room sees at most one per TYPING_INTERVAL.
+        """
+        if not isinstance(is_typing, bool):
+            await self.send_error_message("typing 'is_typing' must be true or false.", room_name)
+            return
+        if not await coalescer.update(is_typing):
+            metrics.WS_EPHEMERAL_EVENTS.inc('typing', 'coalesced')
+
+    async def send_typing(self, room_name, is_typing):
+        metrics.WS_EPHEMERAL_EVENTS.inc('typing', 'broadcast')
+        await self.channel_layer.group_send(
+            room_group(room_name),
+            {
+                'type': 'typing_broadcast', 'user_id': self.user.id, 'username': self.user.username,
+                'is_typing': is_typing, 'room_name': room_name,
+            }
+        )
+
+    async def typing_broadcast(self, event):
+        if event['user_id'] == self.user.id:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'typing', 'user_id': event['user_id'], 'username': event['username'],
+            'is_typing': event['is_typing'], 'room_name': event['room_name'],
+            'expires_in': settings.CHAT_PRESENCE["TYPING_TTL"] if event['is_typing'] else None,
+        }))
+
+
+class ChatConsumer(ChatSocketConsumer):
+    """
+    One socket per room (ws/chat/<room_name>/).
+    """
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        # === ADDED A ROBUST TRY...EXCEPT BLOCK to catch all connection errors ===
+        self.room_name = self.scope['url_route']['kwargs']['room_name']
+        self.room_type = room_type(self.room_name)
+        with metrics.WS_CONNECT_LATENCY.time(self.room_type):
+            outcome = await self.open_connection()
+        metrics.WS_CONNECTIONS.inc(self.room_type, outcome)
+
+    async def open_connection(self):
+        """
+        Authenticates and authorizes the socket, joins the room group and sends the
+        recent history. Returns the outcome label recorded in the connection metrics.
+        """
         try:
-            self.room_name = self.scope['url_route']['kwargs']['room_name']
-            self.room_group_name = f'chat_{self.room_name}'
+            self.room_group_name = room_group(self.room_name)
             self.user = self.scope['user']
 
-            print(f"CONNECT: User '{self.user}' attempting connection for room '{self.room_name}'.")
-
             if not self.user or not self.user.is_authenticated:
-                print("CONNECT: User is not authenticated. Closing connection.")
+                logger.debug("Rejected unauthenticated connection to room '%s'.", self.room_name)
                 await self.close()
-                return
+                return 'unauthenticated'
 
             is_authorized = await self.check_user_authorization_for_room()
             if not is_authorized:
-                print(f"CONNECT: User '{self.user.username}' NOT AUTHORIZED for room '{self.room_name}'. Closing connection.")
+                logger.info("User '%s' is not authorized for room '%s'.", self.user.username, self.room_name)
                 await self.close()
-                return
+                return 'forbidden'
 
-            print(f"CONNECT: User '{self.user.username}' is authorized. Adding to group '{self.room_group_name}'.")
             await self.channel_layer.group_add(
                 self.room_group_name,
                 self.channel_name
             )
 
             await self.accept()
-            print(f"CONNECT: WebSocket connection accepted for user '{self.user.username}'.")
-
-            # These methods now run safely inside the try block
-            await self.mark_messages_as_read_for_user()
-            await self.send_message_history()
-
-        except Exception as e:
-            # This block will catch ANY unhandled exception during the connect phase
-            print("\n--- UNHANDLED EXCEPTION IN ChatConsumer.connect() ---")
-            print(f"Exception Type: {type(e).__name__}")
-            print(f"Exception Details: {e}")
-            print("Traceback:")
-            traceback.print_exc() # Prints the full stack trace to the console
-            print("--------------------------------------------------")
-            # Ensure the connection is closed if an error occurs
+            self.counted_as_active = True
+            metrics.WS_ACTIVE_CONNECTIONS.inc(self.room_type)
+            logger.debug("User '%s' joined room '%s'.", self.user.username, self.room_name)
+
+            # Whatever the history shows counts as read.
+            newest_id = await self.send_message_history()
+            if newest_id is not None:
+                await self.advance_read_cursor(newest_id)
+            await self.join_presence()
+            return 'accepted'
+
+        except Exception:
+            # Any unhandled exception during the connect phase closes the socket.
+            logger.exception("Unhandled exception while connecting to room '%s'.", self.room_name)
             await self.close()
-        # === END OF TRY...EXCEPT BLOCK ===
+            return 'error'
 
     async def disconnect(self, close_code):
+        if hasattr(self, 'typing'):
+            await self.leave_presence()
         if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
             )
-        print(f"DISCONNECT: User '{self.user.username if self.user and self.user.is_authenticated else 'Anonymous'}' from room '{getattr(self, 'room_name', 'N/A')}', code: {close_code}")
+        if getattr(self, 'counted_as_active', False):
+            metrics.WS_ACTIVE_CONNECTIONS.dec(self.room_type)
+        await self.release_connections()
+        logger.debug("Socket left room '%s' (code %s).", getattr(self, 'room_name', 'N/A'), close_code)
 
     async def receive(self, text_data):
-        # ... (Your receive method is fine as is)
-        print(f"RECEIVE: User '{self.user.username}', Raw: {text_data}")
+        with metrics.WS_RECEIVE_LATENCY.time(self.room_type):
+            await self.handle_frame(text_data)
+
+    async def handle_frame(self, text_data):
         if not self.user or not self.user.is_authenticated:
             await self.send_error_message("Authentication error. Please reconnect.")
             return
@@ -75,119 +336,293 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except json.JSONDecodeError:
             await self.send_error_message("Invalid message format.")
             return
+        # Frames without a "type" are chat messages, as sent by existing clients.
+        if text_data_json.get('type') == 'load_older':
+            await self.send_older_messages(text_data_json.get('before_id'))
+            return
+        if text_data_json.get('type') == 'ack':
+            await self.acknowledge(text_data_json.get('message_id'))
+            return
+        if text_data_json.get('type') == 'heartbeat':
+            await self.heartbeat(text_data_json.get('status'))
+            return
+        if text_data_json.get('type') == 'typing':
+            await self.update_typing(self.typing, text_data_json.get('is_typing', True))
+            return
         if not message_content or not message_content.strip():
             return
-        saved_chat_message_obj = await self.save_chat_message_db(message_content)
+        if write_behind_enabled():
+            # Id and timestamp are assigned now; the INSERT happens in a later batch.
+            saved_chat_message_obj = await get_chat_message_writer().enqueue(self.build_chat_message(message_content))
+        else:
+            saved_chat_message_obj = await self.save_chat_message_db(message_content)
         if saved_chat_message_obj:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message_broadcast',
-                    'id': saved_chat_message_obj.id,
-                    'message': saved_chat_message_obj.message_content,
-                    'sender_id': saved_chat_message_obj.sender.id,
-                    'sender_username': saved_chat_message_obj.sender.username,
-                    'timestamp': saved_chat_message_obj.timestamp.isoformat(),
-                    'room_name': self.room_name
-                }
-            )
+            await self.broadcast_chat_message(saved_chat_message_obj, self.room_name, self.room_type)
         else:
             await self.send_error_message('Message could not be sent or saved.')
 
+    def build_chat_message(self, message_content):
+        # The booking id was resolved by the room authorization check on connect.
+        return ChatMessage(
+            sender_id=self.user.id, message_content=message_content,
+            booking_id=self.booking_id, room_identifier=self.room_name
+        )
 
-    async def chat_message_broadcast(self, event):
-        # ... (Your chat_message_broadcast method is fine as is)
+    async def save_chat_message_db(self, message_content):
+        # The INSERT and the room summary update share a transaction, which the async
+        # ORM cannot open, so this runs on the sync executor.
+        try:
+            return await run_sync(save_chat_message, self.build_chat_message(message_content))
+        except Exception:
+            logger.exception("Could not save chat message in room '%s'.", self.room_name)
+            return None
+
+    async def check_user_authorization_for_room(self):
+        access = await authorize_room(self.user, self.room_name)
+        self.booking_id = access.booking_id
+        self.participant_ids = access.participant_ids
+        return access.authorized
+
+    async def get_message_history_db(self, before_id=None, limit=HISTORY_PAGE_SIZE):
+        return await fetch_message_history(self.user, self.room_name, before_id, limit)
+
+    async def send_message_history(self):
+        """
+        Sends the newest page of history; returns the highest message id in it, or None.
+        """
+        history, has_more = await self.get_message_history_db()
+        if not history:
+            return None
+        await self.send(text_data=json.dumps({'type': 'message_history', 'messages': history, 'has_more': has_more}))
+        return max(message['id'] for message in history)
+
+    async def send_older_messages(self, before_id):
+        """
+        Answers a `{"type": "load_older", "before_id": <message id>}` frame with the
+        page of messages preceding that message.
+        """
+        if not is_message_id(before_id):
+            await self.send_error_message("load_older requires a message id (a positive 64-bit integer) in 'before_id'.")
+            return
+        history, has_more = await self.get_message_history_db(before_id=before_id)
         await self.send(text_data=json.dumps({
-            'type': 'chat_message', 'id': event['id'], 'message': event['message'],
-            'sender_id': event['sender_id'], 'sender_username': event['sender_username'],
-            'timestamp': event['timestamp'], 'room_name': event.get('room_name'),
-            'is_self': event['sender_id'] == self.user.id
+            'type': 'older_messages', 'before_id': before_id, 'messages': history, 'has_more': has_more,
         }))
 
-    async def send_error_message(self, error_message_text):
-        # ... (Your send_error_message method is fine as is)
-        await self.send(text_data=json.dumps({ 'type': 'error', 'message': error_message_text }))
+    async def acknowledge(self, message_id):
+        """
+        Answers an `{"type": "ack", "message_id": <id>}` frame: the user has read the
+        room up to that message.
+        """
+        if not is_message_id(message_id):
+            await self.send_error_message("ack requires a message id (a positive 64-bit integer) in 'message_id'.")
+            return
+        await self.advance_read_cursor(message_id)
 
-    @database_sync_to_async
-    def save_chat_message_db(self, message_content):
-        # ... (Your save_chat_message_db method is fine as is)
-        booking_instance = None
-        if self.room_name.startswith('booking_'):
-            try:
-                booking_id = int(self.room_name.split('_', 1)[1])
-                booking_instance = Booking.objects.get(id=booking_id)
-            except (IndexError, ValueError, Booking.DoesNotExist, TypeError):
-                booking_instance = None
+    async def advance_read_cursor(self, message_id):
+        # A single upsert, however many messages it marks read.
+        return await run_sync(ChatReadCursor.advance, self.user.id, self.room_name, message_id)
+
+    async def join_presence(self):
+        """
+        Announces the user online, subscribes the socket to the other participants'
+        presence and sends their current state.
+        """
+        self.typing = self.typing_coalescer(self.room_name)
+        await self.start_presence()
+        await self.watch(self.participant_ids)
+
+    async def leave_presence(self):
+        await self.typing.close()
+        if self.presence_joined:
+            await self.stop_presence()
+
+
+class RoomSubscription:
+    """
+    A room a multiplexed socket is subscribed to: what the authorization check
+    resolved, plus the room's typing state.
+    """
+    __slots__ = ('room_name', 'room_type', 'booking_id', 'participant_ids', 'typing')
+
+    def __init__(self, room_name, access, typing):
+        self.room_name = room_name
+        self.room_type = room_type(room_name)
+        self.booking_id = access.booking_id
+        self.participant_ids = access.participant_ids
+        self.typing = typing
+
+
+class MultiplexChatConsumer(ChatSocketConsumer):
+    """
+    One socket per user for all their rooms (ws/chat/). The token is checked once on
+    connect; rooms are then joined and left with frames, each subscription authorized
+    on its own:
+
+        {"type": "subscribe", "room_name": ..., "history": true}
+        {"type": "unsubscribe", "room_name": ...}
+        {"type": "message", "room_name": ..., "message": ...}
+        {"type": "load_older", "room_name": ..., "before_id": ...}
+        {"type": "ack", "room_name": ..., "message_id": ...}
+        {"type": "typing", "room_name": ..., "is_typing": true | false}
+        {"type": "heartbeat", "status": "online" | "away"}
+
+    Every room-related frame sent back carries its `room_name`. "history": false
+    skips the history page on subscribe, e.g. for a client that has it already.
+    """
+    room_type = 'multiplex'
+    ROOM_FRAMES = ('unsubscribe', 'message', 'load_older', 'ack', 'typing')
+
+    async def connect(self):
+        with metrics.WS_CONNECT_LATENCY.time(self.room_type):
+            outcome = await self.open_connection()
+        metrics.WS_CONNECTIONS.inc(self.room_type, outcome)
+
+    async def open_connection(self):
         try:
-            chat_msg = ChatMessage.objects.create(
-                sender=self.user, message_content=message_content,
-                booking=booking_instance, room_identifier=self.room_name
-            )
-            return chat_msg
-        except Exception as e:
-            print(f"SAVE_MSG DB ERROR: {e}")
-            return None
+            self.user = self.scope['user']
+            if not self.user or not self.user.is_authenticated:
+                logger.debug("Rejected unauthenticated multiplexed connection.")
+                await self.close()
+                return 'unauthenticated'
+            self.subscriptions = {}
+            await self.accept()
+            self.counted_as_active = True
+            metrics.WS_ACTIVE_CONNECTIONS.inc(self.room_type)
+            await self.start_presence()
+            return 'accepted'
+        except Exception:
+            logger.exception("Unhandled exception while opening a multiplexed connection.")
+            await self.close()
+            return 'error'
 
-    @database_sync_to_async
-    def check_user_authorization_for_room(self):
-        # ... (Your check_user_authorization_for_room method is fine as is)
-        user_id = self.user.id
-        print(f"AUTH CHECK: User '{self.user.username}' (ID: {user_id}), Room: '{self.room_name}'")
-        if self.room_name.startswith('booking_'):
-            try:
-                booking_id = int(self.room_name.split('_', 1)[1])
-                booking = Booking.objects.get(id=booking_id)
-                is_customer = (user_id == booking.customer_id)
-                is_provider = False
-                if self.user.is_provider and user_id == booking.provider_profile_id:
-                    is_provider = True
-                authorized = is_customer or is_provider
-                print(f"    AUTH CHECK RESULT (Booking Room): Authorized: {authorized}")
-                return authorized
-            except (Booking.DoesNotExist, IndexError, ValueError, TypeError):
-                return False
-        # This pattern looks for "chat_user_" followed by digits, another "_user_", and more digits.
-        match = re.match(r'^chat_user_(\d+)_user_(\d+)$', self.room_name)
-        if match:
+    async def disconnect(self, close_code):
+        for subscription in list(getattr(self, 'subscriptions', {}).values()):
+            await self.leave_room(subscription)
+        if getattr(self, 'presence_joined', False):
+            await self.stop_presence()
+        if getattr(self, 'counted_as_active', False):
+            metrics.WS_ACTIVE_CONNECTIONS.dec(self.room_type)
+        await self.release_connections()
+        logger.debug("Multiplexed socket closed (code %s).", close_code)
+
+    async def receive(self, text_data):
+        with metrics.WS_RECEIVE_LATENCY.time(self.room_type):
+            await self.handle_frame(text_data)
+
+    async def handle_frame(self, text_data):
+        try:
+            frame = json.loads(text_data)
+        except json.JSONDecodeError:
+            frame = None
+        if not isinstance(frame, dict):
+            await self.send_error_message("Invalid message format.")
+            return
+        frame_type = frame.get('type')
+        room_name = frame.get('room_name')
+        if frame_type == 'heartbeat':
+            await self.heartbeat(frame.get('status'))
+            return
+        if frame_type == 'subscribe':
+            await self.subscribe(room_name, frame.get('history', True))
+            return
+        if frame_type not in self.ROOM_FRAMES:
+            await self.send_error_message(f"Unknown frame type {frame_type!r}.")
+            return
+        subscription = self.subscriptions.get(room_name) if isinstance(room_name, str) else None
+        if subscription is None:
+            await self.send_error_message(f"{frame_type} requires a subscribed 'room_name'.", room_name)
+            return
+        if frame_type == 'unsubscribe':
+            await self.leave_room(subscription)
+            await self.send(text_data=json.dumps({'type': 'unsubscribed', 'room_name': room_name}))
+        elif frame_type == 'message':
+            await self.send_chat_message(subscription, frame.get('message'))
+        elif frame_type == 'load_older':
+            await self.send_older_messages(subscription, frame.get('before_id'))
+        elif frame_type == 'ack':
+            if not is_message_id(frame.get('message_id')):
+                await self.send_error_message("ack requires a message id (a positive 64-bit integer) in 'message_id'.", room_name)
+                return
+            await self.advance_read_cursor(subscription, frame['message_id'])
+        else:
+            await self.update_typing(subscription.typing, frame.get('is_typing', True), room_name)
+
+    async def subscribe(self, room_name, history):
+        """
+        Authorizes the user for the room, joins its group, confirms with a "subscribed"
+        frame and sends the newest page of history (which then counts as read).
+        """
+        if not isinstance(room_name, str) or not ROOM_NAME_RE.match(room_name):
+            await self.send_error_message("subscribe requires a valid 'room_name'.")
+            return
+        if room_name in self.subscriptions:
+            await self.send(text_data=json.dumps({'type': 'subscribed', 'room_name': room_name}))
+            return
+        if len(self.subscriptions) >= MAX_SUBSCRIPTIONS:
+            metrics.WS_SUBSCRIPTIONS.inc(room_type(room_name), 'limit')
+            await self.send_error_message(f"At most {MAX_SUBSCRIPTIONS} rooms per socket.", room_name)
+            return
+        access = await authorize_room(self.user, room_name)
+        if not access.authorized:
+            logger.info("User '%s' is not authorized for room '%s'.", self.user.username, room_name)
+            metrics.WS_SUBSCRIPTIONS.inc(room_type(room_name), 'forbidden')
+            await self.send_error_message("Not authorized for this room.", room_name)
+            return
+        subscription = RoomSubscription(room_name, access, self.typing_coalescer(room_name))
+        self.subscriptions[room_name] = subscription
+        await self.channel_layer.group_add(room_group(room_name), self.channel_name)
+        metrics.WS_SUBSCRIPTIONS.inc(subscription.room_type, 'accepted')
+        metrics.WS_ACTIVE_SUBSCRIPTIONS.inc(subscription.room_type)
+        await self.send(text_data=json.dumps({'type': 'subscribed', 'room_name': room_name}))
+        if history is not False:
+            history_data, has_more = await fetch_message_history(self.user, room_name)
+            if history_data:
+                await self.send(text_data=json.dumps({
+                    'type': 'message_history', 'room_name': room_name,
+                    'messages': history_data, 'has_more': has_more,
+                }))
+                await self.advance_read_cursor(subscription, max(message['id'] for message in history_data))
+        await self.watch(subscription.participant_ids)
+
+    async def leave_room(self, subscription):
+        del self.subscriptions[subscription.room_name]
+        await subscription.typing.close()
+        await self.channel_layer.group_discard(room_group(subscription.room_name), self.channel_name)
+        await self.unwatch(subscription.participant_ids)
+        metrics.WS_ACTIVE_SUBSCRIPTIONS.dec(subscription.room_type)
+
+    async def send_chat_message(self, subscription, message_content):
+        if not isinstance(message_content, str) or not message_content.strip():
+            return
+        chat_message = ChatMessage(
+            sender_id=self.user.id, message_content=message_content,
+            booking_id=subscription.booking_id, room_identifier=subscription.room_name,
+        )
+        if write_behind_enabled():
+            saved_chat_message_obj = await get_chat_message_writer().enqueue(chat_message)
+        else:
             try:
-                # The matched groups (the digits) are extracted.
-                user_id1 = int(match.group(1))
-                user_id2 = int(match.group(2))
-                
-                is_participant = user_id == user_id1 or user_id == user_id2
-                print(f"AUTH CHECK (User Chat): Matched pattern. Participant? {is_participant} (Room User IDs: {user_id1}, {user_id2})")
-                return is_participant
-            except (IndexError, ValueError):
-                # This would only happen if the regex was wrong, but it's a good safeguard.
-                print(f"AUTH CHECK FAILED (User Chat): Could not parse IDs from matched pattern.")
-                return False
-        # === END OF NEW CHECK ===
-        
-        print(f"AUTH CHECK: Unknown or unhandled room type for '{self.room_name}'. Denying access by default.")
-        return False
-
-    @database_sync_to_async
-    def get_message_history_db(self, limit=50):
-        # ... (Your get_message_history_db method is fine as is)
-        messages = ChatMessage.objects.filter(
-            room_identifier=self.room_name
-        ).select_related('sender').order_by('-timestamp')[:limit]
-        history_data = list(reversed([{'id': m.id, 'type': 'chat_message', 'sender_id': m.sender.id,
-            'sender_username': m.sender.username, 'message': m.message_content,
-            'timestamp': m.timestamp.isoformat(), 'is_self': m.sender.id == self.user.id,
-            'room_name': m.room_identifier} for m in messages]))
-        return history_data
+                saved_chat_message_obj = await run_sync(save_chat_message, chat_message)
+            except Exception:
+                logger.exception("Could not save chat message in room '%s'.", subscription.room_name)
+                saved_chat_message_obj = None
+        if saved_chat_message_obj:
+            await self.broadcast_chat_message(saved_chat_message_obj, subscription.room_name, subscription.room_type)
+        else:
+            await self.send_error_message('Message could not be sent or saved.', subscription.room_name)
 
-    async def send_message_history(self):
-        # ... (Your send_message_history method is fine as is)
-        history = await self.get_message_history_db()
-        if history:
-            await self.send(text_data=json.dumps({'type': 'message_history', 'messages': history}))
-
-    @database_sync_to_async
-    def mark_messages_as_read_for_user(self):
-        # ... (Your mark_messages_as_read_for_user method is fine as is)
-        if self.user and self.user.is_authenticated:
-            ChatMessage.objects.filter(
-                room_identifier=self.room_name, is_read=False
-            ).exclude(sender=self.user).update(is_read=True)
\ No newline at end of file
+    async def send_older_messages(self, subscription, before_id):
+        if not is_message_id(before_id):
+            await self.send_error_message(
+                "load_older requires a message id (a positive 64-bit integer) in 'before_id'.", subscription.room_name,
+            )
+            return
+        history, has_more = await fetch_message_history(self.user, subscription.room_name, before_id=before_id)
+        await self.send(text_data=json.dumps({
+            'type': 'older_messages', 'room_name': subscription.room_name, 'before_id': before_id,
+            'messages': history, 'has_more': has_more,
+        }))
+
+    async def advance_read_cursor(self, subscription, message_id):
+        return await run_sync(ChatReadCursor.advance, self.user.id, subscription.room_name, message_id)
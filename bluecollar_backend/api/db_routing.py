@@ -0,0 +1,135 @@
+# File: api/db_routing.py
+
+import logging
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = DEFAULT_DB_ALIAS
+
+# Seconds behind the primary; 0 when the replica has replayed everything it received
+# (an idle primary would otherwise look like growing lag).
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class RoutingState:
+    """
+    Where the reads of the current request (or `primary()` block) go. `replica` is
+    None for the primary; `wrote` is set by the first write, after which reads stay
+    on the primary as well.
+    """
+    __slots__ = ("replica", "wrote")
+
+    def __init__(self, replica=None):
+        self.replica = replica
+        self.wrote = False
+
+
+# Unset outside requests: management commands, sockets and signals use the primary.
+_state = ContextVar("db_routing_state", default=None)
+
+
+def replica_aliases():
+    return [alias for alias in connections if alias != PRIMARY]
+
+
+def choose_replica():
+    replicas = replica_aliases()
+    return random.choice(replicas) if replicas else None
+
+
+def begin(replica=None):
+    """
+    Starts routing for a request; returns the token for `end()`.
+    """
+    state = RoutingState(replica)
+    return state, _state.set(state)
+
+
+def end(token):
+    _state.reset(token)
+
+
+def current_state():
+    return _state.get()
+
+
+@contextmanager
+def primary():
+    """
+    Runs the block's reads against the primary. Used for reads whose results are
+    cached under a freshly bumped version: a lagging replica would store stale data
+    there until the entry expires.
+    """
+    state, token = begin()
+    try:
+        yield state
+    finally:
+        end(token)
+
+
+# --- Read-your-writes pins ---
+
+def _pin_key(user_id):
+    return f"db_pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    cache.set(_pin_key(user_id), 1, settings.DB_REPLICA["PIN_SECONDS"])
+
+
+def is_pinned(user_id):
+    return cache.get(_pin_key(user_id)) is not None
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes go to the primary. Reads go to the replica chosen for the current request
+    (see ReplicaRoutingMiddleware), and to the primary everywhere else. All aliases
+    hold the same data, so relations between them are allowed; only the primary is
+    migrated.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None or state.wrote:
+            return PRIMARY
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+def replica_lag_seconds():
+    """
+    {(alias,): seconds} for every replica that answers.
+    """
+    lag = {}
+    for alias in replica_aliases():
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag[(alias,)] = float(cursor.fetchone()[0])
+        except DatabaseError as e:
+            logger.warning("Could not read the lag of replica '%s': %s", alias, e)
+    return lag
@@ -0,0 +1,187 @@
+# File: api/fieldsets.py
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+
+
+def _split(value):
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+class Fieldset:
+    """
+    The response fields picked by `?fields=` and `?expand=`.
+
+    `fields` lists the top-level fields to return (all when absent). `expand` lists
+    which nested relations (the serializer's `expandable_fields`) are embedded; when
+    it is absent every nested relation is embedded, as before these parameters
+    existed, and `?expand=` with no value embeds none of them.
+    """
+
+    def __init__(self, available, expandable, fields=None, expand=None):
+        self.available = available
+        self.expandable = expandable
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request, serializer_class):
+        available = readable_field_names(serializer_class)
+        expandable = frozenset(getattr(serializer_class, "expandable_fields", ()))
+        params = request.query_params
+        fields = frozenset(_split(params["fields"])) if "fields" in params else None
+        expand = frozenset(_split(params["expand"])) if "expand" in params else None
+        errors = {}
+        if fields is not None and fields - set(available):
+            errors["fields"] = f"Unknown field(s): {', '.join(sorted(fields - set(available)))}."
+        if expand is not None and expand - expandable:
+            errors["expand"] = (
+                f"Cannot expand: {', '.join(sorted(expand - expandable))}. "
+                f"Expandable: {', '.join(sorted(expandable))}."
+            )
+        if errors:
+            raise ValidationError(errors)
+        return cls(available, expandable, fields, expand)
+
+    @property
+    def is_default(self):
+        return self.fields is None and self.expand is None
+
+    def includes(self, name):
+        if self.fields is not None and name not in self.fields:
+            return False
+        if self.expand is not None and name in self.expandable and name not in self.expand:
+            return False
+        return True
+
+    def includes_any(self, names):
+        return any(self.includes(name) for name in names)
+
+    @property
+    def field_names(self):
+        return [name for name in self.available if self.includes(name)]
+
+    def cache_key(self):
+        """
+        Identifies the selection in cache keys ("" for the default representation).
+        """
+        if self.is_default:
+            return ""
+        return "fields=" + ",".join(self.field_names)
+
+
+_readable_fields = {}
+
+
+def readable_field_names(serializer_class):
+    # Field names in declaration order, without write-only fields; built once per class.
+    if serializer_class not in _readable_fields:
+        _readable_fields[serializer_class] = [
+            name for name, field in serializer_class().fields.items() if not field.write_only
+        ]
+    return _readable_fields[serializer_class]
+
+
+def nested_columns(lookup, serializer_class):
+    """
+    The `.only()` paths for a relation loaded with select_related and shown through
+    `serializer_class`, e.g. nested_columns("customer", BasicUserSerializer).
+    """
+    return [f"{lookup}__{name}" for name in readable_field_names(serializer_class)]
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    Drops the fields not selected by the `fieldset` in the serializer context (see
+    SparseFieldsetViewMixin). Without a fieldset the serializer is unchanged.
+    """
+    # Nested relations controlled by ?expand=.
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fieldset = self.context.get("fieldset")
+        if fieldset is not None and not fieldset.is_default:
+            for name in list(self.fields):
+                if not self.fields[name].write_only and not fieldset.includes(name):
+                    self.fields.pop(name)
+
+
+class SparseFieldsetViewMixin:
+    """
+    Parses ?fields= / ?expand= for the view's serializer and shapes the queryset to
+    match, so data the response leaves out is not fetched either:
+
+    - `fieldset_select_related` / `fieldset_prefetch_related` map a response field to
+      the lookups it needs; lookups of fields left out are not applied. Prefetch
+      lookups may be given as callables returning a Prefetch.
+    - The SELECT is limited with `.only()`: concrete model fields named like a
+      response field are kept, plus the columns listed in `fieldset_columns` for the
+      other fields, `fieldset_required_columns` and the keyset ordering columns.
+      Relations loaded with select_related must list the columns they show there
+      (e.g. "customer__username", see nested_columns()); otherwise every column of
+      the related row is read, a user's password hash included.
+    """
+    fieldset_select_related = {}
+    fieldset_prefetch_related = {}
+    fieldset_columns = {}
+    fieldset_required_columns = ()
+    # The serializer the fieldset applies to, when it is not the view's own.
+    fieldset_serializer_class = None
+
+    def get_fieldset(self):
+        if not hasattr(self, "_fieldset"):
+            serializer_class = self.fieldset_serializer_class or self.get_serializer_class()
+            self._fieldset = Fieldset.from_request(self.request, serializer_class)
+        return self._fieldset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["fieldset"] = self.get_fieldset()
+        return context
+
+    def apply_fieldset(self, queryset):
+        fieldset = self.get_fieldset()
+        select_related = [
+            lookup
+            for name, lookups in self.fieldset_select_related.items() if fieldset.includes(name)
+            for lookup in lookups
+        ]
+        prefetch_related = [
+            lookup() if callable(lookup) else lookup
+            for name, lookups in self.fieldset_prefetch_related.items() if fieldset.includes(name)
+            for lookup in lookups
+        ]
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset.only(*self.get_fieldset_columns(queryset.model, fieldset))
+
+    def get_fieldset_columns(self, model, fieldset):
+        columns = list(self.fieldset_required_columns)
+        if hasattr(self, "get_keyset_ordering"):
+            # The keyset paginator reads the ordering values from the last row.
+            columns.extend(key.lstrip("-") for key in self.get_keyset_ordering())
+        for name in fieldset.field_names:
+            if name in self.fieldset_columns:
+                columns.extend(self.fieldset_columns[name])
+                continue
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete and not field.many_to_many:
+                columns.append(name)
+        return [column for column in dict.fromkeys(columns) if self._is_model_path(model, column)]
+
+    @staticmethod
+    def _is_model_path(model, path):
+        # Drops annotations (e.g. a search rank in the ordering) from the .only() list.
+        for part in path.split("__"):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return False
+            model = field.related_model
+        return True
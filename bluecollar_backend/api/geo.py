@@ -0,0 +1,149 @@
+# File: api/geo.py
+
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+# Precision of the stored geohash (cells of about 4.8 m x 4.8 m). Searches use a prefix
+# of it sized to the search radius.
+GEOHASH_PRECISION = 9
+MAX_SEARCH_RADIUS_KM = 500
+DEFAULT_SEARCH_RADIUS_KM = 25
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_KM_PER_DEGREE_LAT = 110.574
+_KM_PER_DEGREE_LNG_AT_EQUATOR = 111.320
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    Standard geohash of a point: interleaved longitude/latitude bisection bits,
+    five per base32 character.
+    """
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, value = (lng_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def cell_size_degrees(precision):
+    """
+    (latitude span, longitude span) of a geohash cell of `precision` characters.
+    """
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def search_precision(latitude, radius_km):
+    """
+    The longest geohash prefix whose cells are at least `radius_km` tall and wide at
+    this latitude, so the cell holding the point plus its eight neighbours cover
+    every point within the radius.
+    """
+    # Cells are narrowest (in km) at the covered latitude farthest from the equator.
+    farthest_latitude = min(abs(latitude) + radius_km / _KM_PER_DEGREE_LAT, 90.0)
+    lng_scale = _KM_PER_DEGREE_LNG_AT_EQUATOR * max(math.cos(math.radians(farthest_latitude)), 1e-6)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_span, lng_span = cell_size_degrees(precision)
+        if lat_span * _KM_PER_DEGREE_LAT >= radius_km and lng_span * lng_scale >= radius_km:
+            return precision
+    return 0
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    Geohash prefixes (at most nine) whose cells together contain every point within
+    `radius_km` of the given point. An empty list means "no usable prefix" (the
+    radius is larger than a top-level cell), i.e. scan without the cell filter.
+    """
+    precision = search_precision(latitude, radius_km)
+    if precision == 0:
+        return []
+    lat_span, lng_span = cell_size_degrees(precision)
+    cells = set()
+    for d_lat in (-lat_span, 0.0, lat_span):
+        for d_lng in (-lng_span, 0.0, lng_span):
+            lat = min(max(latitude + d_lat, -90.0), 90.0 - 1e-9)
+            lng = (longitude + d_lng + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(lat, lng, precision))
+    return sorted(cells)
+
+
+def distance_km_expression(latitude, longitude, lat_field="service_latitude", lng_field="service_longitude"):
+    """
+    Great-circle (haversine) distance in km from the given point to the row's point,
+    computed in SQL.
+    """
+    lat0 = Value(math.radians(latitude), output_field=FloatField())
+    lng0 = Value(math.radians(longitude), output_field=FloatField())
+    lat = Radians(F(lat_field))
+    lng = Radians(F(lng_field))
+    half_chord = (
+        Power(Sin((lat - lat0) / 2), 2)
+        + Cos(lat0) * Cos(lat) * Power(Sin((lng - lng0) / 2), 2)
+    )
+    # Least() guards ASIN against rounding just above 1 for antipodal points.
+    return Value(2 * EARTH_RADIUS_KM, output_field=FloatField()) * ASin(
+        Sqrt(Least(half_chord, Value(1.0, output_field=FloatField())))
+    )
+
+
+def providers_near(queryset, latitude, longitude, radius_km):
+    """
+    Providers within `radius_km` of the point whose own service radius also reaches
+    it, annotated with `distance_km`. Candidates are found through the geohash prefix
+    index; the exact distance check only runs on those.
+    """
+    cells = covering_cells(latitude, longitude, radius_km)
+    if cells:
+        in_cells = Q()
+        for cell in cells:
+            in_cells |= Q(service_geohash__startswith=cell)
+        queryset = queryset.filter(in_cells)
+    else:
+        queryset = queryset.exclude(service_geohash="")
+    return queryset.annotate(
+        distance_km=distance_km_expression(latitude, longitude)
+    ).filter(distance_km__lte=radius_km).filter(distance_km__lte=F("service_radius_km"))
+
+
+def parse_near(value, radius=None):
+    """
+    Parses `?near=lat,lng` and `?radius=` (km). Returns (lat, lng, radius_km) or raises
+    ValueError with a message for the client.
+    """
+    try:
+        lat_text, lng_text = value.split(",")
+        latitude, longitude = float(lat_text), float(lng_text)
+    except ValueError:
+        raise ValueError("Expected 'near=<latitude>,<longitude>'.")
+    if not (math.isfinite(latitude) and math.isfinite(longitude)
+            and -90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("Latitude must be within [-90, 90] and longitude within [-180, 180].")
+    if radius in (None, ""):
+        radius_km = DEFAULT_SEARCH_RADIUS_KM
+    else:
+        try:
+            radius_km = float(radius)
+        except ValueError:
+            raise ValueError("'radius' must be a number of kilometres.")
+        if not 0 < radius_km <= MAX_SEARCH_RADIUS_KM:
+            raise ValueError(f"'radius' must be between 0 and {MAX_SEARCH_RADIUS_KM} km.")
+    return latitude, longitude, radius_km
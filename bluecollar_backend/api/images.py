@@ -0,0 +1,175 @@
+# File: api/images.py
+
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connections
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Target widths per image field. Derivatives are never wider than the source.
+DEFAULT_WIDTHS = {
+    ("api.ServiceProviderProfile", "profile_picture"): (64, 128, 256),
+    ("api.ServiceCategory", "category_image"): (320, 640, 1280),
+}
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+DERIVATIVES_DIR = "derivatives"
+
+
+def _options():
+    return getattr(settings, "IMAGE_DERIVATIVES", {})
+
+
+def derivative_widths(model_label, field_name):
+    configured = _options().get("WIDTHS", {})
+    return tuple(configured.get(f"{model_label}.{field_name}", DEFAULT_WIDTHS[(model_label, field_name)]))
+
+
+def variants_field_name(field_name):
+    return f"{field_name}_variants"
+
+
+def hash_source(field_file):
+    digest = hashlib.sha256()
+    with field_file.open("rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_derivatives(field_file, source_hash, widths, quality):
+    """
+    Writes one WebP and one JPEG per width and returns the variants document:
+    {"source": <sha256>, "sizes": {"<width>": {"width", "height", "webp", "jpeg"}}}.
+
+    File names are derived from the source hash and the width, so the same upload
+    always maps to the same files and an unchanged source is never rewritten.
+    """
+    with field_file.open("rb") as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    sizes = {}
+    for width in sorted(set(min(width, image.width) for width in widths)):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+        entry = {"width": width, "height": height}
+        for extension, pil_format in FORMATS.items():
+            name = f"{DERIVATIVES_DIR}/{source_hash[:2]}/{source_hash}-{width}.{extension}"
+            if not default_storage.exists(name):
+                frame = resized.convert("RGB") if pil_format == "JPEG" else resized
+                buffer = io.BytesIO()
+                frame.save(buffer, pil_format, quality=quality, optimize=pil_format == "JPEG")
+                name = default_storage.save(name, ContentFile(buffer.getvalue()))
+            entry[extension] = name
+        sizes[str(width)] = entry
+    return {"source": source_hash, "sizes": sizes}
+
+
+def generate_derivatives(model_label, pk, field_name, force=False):
+    """
+    Brings the derivatives of one image field up to date. Returns True when the
+    variants were (re)written, False when the source was unchanged or is gone.
+    """
+    model = apps.get_model(model_label)
+    variants_field = variants_field_name(field_name)
+    row = model.objects.filter(pk=pk).only(field_name, variants_field).first()
+    if row is None:
+        return False
+    field_file = getattr(row, field_name)
+    current = getattr(row, variants_field) or {}
+    if not field_file:
+        if not current:
+            return False
+        variants = {}
+    else:
+        source_hash = hash_source(field_file)
+        if not force and current.get("source") == source_hash:
+            return False
+        variants = render_derivatives(
+            field_file, source_hash, derivative_widths(model_label, field_name), _options().get("QUALITY", 80)
+        )
+    # Only store the result if the field still points at the file we processed; a newer
+    # upload has its own job queued.
+    if field_file:
+        same_source = Q(**{field_name: field_file.name})
+    else:
+        same_source = Q(**{field_name: ""}) | Q(**{f"{field_name}__isnull": True})
+    updated = model.objects.filter(same_source, pk=pk).update(**{variants_field: variants})
+    if updated:
+        _invalidate_cached_documents(model_label, pk)
+    return bool(updated)
+
+
+def _invalidate_cached_documents(model_label, pk):
+    # update() sends no signals, so drop the cached responses embedding the image.
+    from .response_cache import invalidate_category_list, invalidate_provider_details
+
+    if model_label == "api.ServiceCategory":
+        invalidate_category_list()
+    else:
+        invalidate_provider_details([pk])
+
+
+# --- Worker pool ---
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_options().get("WORKERS", 2), thread_name_prefix="image-derivatives"
+            )
+    return _executor
+
+
+def _run_job(model_label, pk, field_name):
+    close_old_connections()
+    try:
+        generate_derivatives(model_label, pk, field_name)
+    except Exception:
+        logger.exception("Could not generate %s derivatives for %s %s.", field_name, model_label, pk)
+    finally:
+        connections.close_all()
+
+
+def schedule_derivatives(model_label, pk, field_name):
+    """
+    Queues derivative generation on the worker pool, off the request path. Call
+    after commit so the worker sees the new file name.
+    """
+    return get_executor().submit(_run_job, model_label, pk, field_name)
+
+
+def srcset_map(request, variants):
+    """
+    {"webp": "<url> 64w, <url> 128w", "jpeg": ...} for a variants document; empty
+    until the derivatives exist.
+    """
+    sizes = sorted((variants or {}).get("sizes", {}).values(), key=lambda entry: entry["width"])
+    result = {}
+    for extension in FORMATS:
+        urls = []
+        for entry in sizes:
+            url = default_storage.url(entry[extension])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls.append(f"{url} {entry['width']}w")
+        if urls:
+            result[extension] = ", ".join(urls)
+    return result
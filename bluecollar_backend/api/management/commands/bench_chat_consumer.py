@@ -0,0 +1,164 @@
+# File: api/management/commands/bench_chat_consumer.py
+
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.db.models import Q, Subquery
+from django.urls import re_path
+from django.utils import timezone
+
+from api.chat_persistence import save_chat_message
+from api.chat_rooms import room_access_cache
+from api.consumers import HISTORY_PAGE_SIZE, ChatConsumer
+from api.models import Booking, ChatMessage, ChatReadCursor, ServiceProviderProfile, User
+
+BENCH_PREFIX = "bench_chat_"
+
+
+class DatabaseSyncToAsyncChatConsumer(ChatConsumer):
+    """
+    The consumer's database access as it was before the async ORM: every touch wrapped
+    in database_sync_to_async, i.e. a hop to the thread-sensitive thread with
+    connection cleanup before and after.
+    """
+
+    async def check_user_authorization_for_room(self):
+        access = room_access_cache.get_local(self.user.id, self.room_name)
+        if access is None:
+            access = await database_sync_to_async(room_access_cache.get)(self.user, self.room_name)
+        self.booking_id = access.booking_id
+        self.participant_ids = access.participant_ids
+        return access.authorized
+
+    @database_sync_to_async
+    def save_chat_message_db(self, message_content):
+        return save_chat_message(self.build_chat_message(message_content))
+
+    @database_sync_to_async
+    def advance_read_cursor(self, message_id):
+        return ChatReadCursor.advance(self.user.id, self.room_name, message_id)
+
+    @database_sync_to_async
+    def get_message_history_db(self, before_id=None, limit=HISTORY_PAGE_SIZE):
+        messages = ChatMessage.objects.filter(room_identifier=self.room_name)
+        if before_id is not None:
+            anchor = Subquery(
+                ChatMessage.objects.filter(pk=before_id, room_identifier=self.room_name).values('timestamp')
+            )
+            messages = messages.filter(Q(timestamp__lt=anchor) | Q(timestamp=anchor, id__lt=before_id), timestamp__lte=anchor)
+        rows = list(messages.order_by('-timestamp', '-id').values(
+            'id', 'sender_id', 'message_content', 'timestamp', 'room_identifier'
+        )[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not hasattr(self, 'sender_usernames'):
+            self.sender_usernames = {self.user.id: self.user.username}
+        missing = {row['sender_id'] for row in rows} - self.sender_usernames.keys()
+        if missing:
+            self.sender_usernames.update(User.objects.filter(pk__in=missing).values_list('id', 'username'))
+        history = [{'id': row['id'], 'type': 'chat_message', 'sender_id': row['sender_id'],
+            'sender_username': self.sender_usernames.get(row['sender_id']), 'message': row['message_content'],
+            'timestamp': row['timestamp'].isoformat(), 'is_self': row['sender_id'] == self.user.id,
+            'room_name': row['room_identifier']} for row in reversed(rows)]
+        return history, has_more
+
+
+IMPLEMENTATIONS = {
+    "database_sync_to_async": DatabaseSyncToAsyncChatConsumer,
+    "async_orm": ChatConsumer,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares connects/s and messages/s of the chat consumer on the async ORM with the "
+        "previous database_sync_to_async implementation, in-process over the configured "
+        "channel layer. Creates throwaway users, bookings and messages and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=50, help="Booking rooms (one socket per room in the message phase).")
+        parser.add_argument("--connects", type=int, default=1000, help="Socket connects in the connect phase.")
+        parser.add_argument("--messages", type=int, default=20, help="Messages sent per socket in the message phase.")
+        parser.add_argument("--concurrency", type=int, default=50, help="Sockets connecting at the same time.")
+        parser.add_argument("--history", type=int, default=20, help="Messages seeded per room.")
+        parser.add_argument("--implementation", choices=list(IMPLEMENTATIONS), action="append", dest="implementations")
+
+    def handle(self, *args, **options):
+        customer, rooms = self._seed(options["rooms"], options["history"])
+        try:
+            for name in options["implementations"] or list(IMPLEMENTATIONS):
+                for room in rooms:
+                    room_access_cache.invalidate_room(room)
+                connects, messages = asyncio.run(self._run(IMPLEMENTATIONS[name], customer, rooms, options))
+                self.stdout.write(f"{name:<24}{connects:>10.0f} connects/s{messages:>12.0f} messages/s")
+        finally:
+            User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    def _seed(self, room_count, history):
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        customer = User.objects.create(username=f"{BENCH_PREFIX}customer")
+        provider = User.objects.create(username=f"{BENCH_PREFIX}provider", is_provider=True)
+        profile = ServiceProviderProfile.objects.create(user=provider, status="APPROVED")
+        start = timezone.now() + timedelta(days=1)
+        bookings = [
+            Booking.objects.create(
+                customer=customer, provider_profile=profile, service_description="bench",
+                booking_datetime=start + timedelta(hours=2 * i), address_for_service="bench",
+            )
+            for i in range(room_count)
+        ]
+        ChatMessage.objects.bulk_create([
+            ChatMessage(
+                booking=booking, sender=provider if i % 2 else customer,
+                message_content=f"history {i}", room_identifier=f"booking_{booking.pk}",
+            )
+            for booking in bookings for i in range(history)
+        ])
+        return customer, [f"booking_{booking.pk}" for booking in bookings]
+
+    async def _run(self, consumer_class, customer, rooms, options):
+        application = URLRouter([re_path(r"^ws/chat/(?P<room_name>[^/]+)/$", consumer_class.as_asgi())])
+
+        async def open_socket(room):
+            communicator = WebsocketCommunicator(application, f"/ws/chat/{room}/")
+            communicator.scope["user"] = customer
+            connected, _ = await communicator.connect(timeout=30)
+            assert connected, f"connect to {room} refused"
+            if options["history"]:
+                await communicator.receive_from(timeout=30)  # message_history
+            return communicator
+
+        # Connect phase: accept + history + read cursor, `concurrency` sockets at a time.
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        opened = []
+
+        async def connect_one(i):
+            async with semaphore:
+                opened.append(await open_socket(rooms[i % len(rooms)]))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connect_one(i) for i in range(options["connects"])))
+        connects_per_second = options["connects"] / (time.perf_counter() - started)
+        await asyncio.gather(*(communicator.disconnect() for communicator in opened))
+
+        # Message phase: one socket per room, each sending and awaiting its own echo.
+        sockets = await asyncio.gather(*(open_socket(room) for room in rooms))
+
+        async def chat(communicator):
+            for i in range(options["messages"]):
+                await communicator.send_to(text_data=json.dumps({"message": f"bench {i}"}))
+                while json.loads(await communicator.receive_from(timeout=30))["type"] != "chat_message":
+                    pass
+
+        started = time.perf_counter()
+        await asyncio.gather(*(chat(communicator) for communicator in sockets))
+        messages_per_second = len(sockets) * options["messages"] / (time.perf_counter() - started)
+        await asyncio.gather(*(communicator.disconnect() for communicator in sockets))
+        return connects_per_second, messages_per_second
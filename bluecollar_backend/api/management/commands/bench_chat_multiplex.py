@@ -0,0 +1,136 @@
+# File: api/management/commands/bench_chat_multiplex.py
+
+import asyncio
+import gc
+import json
+import time
+import tracemalloc
+from datetime import timedelta
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.chat_rooms import room_access_cache
+from api.middleware import TokenAuthMiddlewareStack
+from api.models import Booking, ChatMessage, ServiceProviderProfile, User
+from api.routing import websocket_urlpatterns
+
+BENCH_PREFIX = "bench_multiplex_"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares a provider watching --rooms bookings over one socket per room with the "
+        "same provider on a single multiplexed socket (ws/chat/): sockets opened, time to "
+        "be in every room with its history, and Python memory held while connected. Runs "
+        "in-process through TokenAuthMiddleware and the real routes. Creates throwaway "
+        "users, bookings and messages and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=30, help="Bookings (rooms) the provider watches.")
+        parser.add_argument("--history", type=int, default=50, help="Messages seeded per room.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per mode; the best time is reported.")
+
+    def handle(self, *args, **options):
+        provider, rooms = self._seed(options["rooms"], options["history"])
+        self.application = TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        self.token = str(AccessToken.for_user(provider))
+        try:
+            for label, run in (("one socket per room", self._per_room), ("multiplexed", self._multiplexed)):
+                results = [asyncio.run(self._measure(run, rooms, options["history"] > 0)) for _ in range(options["repeat"])]
+                sockets = results[0][0]
+                seconds = min(result[1] for result in results)
+                memory = min(result[2] for result in results)
+                self.stdout.write(f"{label:<22}{sockets:>5} sockets{seconds * 1000:>10.1f} ms{memory / 1024:>10.0f} KiB held")
+        finally:
+            User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    def _seed(self, room_count, history):
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        provider = User.objects.create(username=f"{BENCH_PREFIX}provider", is_provider=True)
+        profile = ServiceProviderProfile.objects.create(user=provider, status="APPROVED")
+        start = timezone.now() + timedelta(days=1)
+        bookings = []
+        for i in range(room_count):
+            customer = User.objects.create(username=f"{BENCH_PREFIX}customer_{i}")
+            bookings.append(Booking.objects.create(
+                customer=customer, provider_profile=profile, service_description="bench",
+                booking_datetime=start + timedelta(hours=2 * i), address_for_service="bench",
+            ))
+        ChatMessage.objects.bulk_create([
+            ChatMessage(
+                booking=booking, sender=provider if i % 2 else booking.customer,
+                message_content=f"history {i}", room_identifier=f"booking_{booking.pk}",
+            )
+            for booking in bookings for i in range(history)
+        ])
+        return provider, [f"booking_{booking.pk}" for booking in bookings]
+
+    async def _measure(self, run, rooms, with_history):
+        for room in rooms:
+            room_access_cache.invalidate_room(room)
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        sockets = await run(rooms, with_history)
+        elapsed = time.perf_counter() - started
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        await self._check_delivery(sockets, rooms)
+        await asyncio.gather(*(communicator.disconnect() for communicator in sockets))
+        return len(sockets), elapsed, held
+
+    def _communicator(self, path):
+        return WebsocketCommunicator(self.application, f"{path}?token={self.token}")
+
+    async def _per_room(self, rooms, with_history):
+        async def open_socket(room):
+            communicator = self._communicator(f"/ws/chat/{room}/")
+            connected, _ = await communicator.connect(timeout=30)
+            if not connected:
+                raise CommandError(f"Connect to {room} refused.")
+            await self._receive_until(communicator, "presence" if not with_history else "message_history")
+            return communicator
+
+        return await asyncio.gather(*(open_socket(room) for room in rooms))
+
+    async def _multiplexed(self, rooms, with_history):
+        communicator = self._communicator("/ws/chat/")
+        connected, _ = await communicator.connect(timeout=30)
+        if not connected:
+            raise CommandError("Multiplexed connect refused.")
+        for room in rooms:
+            await communicator.send_to(text_data=json.dumps({"type": "subscribe", "room_name": room}))
+        pending = set(rooms)
+        expected = "message_history" if with_history else "subscribed"
+        while pending:
+            frame = json.loads(await communicator.receive_from(timeout=30))
+            if frame["type"] == "error":
+                raise CommandError(f"Subscribe failed: {frame}")
+            if frame["type"] == expected:
+                pending.discard(frame["room_name"])
+        return [communicator]
+
+    async def _check_delivery(self, sockets, rooms):
+        # A message sent on the first room must come back tagged with that room.
+        communicator = sockets[0]
+        if len(sockets) == 1:
+            payload = {"type": "message", "room_name": rooms[0], "message": "bench delivery"}
+        else:
+            payload = {"message": "bench delivery"}
+        await communicator.send_to(text_data=json.dumps(payload))
+        frame = await self._receive_until(communicator, "chat_message")
+        if frame["room_name"] != rooms[0] or not frame["is_self"]:
+            raise CommandError(f"Unexpected delivery: {frame}")
+
+    async def _receive_until(self, communicator, frame_type):
+        while True:
+            frame = json.loads(await communicator.receive_from(timeout=30))
+            if frame["type"] == frame_type:
+                return frame
@@ -0,0 +1,166 @@
+# File: api/management/commands/bench_provider_geo.py
+
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.geo import distance_km_expression, encode_geohash, providers_near
+from api.models import ServiceCategory, ServiceProviderProfile, User
+
+# Metro areas the seeded providers cluster around (lat, lng), plus a uniform background.
+METROS = {
+    "new-york": (40.7128, -74.0060),
+    "chicago": (41.8781, -87.6298),
+    "houston": (29.7604, -95.3698),
+    "denver": (39.7392, -104.9903),
+    "seattle": (47.6062, -122.3321),
+}
+# Bounding box of the uniform background (roughly the contiguous US).
+BOUNDS = ((25.0, 49.0), (-124.0, -67.0))
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway directory of located providers and times ?near= searches (geohash "
+        "candidates + exact distance) against a full-table distance scan. Everything is rolled "
+        "back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--providers", type=int, default=1_000_000)
+        parser.add_argument("--radius", type=float, action="append", dest="radii", help="Search radius in km (repeatable).")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query.")
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument("--skip-scan", action="store_true", help="Do not time the full-scan baseline.")
+        parser.add_argument("--keep", action="store_true", help="Commit the seeded rows.")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        radii = options["radii"] or [5.0, 25.0, 100.0]
+        try:
+            with transaction.atomic():
+                category = self._seed(options["providers"])
+                self._report(category, radii, options)
+                if not options["keep"]:
+                    raise _Rollback
+        except _Rollback:
+            self.stdout.write("Seeded rows rolled back.")
+
+    # --- Seeding ---
+
+    def _seed(self, count):
+        started = time.perf_counter()
+        categories = [
+            ServiceCategory.objects.get_or_create(name=f"Geo Bench {i}")[0] for i in range(8)
+        ]
+        with connection.cursor() as cursor:
+            # Users straight from generate_series; only the ids are needed here.
+            cursor.execute(
+                f"""
+                INSERT INTO {User._meta.db_table}
+                    (password, is_superuser, username, first_name, last_name, email,
+                     is_staff, is_active, date_joined, is_provider)
+                SELECT '!', false, 'geo_bench_' || g, '', '', '', false, true, now(), true
+                FROM generate_series(1, %s) AS g
+                RETURNING id
+                """,
+                [count],
+            )
+            user_ids = [row[0] for row in cursor.fetchall()]
+            self._insert_profiles(cursor, user_ids)
+            through = ServiceProviderProfile.services_offered.through
+            cursor.execute(
+                f"""
+                INSERT INTO {through._meta.db_table} (serviceproviderprofile_id, servicecategory_id)
+                SELECT user_id, (%s::bigint[])[1 + floor(random() * %s)::int]
+                FROM {ServiceProviderProfile._meta.db_table}
+                WHERE user_id = ANY(%s)
+                """,
+                [[c.pk for c in categories], len(categories), user_ids],
+            )
+            for model in (User, ServiceProviderProfile, through):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+        self.stdout.write(f"Seeded {count} located providers in {time.perf_counter() - started:.1f}s.")
+        return categories[0]
+
+    def _insert_profiles(self, cursor, user_ids, batch_size=5000):
+        columns = [
+            "user", "business_name", "bio", "phone_number", "status", "average_rating",
+            "review_count", "rating_histogram", "profile_picture_variants",
+            "service_latitude", "service_longitude", "service_radius_km", "service_geohash",
+        ]
+        db_columns = ", ".join(ServiceProviderProfile._meta.get_field(name).column for name in columns)
+        histogram = json.dumps({str(star): 0 for star in range(1, 6)})
+        metros = list(METROS.values())
+        for offset in range(0, len(user_ids), batch_size):
+            rows, params = [], []
+            for user_id in user_ids[offset:offset + batch_size]:
+                if random.random() < 0.7:
+                    # ~70% within a few tens of km of a metro centre.
+                    centre_lat, centre_lng = random.choice(metros)
+                    lat = centre_lat + random.gauss(0, 0.25)
+                    lng = centre_lng + random.gauss(0, 0.3)
+                else:
+                    lat = random.uniform(*BOUNDS[0])
+                    lng = random.uniform(*BOUNDS[1])
+                rows.append("(" + ", ".join(["%s"] * len(columns)) + ")")
+                params.extend([
+                    user_id, f"Geo Bench {user_id}", "", "", "APPROVED", 0, 0, histogram, "{}",
+                    lat, lng, random.choice((10, 25, 50, 100)), encode_geohash(lat, lng),
+                ])
+            cursor.execute(
+                f"INSERT INTO {ServiceProviderProfile._meta.db_table} ({db_columns}) VALUES {', '.join(rows)}",
+                params,
+            )
+
+    # --- Timing ---
+
+    def _report(self, category, radii, options):
+        base = ServiceProviderProfile.objects.filter(status="APPROVED", user__is_active=True)
+        page_size = options["page_size"]
+        self.stdout.write(
+            f"{'place':<10}{'km':>6}{'category':>10}{'geohash ms':>12}{'scan ms':>10}{'rows':>6}"
+        )
+        for place, (lat, lng) in METROS.items():
+            for radius in radii:
+                for with_category in (False, True):
+                    queryset = base.filter(services_offered=category) if with_category else base
+
+                    def indexed():
+                        return list(
+                            providers_near(queryset, lat, lng, radius)
+                            .order_by("distance_km", "user_id").values_list("pk", flat=True)[:page_size]
+                        )
+
+                    def scan():
+                        return list(
+                            queryset.annotate(distance_km=distance_km_expression(lat, lng))
+                            .filter(distance_km__lte=radius, service_latitude__isnull=False)
+                            .order_by("distance_km", "user_id").values_list("pk", flat=True)[:page_size]
+                        )
+
+                    rows = indexed()
+                    indexed_ms = self._time(indexed, options["repeat"])
+                    scan_ms = "-" if options["skip_scan"] else f"{self._time(scan, 1):.1f}"
+                    self.stdout.write(
+                        f"{place:<10}{radius:>6.0f}{'yes' if with_category else 'no':>10}"
+                        f"{indexed_ms:>12.2f}{scan_ms:>10}{len(rows):>6}"
+                    )
+
+    def _time(self, run, repeat):
+        run()  # warm-up
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples)
@@ -0,0 +1,112 @@
+# File: api/management/commands/bench_provider_search.py
+
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.models import ServiceCategory, ServiceProviderProfile, User
+from api.search import legacy_search_providers, refresh_provider_search_documents, search_providers
+
+WORDS = (
+    "plumbing electric repair leak pipe boiler heating cooling garden lawn paint roof tile "
+    "carpentry cabinet door window lock glass floor clean laundry move haul install fix "
+    "emergency licensed certified family local quality fast reliable affordable expert"
+).split()
+NAMES = "john maria ahmed li olga pedro fatima kenji amara noah sofia ivan".split()
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway provider directory and compares the full-text provider search "
+        "against the original icontains search. Everything is rolled back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--providers", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query.")
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument(
+            "--query", action="append", dest="queries",
+            help="Search text to time (repeatable). Defaults to a small mixed set.",
+        )
+        parser.add_argument("--keep", action="store_true", help="Commit the seeded rows.")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        queries = options["queries"] or ["plumb", "boiler repair", "maria", "licensed electric", "zzzz"]
+        try:
+            with transaction.atomic():
+                self._seed(options["providers"])
+                self._report(queries, options["repeat"], options["page_size"])
+                if not options["keep"]:
+                    raise _Rollback
+        except _Rollback:
+            self.stdout.write("Seeded rows rolled back.")
+
+    def _seed(self, count):
+        started = time.perf_counter()
+        categories = [
+            ServiceCategory.objects.get_or_create(name=f"Bench {word.title()}")[0]
+            for word in WORDS[:12]
+        ]
+        batch_size = 5000
+        Through = ServiceProviderProfile.services_offered.through
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            users = User.objects.bulk_create([
+                User(username=f"bench_{random.choice(NAMES)}_{offset + i}", password="!", is_provider=True)
+                for i in range(size)
+            ])
+            profiles = ServiceProviderProfile.objects.bulk_create([
+                ServiceProviderProfile(
+                    user=user,
+                    status=ServiceProviderProfile.ProfileStatus.APPROVED,
+                    business_name=" ".join(random.sample(WORDS, 3)).title(),
+                    bio=" ".join(random.choices(WORDS, k=30)),
+                )
+                for user in users
+            ])
+            Through.objects.bulk_create([
+                Through(serviceproviderprofile_id=profile.pk, servicecategory_id=category.pk)
+                for profile in profiles
+                for category in random.sample(categories, 2)
+            ])
+        refresh_provider_search_documents()
+        with connection.cursor() as cursor:
+            for table in (ServiceProviderProfile, User, ServiceCategory, Through):
+                cursor.execute(f"ANALYZE {table._meta.db_table}")
+        self.stdout.write(f"Seeded {count} providers in {time.perf_counter() - started:.1f}s.")
+
+    def _report(self, queries, repeat, page_size):
+        base = ServiceProviderProfile.objects.filter(status="APPROVED", user__is_active=True)
+        self.stdout.write(f"{'query':<22}{'icontains ms':>14}{'full-text ms':>14}{'speedup':>10}")
+        for text in queries:
+            legacy = self._time(
+                lambda: list(legacy_search_providers(base, text).order_by("business_name")
+                             .values_list("pk", flat=True)[:page_size]),
+                repeat,
+            )
+            fulltext = self._time(
+                lambda: list(search_providers(base, text).order_by("-search_rank", "business_name")
+                             .values_list("pk", flat=True)[:page_size]),
+                repeat,
+            )
+            speedup = legacy / fulltext if fulltext else float("inf")
+            self.stdout.write(f"{text:<22}{legacy:>14.2f}{fulltext:>14.2f}{speedup:>9.1f}x")
+
+    def _time(self, run, repeat):
+        run()  # warm-up
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples)
@@ -0,0 +1,145 @@
+# File: api/management/commands/check_channel_fanout.py
+
+import asyncio
+import multiprocessing
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from api.channel_layers import unpack_batch
+
+GROUP = "chat_fanout_check"
+
+
+def _make_layer(layer_settings):
+    return import_string(layer_settings["BACKEND"])(**layer_settings.get("CONFIG", {}))
+
+
+def _worker(worker_id, layer_settings, workers, messages, ready, start, results, timeout):
+    """
+    One "Daphne worker": joins the group, publishes its own messages once every worker
+    is listening, and reports which (worker, seq) pairs it received.
+    """
+    async def run():
+        layer = _make_layer(layer_settings)
+        channel = await layer.new_channel()
+        await layer.group_add(GROUP, channel)
+        ready.put(worker_id)
+        await asyncio.get_running_loop().run_in_executor(None, start.wait)
+
+        async def publish():
+            # Concurrent sends, like many sockets of one room served by this process.
+            await asyncio.gather(*(
+                layer.group_send(GROUP, {"type": "fanout.check", "worker": worker_id, "seq": seq})
+                for seq in range(messages)
+            ))
+
+        publisher = asyncio.ensure_future(publish())
+        received = set()
+        expected = workers * messages
+        deadline = time.monotonic() + timeout
+        while len(received) < expected and time.monotonic() < deadline:
+            try:
+                message = await asyncio.wait_for(layer.receive(channel), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            for item in unpack_batch(message):
+                received.add((item["worker"], item["seq"]))
+        await publisher
+        await layer.group_discard(GROUP, channel)
+        return received
+
+    received = asyncio.run(run())
+    cross_worker = sum(1 for sender, _ in received if sender != worker_id)
+    results.put((worker_id, len(received), cross_worker))
+
+
+class Command(BaseCommand):
+    help = (
+        "Starts several worker processes on the configured channel layer and checks that every "
+        "group message reaches every process. --fake-broker runs against a local stand-in "
+        "Redis (fakeredis) instead of CHANNEL_REDIS_URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--messages", type=int, default=200, help="Group messages sent by each worker.")
+        parser.add_argument("--timeout", type=float, default=30.0)
+        parser.add_argument(
+            "--fake-broker", action="store_true",
+            help="Serve a fakeredis TCP server on a free local port for the duration of the check.",
+        )
+
+    def handle(self, *args, **options):
+        layer_settings = dict(settings.CHANNEL_LAYERS["default"])
+        server = None
+        if options["fake_broker"]:
+            server, url = self._start_fake_broker()
+            layer_settings = {
+                "BACKEND": "api.channel_layers.BatchingRedisChannelLayer",
+                "CONFIG": {**settings.CHANNEL_LAYER_CONFIG, "hosts": [url]},
+            }
+            self.stdout.write(f"Stand-in broker listening on {url}")
+        elif "InMemory" in layer_settings["BACKEND"]:
+            raise CommandError(
+                "The in-memory channel layer cannot cross processes. "
+                "Set CHANNEL_REDIS_URL or pass --fake-broker."
+            )
+
+        workers, messages = options["workers"], options["messages"]
+        context = multiprocessing.get_context("spawn")
+        ready, results, start = context.Queue(), context.Queue(), context.Event()
+        processes = [
+            context.Process(
+                target=_worker,
+                args=(i, layer_settings, workers, messages, ready, start, results, options["timeout"]),
+            )
+            for i in range(workers)
+        ]
+        try:
+            for process in processes:
+                process.start()
+            for _ in processes:
+                ready.get(timeout=options["timeout"])
+            started = time.perf_counter()
+            start.set()
+            outcome = [results.get(timeout=options["timeout"] + 5) for _ in processes]
+            elapsed = time.perf_counter() - started
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            if server is not None:
+                server.shutdown()
+
+        expected = workers * messages
+        failed = False
+        for worker_id, received, cross_worker in sorted(outcome):
+            status = "ok" if received == expected else "MISSING"
+            failed |= received != expected
+            self.stdout.write(
+                f"worker {worker_id}: received {received}/{expected} "
+                f"({cross_worker} from other processes) {status}"
+            )
+        rate = workers * expected / elapsed if elapsed else 0
+        self.stdout.write(f"{workers * expected} deliveries in {elapsed:.2f}s ({rate:.0f}/s)")
+        if failed:
+            raise CommandError("Some group messages did not reach every worker process.")
+        self.stdout.write(self.style.SUCCESS("Group messages crossed all worker processes."))
+
+    def _start_fake_broker(self):
+        try:
+            from fakeredis import TcpFakeServer
+        except ImportError:
+            raise CommandError("--fake-broker needs fakeredis with Lua support: pip install 'fakeredis[lua]'")
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, f"redis://127.0.0.1:{port}/0"
@@ -0,0 +1,83 @@
+# File: api/management/commands/check_replica_routing.py
+
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api import db_routing
+from api.models import ServiceProviderProfile, User
+
+CHECK_PREFIX = "replica_check_"
+
+
+class Command(BaseCommand):
+    help = (
+        "Walks a customer through reads, a booking and the read-your-writes window, and "
+        "checks which database alias each request's queries ran on. Needs at least one "
+        "replica alias (DB_REPLICA_HOSTS); locally it may point at the primary itself. "
+        "Creates a throwaway customer and provider and deletes them afterwards."
+    )
+
+    def handle(self, *args, **options):
+        if not db_routing.replica_aliases():
+            raise CommandError("No replica configured; set DB_REPLICA_HOSTS (e.g. to the primary's host).")
+        customer, provider = self._seed()
+        client = APIClient(HTTP_HOST="localhost")
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(customer)}")
+        booking = {
+            "provider_profile": provider.pk,
+            "service_description": "replica check",
+            "booking_datetime": (timezone.now() + timedelta(days=1)).isoformat(),
+            "address_for_service": "replica check",
+        }
+        pin_seconds = settings.DB_REPLICA["PIN_SECONDS"]
+        steps = [
+            ("GET providers", lambda: client.get("/api/providers/"), "replica"),
+            ("GET bookings", lambda: client.get("/api/bookings/"), "replica"),
+            ("POST booking", lambda: client.post("/api/bookings/create/", booking, format="json"), "primary"),
+            ("GET bookings (pinned)", lambda: client.get("/api/bookings/"), "primary"),
+            (f"wait {pin_seconds}s for the pin to expire", lambda: time.sleep(pin_seconds), None),
+            ("GET bookings", lambda: client.get("/api/bookings/"), "replica"),
+        ]
+        failed = False
+        try:
+            for label, run, expected in steps:
+                aliases = []
+                with ExitStack() as stack:
+                    for alias in connections:
+                        stack.enter_context(connections[alias].execute_wrapper(self._recorder(alias, aliases)))
+                    response = run()
+                if expected is None:
+                    self.stdout.write(label)
+                    continue
+                # Cache fills (e.g. the user snapshot) read the primary even on replica requests.
+                used = "replica" if any(alias != db_routing.PRIMARY for alias in aliases) else "primary"
+                ok = response.status_code < 400 and bool(aliases) and used == expected
+                failed = failed or not ok
+                summary = ", ".join(f"{alias} x{aliases.count(alias)}" for alias in dict.fromkeys(aliases))
+                line = f"{label:<24}{response.status_code:>5}  {summary or 'no queries'} (expected {expected})"
+                self.stdout.write(self.style.SUCCESS(line) if ok else self.style.ERROR(line))
+        finally:
+            User.objects.filter(username__startswith=CHECK_PREFIX).delete()
+        if failed:
+            raise CommandError("Some requests were not routed as expected.")
+
+    def _seed(self):
+        User.objects.filter(username__startswith=CHECK_PREFIX).delete()
+        customer = User.objects.create(username=f"{CHECK_PREFIX}customer")
+        provider_user = User.objects.create(username=f"{CHECK_PREFIX}provider", is_provider=True)
+        provider = ServiceProviderProfile.objects.create(user=provider_user, status="APPROVED")
+        return customer, provider
+
+    def _recorder(self, alias, aliases):
+        def record(execute, sql, params, many, context):
+            aliases.append(alias)
+            return execute(sql, params, many, context)
+        return record
@@ -0,0 +1,61 @@
+# File: api/management/commands/generate_image_derivatives.py
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from api.images import generate_derivatives, variants_field_name
+from api.models import ServiceCategory, ServiceProviderProfile
+
+IMAGE_FIELDS = [
+    (ServiceProviderProfile, "profile_picture"),
+    (ServiceCategory, "category_image"),
+]
+
+
+def _generate(model_label, pk, field_name, force):
+    try:
+        return generate_derivatives(model_label, pk, field_name, force=force)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates missing or outdated WebP/JPEG derivatives of provider pictures and category "
+        "images (e.g. for files uploaded before the derivative pipeline existed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Images processed in parallel.")
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Re-render even when the stored source hash matches.",
+        )
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model, field_name in IMAGE_FIELDS:
+            # Rows with an image, plus rows whose image was removed but still list derivatives.
+            has_image = ~Q(**{field_name: ""}) & Q(**{f"{field_name}__isnull": False})
+            stale = ~Q(**{variants_field_name(field_name): {}})
+            pks = model.objects.filter(has_image | stale).values_list("pk", flat=True)
+            jobs.extend((model._meta.label, pk, field_name) for pk in pks.iterator())
+
+        written = failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = {executor.submit(_generate, *job, options["force"]): job for job in jobs}
+            for future in as_completed(futures):
+                model_label, pk, field_name = futures[future]
+                try:
+                    written += future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{model_label} {pk} {field_name}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {len(jobs)} images: {written} derivative sets written, "
+            f"{len(jobs) - written - failed} already up to date, {failed} failed."
+        ))
@@ -0,0 +1,340 @@
+# File: api/management/commands/import_providers.py
+
+import csv
+import itertools
+import json
+import os
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Upper
+
+from api.models import ServiceCategory, ServiceProviderProfile, User
+from api.password_hashing import hash_password, hashing_pool
+from api.response_cache import invalidate_category_list
+from api.search import refresh_provider_search_documents
+
+USER_COLUMNS = ("username", "email", "first_name", "last_name")
+PROFILE_COLUMNS = ("business_name", "phone_number", "bio")
+REQUIRED_COLUMNS = ("username", "email", "business_name", "phone_number")
+# CSV cells may list several categories (names or ids) separated by this character.
+SERVICES_SEPARATOR = ";"
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports service providers from a CSV or JSONL file in chunks: bulk inserts of users, "
+        "profiles and service categories, password hashing in a process pool, per-row errors "
+        "written to an errors file and progress to a state file, so an interrupted import "
+        "resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV (with a header row) or JSONL file, one provider per row.")
+        parser.add_argument("--format", choices=("csv", "jsonl"), help="Defaults to the file extension.")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Password hashing processes.")
+        parser.add_argument(
+            "--status", choices=[choice for choice, _ in ServiceProviderProfile.ProfileStatus.choices],
+            default=ServiceProviderProfile.ProfileStatus.PENDING,
+            help="Status of the imported profiles. APPROVED also marks the users as providers.",
+        )
+        parser.add_argument("--create-categories", action="store_true", help="Create unknown category names instead of rejecting the row.")
+        parser.add_argument("--state-file", help="Progress file (default: <path>.import-state.json).")
+        parser.add_argument("--errors-file", help="Rejected rows as JSONL (default: <path>.errors.jsonl).")
+        parser.add_argument("--restart", action="store_true", help="Ignore saved progress and start from the first row.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"No such file: {path}")
+        file_format = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+        self.options = options
+        self.status = options["status"]
+        self.state_path = options["state_file"] or f"{path}.import-state.json"
+        errors_path = options["errors_file"] or f"{path}.errors.jsonl"
+        self.categories = self._load_categories()
+        self.created_categories = False
+
+        state = self._load_state(path)
+        if state["rows_done"]:
+            self.stdout.write(f"Resuming after row {state['rows_done']} ({state['imported']} imported so far).")
+        started = time.perf_counter()
+        imported_before = state["imported"]
+
+        with open(path, newline="", encoding="utf-8") as source, \
+                open(errors_path, "a", encoding="utf-8") as self.errors_file, \
+                hashing_pool(options["workers"]) as self.pool:
+            rows = self._read_rows(source, file_format)
+            rows = itertools.islice(enumerate(rows, start=1), state["rows_done"], None)
+            while True:
+                chunk = list(itertools.islice(rows, options["chunk_size"]))
+                if not chunk:
+                    break
+                imported, failed = self._import_chunk(chunk)
+                state["rows_done"] = chunk[-1][0]
+                state["imported"] += imported
+                state["failed"] += failed
+                self._save_state(state)
+                rate = (state["imported"] - imported_before) / max(time.perf_counter() - started, 1e-9) * 60
+                self.stdout.write(
+                    f"Row {state['rows_done']}: {state['imported']} imported, {state['failed']} rejected "
+                    f"({rate:,.0f} providers/min)."
+                )
+
+        if self.created_categories:
+            invalidate_category_list()
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {state['imported']} providers imported, {state['failed']} rows rejected"
+            + (f" (see {errors_path})." if state["failed"] else ".")
+        ))
+
+    # --- Input ---
+
+    def _read_rows(self, source, file_format):
+        if file_format == "csv":
+            for row in csv.DictReader(source):
+                services = row.get("services") or ""
+                row["services"] = [name.strip() for name in services.split(SERVICES_SEPARATOR) if name.strip()]
+                yield row
+        else:
+            for line in source:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = {"_parse_error": "Not valid JSON."}
+                yield row if isinstance(row, dict) else {"_parse_error": "Expected a JSON object."}
+
+    # --- Progress ---
+
+    def _load_state(self, path):
+        fresh = {"path": os.path.abspath(path), "size": os.path.getsize(path), "rows_done": 0, "imported": 0, "failed": 0}
+        if self.options["restart"] or not os.path.exists(self.state_path):
+            return fresh
+        with open(self.state_path, encoding="utf-8") as state_file:
+            state = json.load(state_file)
+        if (state.get("path"), state.get("size")) != (fresh["path"], fresh["size"]):
+            raise CommandError(
+                f"{self.state_path} belongs to a different file; pass --restart or another --state-file."
+            )
+        return state
+
+    def _save_state(self, state):
+        # Written after each committed chunk. A crash between the two re-runs that chunk,
+        # whose rows are then rejected as existing users rather than imported twice.
+        temporary = f"{self.state_path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as state_file:
+            json.dump(state, state_file)
+        os.replace(temporary, self.state_path)
+
+    def _reject(self, line, row, errors):
+        # Buffered until the chunk is committed, so a retried chunk reports each row once.
+        row = {key: value for key, value in row.items() if key not in ("password", "_parse_error")}
+        self.rejected.append(json.dumps({"row": line, "errors": errors, "data": row}, default=str) + "\n")
+
+    # --- Categories ---
+
+    def _load_categories(self):
+        categories = {}
+        for pk, name in ServiceCategory.objects.values_list("pk", "name"):
+            categories[name.casefold()] = pk
+            categories[str(pk)] = pk
+        return categories
+
+    def _resolve_services(self, chunk):
+        if not self.options["create_categories"]:
+            return
+        missing = {
+            str(name).strip() for _, row in chunk for name in row.get("services") or ()
+            if str(name).strip() and str(name).strip().casefold() not in self.categories and not str(name).isdigit()
+        }
+        if missing:
+            ServiceCategory.objects.bulk_create(
+                [ServiceCategory(name=name) for name in sorted(missing)], ignore_conflicts=True
+            )
+            self.categories = self._load_categories()
+            self.created_categories = True
+
+    # --- Chunks ---
+
+    def _import_chunk(self, chunk):
+        self._resolve_services(chunk)
+        self.rejected = []
+        try:
+            result = self._insert_chunk(chunk)
+        except IntegrityError:
+            # A user registered through the API between validation and insert; validating
+            # again now rejects that row and the rest of the chunk goes in.
+            self.rejected = []
+            result = self._insert_chunk(chunk)
+        self.errors_file.writelines(self.rejected)
+        self.errors_file.flush()
+        return result
+
+    def _insert_chunk(self, chunk):
+        valid, failed = self._validate_chunk(chunk)
+        if not valid:
+            return 0, failed
+        approved = self.status == ServiceProviderProfile.ProfileStatus.APPROVED
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(
+                    password=entry["password"], is_provider=approved,
+                    **{column: entry["row"].get(column) or "" for column in USER_COLUMNS},
+                )
+                for entry in valid
+            ])
+            profiles = []
+            for user, entry in zip(users, valid):
+                profile = ServiceProviderProfile(
+                    user=user, status=self.status,
+                    service_latitude=entry["latitude"], service_longitude=entry["longitude"],
+                    **{column: entry["row"].get(column) or "" for column in PROFILE_COLUMNS},
+                )
+                if entry["radius"] is not None:
+                    profile.service_radius_km = entry["radius"]
+                # bulk_create() bypasses save(), which normally keeps the geohash in step.
+                profile.service_geohash = profile.compute_service_geohash()
+                profiles.append(profile)
+            ServiceProviderProfile.objects.bulk_create(profiles)
+            through = ServiceProviderProfile.services_offered.through
+            through.objects.bulk_create([
+                through(serviceproviderprofile_id=user.pk, servicecategory_id=category_id)
+                for user, entry in zip(users, valid)
+                for category_id in entry["services"]
+            ])
+            # No signals fire for bulk inserts, so build the search documents here.
+            refresh_provider_search_documents([user.pk for user in users])
+        return len(valid), failed
+
+    def _validate_chunk(self, chunk):
+        """
+        Checks the rows of one chunk with a fixed number of queries (not per row) and
+        hashes their passwords in the process pool. Returns (valid entries, rejected).
+        """
+        entries, failed = [], 0
+        for line, row in chunk:
+            errors = self._row_errors(row)
+            if errors:
+                self._reject(line, row, errors)
+                failed += 1
+            else:
+                entries.append(self._entry(line, row))
+
+        # Existing users, compared case-insensitively like the registration endpoint does.
+        usernames = {entry["row"]["username"].upper() for entry in entries}
+        emails = {entry["row"]["email"].upper() for entry in entries}
+        taken_usernames = set(
+            User.objects.annotate(key=Upper("username")).filter(key__in=usernames).values_list("key", flat=True)
+        )
+        taken_emails = set(
+            User.objects.annotate(key=Upper("email")).filter(key__in=emails).values_list("key", flat=True)
+        )
+
+        checked = []
+        for entry in entries:
+            username, email = entry["row"]["username"].upper(), entry["row"]["email"].upper()
+            errors = {}
+            if username in taken_usernames:
+                errors["username"] = ["A user with this username already exists."]
+            if email in taken_emails:
+                errors["email"] = ["A user with this email already exists."]
+            if errors:
+                self._reject(entry["line"], entry["row"], errors)
+                failed += 1
+                continue
+            # Later rows of the file with the same username or email are duplicates.
+            taken_usernames.add(username)
+            taken_emails.add(email)
+            checked.append(entry)
+
+        with_password = [entry for entry in checked if entry["row"].get("password")]
+        jobs = [
+            (entry["row"]["password"], {column: entry["row"].get(column) or "" for column in USER_COLUMNS})
+            for entry in with_password
+        ]
+        chunksize = max(1, len(jobs) // (self.options["workers"] * 4))
+        for entry, (password_hash, errors) in zip(with_password, self.pool.map(hash_password, jobs, chunksize=chunksize)):
+            entry["password"] = password_hash
+            if errors:
+                entry["errors"] = {"password": errors}
+
+        valid = []
+        for entry in checked:
+            if "errors" in entry:
+                self._reject(entry["line"], entry["row"], entry["errors"])
+                failed += 1
+            else:
+                valid.append(entry)
+        return valid, failed
+
+    def _row_errors(self, row):
+        if "_parse_error" in row:
+            return {"row": [row["_parse_error"]]}
+        errors = {}
+        for column in REQUIRED_COLUMNS:
+            if not str(row.get(column) or "").strip():
+                errors[column] = ["This field is required."]
+        username = str(row.get("username") or "")
+        if username:
+            if len(username) > User._meta.get_field("username").max_length:
+                errors["username"] = ["Ensure this field has no more than 150 characters."]
+            else:
+                try:
+                    UnicodeUsernameValidator()(username)
+                except ValidationError as e:
+                    errors["username"] = list(e.messages)
+        if row.get("email"):
+            try:
+                validate_email(row["email"])
+            except ValidationError as e:
+                errors["email"] = list(e.messages)
+        for column in ("business_name", "phone_number"):
+            max_length = ServiceProviderProfile._meta.get_field(column).max_length
+            if len(str(row.get(column) or "")) > max_length:
+                errors[column] = [f"Ensure this field has no more than {max_length} characters."]
+        unknown = [
+            str(name) for name in row.get("services") or () if str(name).strip().casefold() not in self.categories
+        ]
+        if unknown:
+            errors["services"] = [f"Unknown categories: {', '.join(unknown)}."]
+        try:
+            self._location(row)
+        except ValueError as e:
+            errors["location"] = [str(e)]
+        return errors
+
+    def _location(self, row):
+        latitude, longitude, radius = (row.get(key) for key in ("latitude", "longitude", "service_radius_km"))
+        latitude = float(latitude) if latitude not in (None, "") else None
+        longitude = float(longitude) if longitude not in (None, "") else None
+        if (latitude is None) != (longitude is None):
+            raise ValueError("Give both latitude and longitude, or neither.")
+        if latitude is not None and not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError("Latitude must be within [-90, 90] and longitude within [-180, 180].")
+        radius = int(radius) if radius not in (None, "") else None
+        if radius is not None and radius < 0:
+            raise ValueError("service_radius_km cannot be negative.")
+        return latitude, longitude, radius
+
+    def _entry(self, line, row):
+        row = {key: (value.strip() if isinstance(value, str) else value) for key, value in row.items()}
+        latitude, longitude, radius = self._location(row)
+        services = {self.categories[str(name).strip().casefold()] for name in row.get("services") or ()}
+        return {
+            "line": line,
+            "row": row,
+            # Rows without a password get an unusable one; the provider sets it via a reset.
+            "password": make_password(None),
+            "latitude": latitude,
+            "longitude": longitude,
+            "radius": radius,
+            "services": sorted(services),
+        }
@@ -0,0 +1,62 @@
+# File: api/management/commands/rebuild_provider_ratings.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Review, ServiceProviderProfile
+from api.response_cache import invalidate_provider_details
+
+
+class Command(BaseCommand):
+    help = "Recomputes the denormalized rating fields (average, count, histogram) of every provider."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Number of provider profiles written per UPDATE batch.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        # One grouped aggregate over all reviews instead of one Avg() per provider.
+        stats_by_provider = {
+            row["provider_profile_id"]: ServiceProviderProfile.rating_stats_from_aggregates(row)
+            for row in Review.objects.order_by().values("provider_profile_id").annotate(
+                **ServiceProviderProfile.rating_stats_aggregates()
+            )
+        }
+        no_reviews = ServiceProviderProfile.rating_stats_from_aggregates({})
+
+        updated = 0
+        profiles = ServiceProviderProfile.objects.only(
+            "pk", "average_rating", "review_count", "rating_histogram"
+        ).order_by("pk")
+        batch = []
+        with transaction.atomic():
+            for profile in profiles.iterator(chunk_size=batch_size):
+                stats = stats_by_provider.get(profile.pk, no_reviews)
+                if all(getattr(profile, field) == value for field, value in stats.items()):
+                    continue
+                for field, value in stats.items():
+                    setattr(profile, field, value)
+                batch.append(profile)
+                if len(batch) >= batch_size:
+                    updated += self._write(batch)
+                    batch = []
+            updated += self._write(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt rating stats: {updated} provider profiles updated, "
+            f"{len(stats_by_provider)} with reviews."
+        ))
+
+    def _write(self, batch):
+        if batch:
+            ServiceProviderProfile.objects.bulk_update(
+                batch, ["average_rating", "review_count", "rating_histogram"]
+            )
+            # bulk_update() sends no signals; drop the cached provider documents once committed.
+            provider_ids = [profile.pk for profile in batch]
+            transaction.on_commit(lambda: invalidate_provider_details(provider_ids))
+        return len(batch)
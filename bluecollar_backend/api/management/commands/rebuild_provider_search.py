@@ -0,0 +1,13 @@
+# File: api/management/commands/rebuild_provider_search.py
+
+from django.core.management.base import BaseCommand
+
+from api.search import refresh_provider_search_documents
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search document of every provider profile (e.g. after a bulk load)."
+
+    def handle(self, *args, **options):
+        updated = refresh_provider_search_documents()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search documents for {updated} provider profiles."))
@@ -0,0 +1,186 @@
+# File: api/management/commands/stress_db_pool.py
+
+import asyncio
+import json
+import threading
+import time
+from datetime import timedelta
+
+import psycopg
+from channels.routing import URLRouter
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.urls import re_path
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.chat_rooms import room_access_cache
+from api.consumers import ChatConsumer
+from api.models import Booking, ServiceProviderProfile, User
+
+STRESS_PREFIX = "stress_pool_"
+
+# Server-side view of this database: client backends other than the sampler itself,
+# and the number of sessions ever opened (PostgreSQL 14+).
+BACKENDS_SQL = """
+    SELECT count(*) FROM pg_stat_activity
+    WHERE datname = current_database() AND backend_type = 'client backend' AND pid <> pg_backend_pid()
+"""
+SESSIONS_SQL = "SELECT sessions FROM pg_stat_database WHERE datname = current_database()"
+
+
+class ConnectionSampler(threading.Thread):
+    """
+    Polls pg_stat_activity over its own connection (outside Django and the pool)
+    and keeps the highest number of client backends seen.
+    """
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._conn = psycopg.connect(**connection.get_connection_params(), autocommit=True)
+
+    def query(self, sql):
+        return self._conn.execute(sql).fetchone()[0]
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, self.query(BACKENDS_SQL))
+            self.samples += 1
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self._conn.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Holds --sockets concurrent chat sockets open (connect, history, messages) while "
+        "sending authenticated REST requests, and samples the database's client backends "
+        "throughout. With DB_POOL enabled the peak must stay within the pool's max size. "
+        "Creates throwaway users and bookings and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=1000, help="Sockets held open at the same time.")
+        parser.add_argument("--rooms", type=int, default=100, help="Booking rooms the sockets are spread over.")
+        parser.add_argument("--messages", type=int, default=2, help="Messages sent per socket once all are open.")
+        parser.add_argument("--http-requests", type=int, default=1000, help="REST requests sent alongside the sockets.")
+        parser.add_argument("--concurrency", type=int, default=200, help="Sockets connecting / requests in flight at once.")
+        parser.add_argument("--sample-interval", type=float, default=0.02, help="Seconds between pg_stat_activity samples.")
+
+    def handle(self, *args, **options):
+        # The baseline is taken before this process connects, so the pool's own
+        # connections count towards the peak.
+        sampler = ConnectionSampler(options["sample_interval"])
+        baseline = sampler.query(BACKENDS_SQL)
+        sessions_before = sampler.query(SESSIONS_SQL)
+        customer, provider_id, rooms = self._seed(options["rooms"])
+        for room in rooms:
+            room_access_cache.invalidate_room(room)
+        # Hand this thread's connection back so it is free for the run.
+        connection.close()
+        sampler.start()
+        try:
+            started = time.perf_counter()
+            failures = asyncio.run(self._run(customer, provider_id, rooms, options))
+            elapsed = time.perf_counter() - started
+        finally:
+            sampler.stop()
+            User.objects.filter(username__startswith=STRESS_PREFIX).delete()
+        self._report(sampler, baseline, sessions_before, failures, elapsed, options)
+
+    def _seed(self, room_count):
+        User.objects.filter(username__startswith=STRESS_PREFIX).delete()
+        customer = User.objects.create(username=f"{STRESS_PREFIX}customer")
+        provider = User.objects.create(username=f"{STRESS_PREFIX}provider", is_provider=True)
+        profile = ServiceProviderProfile.objects.create(user=provider, status="APPROVED")
+        start = timezone.now() + timedelta(days=1)
+        bookings = [
+            Booking.objects.create(
+                customer=customer, provider_profile=profile, service_description="stress",
+                booking_datetime=start + timedelta(hours=2 * i), address_for_service="stress",
+            )
+            for i in range(room_count)
+        ]
+        return customer, profile.pk, [f"booking_{booking.pk}" for booking in bookings]
+
+    async def _run(self, customer, provider_id, rooms, options):
+        sockets_app = URLRouter([re_path(r"^ws/chat/(?P<room_name>[^/]+)/$", ChatConsumer.as_asgi())])
+        http_app = get_asgi_application()
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        failures = {"sockets": 0, "http": 0}
+        day = timezone.localdate() + timedelta(days=1)
+        path = f"/api/providers/{provider_id}/availability/?start={day}&end={day + timedelta(days=6)}"
+        headers = [(b"authorization", f"Bearer {AccessToken.for_user(customer)}".encode())]
+
+        async def open_socket(i):
+            async with semaphore:
+                communicator = WebsocketCommunicator(sockets_app, f"/ws/chat/{rooms[i % len(rooms)]}/")
+                communicator.scope["user"] = customer
+                connected, _ = await communicator.connect(timeout=60)
+                if not connected:
+                    failures["sockets"] += 1
+                    return None
+                return communicator
+
+        async def chat(communicator):
+            for i in range(options["messages"]):
+                await communicator.send_to(text_data=json.dumps({"message": f"stress {i}"}))
+                while True:
+                    frame = json.loads(await communicator.receive_from(timeout=60))
+                    if frame["type"] == "chat_message" and frame["message"] == f"stress {i}" and frame["is_self"]:
+                        break
+
+        async def request(i):
+            async with semaphore:
+                communicator = HttpCommunicator(http_app, "GET", path, headers=headers)
+                response = await communicator.get_response(timeout=60)
+                # Let Django close the response (request_finished hands the connection
+                # back to the pool) before the communicator cancels the application.
+                await communicator.wait(timeout=60)
+                if response["status"] != 200:
+                    failures["http"] += 1
+
+        async def hold_sockets():
+            sockets = [s for s in await asyncio.gather(*(open_socket(i) for i in range(options["sockets"]))) if s]
+            await asyncio.gather(*(chat(communicator) for communicator in sockets))
+            await asyncio.gather(*(communicator.disconnect() for communicator in sockets))
+
+        await asyncio.gather(hold_sockets(), *(request(i) for i in range(options["http_requests"])))
+        return failures
+
+    def _report(self, sampler, baseline, sessions_before, failures, elapsed, options):
+        pool = connection.pool
+        peak = sampler.peak - baseline
+        self.stdout.write(
+            f"{options['sockets']} sockets, {options['http_requests']} HTTP requests in {elapsed:.1f}s; "
+            f"{failures['sockets']} sockets refused, {failures['http']} HTTP errors."
+        )
+        self.stdout.write(
+            f"Client backends: {baseline} before, peak {sampler.peak} (+{peak}) over {sampler.samples} samples."
+        )
+        with psycopg.connect(**connection.get_connection_params(), autocommit=True) as conn:
+            opened = conn.execute(SESSIONS_SQL).fetchone()[0] - sessions_before - 1  # minus this connection
+        self.stdout.write(f"Server sessions opened during the run: {opened}.")
+        if pool is None:
+            self.stdout.write("DB_POOL is off: every database_sync_to_async call and request connected anew.")
+            return
+        stats = pool.get_stats()
+        self.stdout.write(
+            f"Pool: max {stats.get('pool_max')}, {stats.get('requests_num', 0)} checkouts, "
+            f"{stats.get('requests_queued', 0)} queued ({stats.get('requests_wait_ms', 0)} ms waited), "
+            f"{stats.get('requests_errors', 0)} timeouts, {stats.get('connections_num', 0)} connections opened."
+        )
+        if peak > settings.DB_POOL["MAX_SIZE"]:
+            self.stderr.write(self.style.ERROR(f"Peak of {peak} connections exceeds DB_POOL MAX_SIZE."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Connection count stayed within DB_POOL MAX_SIZE ({peak} <= {settings.DB_POOL['MAX_SIZE']})."))
@@ -0,0 +1,344 @@
+# File: api/metrics.py
+
+import bisect
+import threading
+import time
+
+from django.conf import settings
+
+# Collectors only record anything when METRICS_ENABLED is set; otherwise every call
+# returns straight away and the metrics middleware removes itself.
+ENABLED = getattr(settings, "METRICS_ENABLED", False)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds (seconds) for latency histograms.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A named metric with a fixed set of label names, rendered in the Prometheus text
+    format. Label values are passed positionally, in the order of `labelnames`.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, (), value) for labels, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. With `function`, the value is computed when the
+    metrics are scraped instead: the function returns a number, or a dict mapping
+    label-value tuples to numbers.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def inc(self, *labels, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        value = self.function()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [(self.name, labels, (), v) for labels, v in value.items()]
+
+
+class ScrapedCounter(Gauge):
+    """
+    A counter kept elsewhere (e.g. a library's statistics) and read through `function`
+    when the metrics are scraped.
+    """
+    kind = "counter"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, the +Inf bucket last, then sum and count.
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, *labels):
+        """
+        Context manager observing the duration of its block.
+        """
+        if not ENABLED:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            states = [(labels, list(state[0]), state[1], state[2]) for labels, state in self._values.items()]
+        samples = []
+        for labels, counts, total, count in states:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", labels, (("le", _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_sum", labels, (), total))
+            samples.append((f"{self.name}_count", labels, (), count))
+        return samples
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def render():
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# --- Scrape-time gauges ---
+
+def _channel_layer_stat(attribute):
+    from channels.layers import get_channel_layer
+
+    return getattr(get_channel_layer(), attribute, 0)
+
+
+def _write_behind_pending():
+    from .chat_persistence import pending_chat_messages
+
+    return pending_chat_messages()
+
+
+def _replica_lag():
+    from .db_routing import replica_lag_seconds
+
+    return replica_lag_seconds()
+
+
+def _db_pool_stat(*keys, scale=1):
+    """
+    Reads psycopg pool statistics (summed over `keys`) per database alias that uses a pool.
+    """
+    def collect():
+        from django.db import connections
+
+        values = {}
+        for alias in connections:
+            pool = getattr(connections[alias], "pool", None)
+            if pool is not None:
+                stats = pool.get_stats()
+                values[(alias,)] = sum(stats.get(key, 0) for key in keys) * scale
+        return values
+    return collect
+
+
+# --- HTTP ---
+
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent handling HTTP requests, by view.", ["view", "method"],
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP responses, by view and status code.", ["view", "method", "status"],
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "http_request_db_queries", "Database queries run while handling a request.", ["view"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "http_request_db_duration_seconds", "Time spent in database queries while handling a request.", ["view"],
+)
+
+# --- WebSockets ---
+
+WS_CONNECT_LATENCY = Histogram(
+    "websocket_connect_duration_seconds", "Time from connect to accept or rejection, by room type.", ["room_type"],
+)
+WS_RECEIVE_LATENCY = Histogram(
+    "websocket_receive_duration_seconds", "Time spent handling an incoming WebSocket frame.", ["room_type"],
+)
+WS_BROADCAST_LATENCY = Histogram(
+    "websocket_broadcast_duration_seconds", "Time spent handing a chat message to the channel layer.", ["room_type"],
+)
+WS_CONNECTIONS = Counter(
+    "websocket_connections_total", "WebSocket connection attempts, by room type and outcome.", ["room_type", "outcome"],
+)
+WS_ACTIVE_CONNECTIONS = Gauge(
+    "websocket_active_connections", "Open WebSocket connections in this process, by room type.", ["room_type"],
+)
+WS_SUBSCRIPTIONS = Counter(
+    "websocket_subscriptions_total", "Room subscriptions on multiplexed sockets, by room type and outcome.",
+    ["room_type", "outcome"],
+)
+WS_ACTIVE_SUBSCRIPTIONS = Gauge(
+    "websocket_active_subscriptions", "Rooms subscribed on this process's multiplexed sockets, by room type.",
+    ["room_type"],
+)
+WS_EPHEMERAL_EVENTS = Counter(
+    "websocket_ephemeral_events_total", "Presence and typing updates, by kind and whether they were broadcast or coalesced.",
+    ["kind", "outcome"],
+)
+
+# --- Channel layer and chat persistence ---
+
+CHANNEL_LAYER_QUEUED = Gauge(
+    "channel_layer_queued_messages", "Messages delivered to this process's channels but not yet consumed.",
+    function=lambda: _channel_layer_stat("queued_messages"),
+)
+CHANNEL_LAYER_PENDING_GROUP_SENDS = Gauge(
+    "channel_layer_pending_group_messages", "Group messages waiting in open send batches.",
+    function=lambda: _channel_layer_stat("pending_group_messages"),
+)
+CHAT_WRITE_BEHIND_PENDING = Gauge(
+    "chat_write_behind_pending_messages", "Chat messages buffered by the write-behind writer.",
+    function=_write_behind_pending,
+)
+CHAT_WRITE_BEHIND_FAILURES = Counter(
+    "chat_write_behind_failures_total", "Write-behind batches that failed to write and were queued for a retry.",
+)
+
+# --- Database connection pool ---
+
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Connections currently open in the pool, by database alias.", ["alias"],
+    function=_db_pool_stat("pool_size"),
+)
+DB_POOL_AVAILABLE = Gauge(
+    "db_pool_available_connections", "Idle connections ready to be borrowed.", ["alias"],
+    function=_db_pool_stat("pool_available"),
+)
+DB_POOL_MAX = Gauge(
+    "db_pool_max_connections", "Upper bound on the pool's connections.", ["alias"],
+    function=_db_pool_stat("pool_max"),
+)
+DB_POOL_WAITING = Gauge(
+    "db_pool_waiting_requests", "Threads currently waiting for a connection.", ["alias"],
+    function=_db_pool_stat("requests_waiting"),
+)
+DB_POOL_REQUESTS = ScrapedCounter(
+    "db_pool_requests_total", "Connections handed out by the pool.", ["alias"],
+    function=_db_pool_stat("requests_num"),
+)
+DB_POOL_QUEUED = ScrapedCounter(
+    "db_pool_queued_requests_total", "Requests that had to wait because no connection was idle.", ["alias"],
+    function=_db_pool_stat("requests_queued"),
+)
+DB_POOL_WAIT = ScrapedCounter(
+    "db_pool_wait_seconds_total", "Time threads spent waiting for a connection.", ["alias"],
+    function=_db_pool_stat("requests_wait_ms", scale=0.001),
+)
+DB_POOL_TIMEOUTS = ScrapedCounter(
+    "db_pool_timeouts_total", "Requests that gave up after waiting the pool timeout.", ["alias"],
+    function=_db_pool_stat("requests_errors"),
+)
+DB_POOL_OPENED = ScrapedCounter(
+    "db_pool_connections_opened_total", "Connections the pool opened to the server.", ["alias"],
+    function=_db_pool_stat("connections_num"),
+)
+DB_POOL_BAD = ScrapedCounter(
+    "db_pool_bad_connections_total", "Connections discarded as broken, when borrowed or returned.", ["alias"],
+    function=_db_pool_stat("connections_lost", "returns_bad"),
+)
+
+# --- Read replicas ---
+
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds", "How far each read replica's replay is behind the primary.", ["alias"],
+    function=_replica_lag,
+)
+DB_ROUTED_REQUESTS = Counter(
+    "db_routed_requests_total", "Safe requests to replica-enabled views, by the database their reads went to.",
+    ["alias"],
+)
@@ -1,36 +1,53 @@
 # File: api/middleware.py
 
-from channels.db import database_sync_to_async # <<< 1. IMPORT THIS
+import logging
+import time
+from contextlib import ExitStack
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from urllib.parse import parse_qs
-from channels.auth import AuthMiddlewareStack
+
+from . import db_routing, metrics
+from .authentication import aget_user_snapshot, snapshot_auth_enabled, user_from_snapshot
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
-# <<< 2. ADD THE DECORATOR HERE >>>
-@database_sync_to_async
-def get_user_from_token(token_string):
+async def get_user_from_db(user_id):
+    return await User.objects.aget(id=user_id)
+
+async def get_user_from_token(token_string):
     """
     Asynchronously gets a user from a JWT access token string.
     Returns AnonymousUser if token is invalid or user doesn't exist.
+    In "snapshot" auth mode the user comes from the user snapshot cache,
+    so a connect does not query the user table.
     """
-    print(f"  [get_user_from_token]: Attempting to decode token...")
     try:
         access_token = AccessToken(token_string)
         user_id = access_token.get('user_id')
         
         if user_id is None:
-            print("  [get_user_from_token]: FAILED. 'user_id' not found in token payload.")
+            logger.info("WebSocket token has no 'user_id' claim.")
             return AnonymousUser()
 
-        user = User.objects.get(id=user_id)
-        print(f"  [get_user_from_token]: Success! Found user '{user.username}'.")
+        if snapshot_auth_enabled():
+            user = user_from_snapshot(await aget_user_snapshot(user_id))
+        else:
+            user = await get_user_from_db(user_id)
         return user
-    except (InvalidToken, TokenError, User.DoesNotExist) as e:
-        print(f"  [get_user_from_token]: FAILED. Error: {type(e).__name__} - {e}")
+    except (InvalidToken, TokenError, AuthenticationFailed, User.DoesNotExist) as e:
+        logger.info("WebSocket token rejected: %s - %s", type(e).__name__, e)
         return AnonymousUser()
 
 class TokenAuthMiddleware:
@@ -46,16 +63,116 @@ class TokenAuthMiddleware:
         query_params = parse_qs(query_string)
         token = query_params.get('token', [None])[0]
 
-        print("\n--- TOKEN AUTH MIDDLEWARE ---")
         if token:
-            print("  > Token found in query string.")
             scope['user'] = await get_user_from_token(token)
         else:
-            print("  > No token found in query string, user is AnonymousUser.")
             scope['user'] = AnonymousUser()
-        print("---------------------------\n")
 
         return await self.app(scope, receive, send)
 
-# A convenient wrapper for asgi.py
-TokenAuthMiddlewareStack = lambda inner: TokenAuthMiddleware(AuthMiddlewareStack(inner))
\ No newline at end of file
+# A convenient wrapper for asgi.py. Sockets authenticate with the JWT only, so the
+# session/cookie lookups of channels' AuthMiddlewareStack are not needed.
+TokenAuthMiddlewareStack = lambda inner: TokenAuthMiddleware(inner)
+
+
+class QueryStats:
+    """
+    Database execute wrapper that counts queries and their total duration.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status and database query count/time for every HTTP request,
+    labelled by URL name (see api/metrics.py). Removed from the stack when
+    METRICS_ENABLED is off.
+    """
+    def __init__(self, get_response):
+        if not metrics.ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        # Unresolved paths share one label so scanners cannot blow up the label set.
+        view = match.view_name if match else 'unmatched'
+        metrics.HTTP_REQUEST_LATENCY.observe(elapsed, view, request.method)
+        metrics.HTTP_REQUESTS.inc(view, request.method, response.status_code)
+        metrics.DB_QUERIES_PER_REQUEST.observe(stats.count, view)
+        metrics.DB_TIME_PER_REQUEST.observe(stats.duration, view)
+        return response
+
+
+def token_user_id(request):
+    """
+    The user id of the request's JWT access token, or None (no token, invalid token).
+    Verifies the token but does not load the user.
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if raw_token is None:
+        return None
+    try:
+        return authentication.get_validated_token(raw_token).get(jwt_settings.USER_ID_CLAIM)
+    except InvalidToken:
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Sends the reads of safe requests to views marked `read_from_replica` to a read
+    replica (api/db_routing.py), unless the requesting user wrote within the last
+    DB_REPLICA["PIN_SECONDS"]. A request that writes pins its user to the primary
+    for that long, so they read their own writes. Removed from the stack when no
+    replica is configured.
+    """
+    def __init__(self, get_response):
+        if not db_routing.replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state, token = db_routing.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            db_routing.end(token)
+        if state.wrote:
+            # DRF sets the authenticated user on the underlying request as well.
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                db_routing.pin_to_primary(user.pk)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        if request.method not in SAFE_METHODS or not getattr(view_class, 'read_from_replica', False):
+            return None
+        user_id = token_user_id(request)
+        if user_id is not None and db_routing.is_pinned(user_id):
+            metrics.DB_ROUTED_REQUESTS.inc(db_routing.PRIMARY)
+            return None
+        state = db_routing.current_state()
+        state.replica = db_routing.choose_replica()
+        metrics.DB_ROUTED_REQUESTS.inc(state.replica)
+        return None
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:41
+
+import api.models
+from django.db import migrations, models
+from django.db.models import Avg, Count, Q
+
+
+def backfill_rating_stats(apps, schema_editor):
+    Review = apps.get_model('api', 'Review')
+    ServiceProviderProfile = apps.get_model('api', 'ServiceProviderProfile')
+    aggregates = {'review_count': Count('id'), 'average_rating': Avg('rating')}
+    for star in range(1, 6):
+        aggregates[f'star_{star}'] = Count('id', filter=Q(rating=star))
+    rows = Review.objects.order_by().values('provider_profile_id').annotate(**aggregates)
+    for row in rows:
+        ServiceProviderProfile.objects.filter(pk=row['provider_profile_id']).update(
+            review_count=row['review_count'],
+            average_rating=round(row['average_rating'], 2),
+            rating_histogram={str(star): row[f'star_{star}'] for star in range(1, 6)},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_remove_servicecategory_icon_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='average_rating',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, help_text='Average review rating (0 when the provider has no reviews).', max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='rating_histogram',
+            field=models.JSONField(default=api.models.empty_rating_histogram, help_text="Number of reviews received per star rating, keyed '1' to '5'."),
+        ),
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of reviews received.'),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:42
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+# Same document as api.search.provider_search_vector(), written as SQL so the backfill
+# does not depend on the current model definitions.
+BACKFILL_SEARCH_DOCUMENTS = """
+UPDATE api_serviceproviderprofile AS p
+SET search_document =
+    setweight(to_tsvector('english', COALESCE(p.business_name, '')), 'A')
+    || setweight(to_tsvector('english', COALESCE(u.username, '')), 'A')
+    || setweight(to_tsvector('english', COALESCE((
+        SELECT string_agg(c.name, ' ')
+        FROM api_servicecategory AS c
+        JOIN api_serviceproviderprofile_services_offered AS so ON so.servicecategory_id = c.id
+        WHERE so.serviceproviderprofile_id = p.user_id
+    ), '')), 'B')
+    || setweight(to_tsvector('english', COALESCE(p.bio, '')), 'C')
+FROM api_user AS u
+WHERE u.id = p.user_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_provider_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='serviceproviderprofile',
+            index=django.contrib.postgres.indexes.GinIndex(condition=models.Q(('status', 'APPROVED')), fields=['search_document'], name='provider_search_document_gin'),
+        ),
+        migrations.RunSQL(BACKFILL_SEARCH_DOCUMENTS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_provider_search_document'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['customer', '-created_at', 'id'], name='booking_customer_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['provider_profile', '-created_at', 'id'], name='booking_provider_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceproviderprofile',
+            index=models.Index(condition=models.Q(('status', 'APPROVED')), fields=['business_name', 'user'], name='provider_name_keyset_idx'),
+        ),
+    ]
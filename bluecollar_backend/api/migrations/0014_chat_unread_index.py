@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['booking', 'sender'], name='chat_unread_by_booking_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_chat_unread_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='room_identifier',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room_identifier', 'timestamp', 'id'], name='chat_room_history_idx'),
+        ),
+    ]
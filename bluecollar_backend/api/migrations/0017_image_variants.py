@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_chatmessage_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicecategory',
+            name='category_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Source hash and generated derivative files of the category image.'),
+        ),
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='profile_picture_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Source hash and generated derivative files of the profile picture.'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='service_geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='service_latitude',
+            field=models.FloatField(blank=True, help_text='Latitude of the service area centre.', null=True),
+        ),
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='service_longitude',
+            field=models.FloatField(blank=True, help_text='Longitude of the service area centre.', null=True),
+        ),
+        migrations.AddField(
+            model_name='serviceproviderprofile',
+            name='service_radius_km',
+            field=models.PositiveIntegerField(default=25, help_text='How far from the centre (km) the provider takes jobs.'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceproviderprofile',
+            index=models.Index(condition=models.Q(('status', 'APPROVED')), fields=['service_geohash'], name='provider_geohash_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,139 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:09
+
+import api.models
+import django.contrib.postgres.constraints
+import django.contrib.postgres.operations
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Same rule as Booking.compute_end_datetime(): bookings without an estimated duration
+# hold BOOKING_CALENDAR["DEFAULT_DURATION_HOURS"].
+BACKFILL_BOOKING_END = """
+UPDATE api_booking
+SET booking_end_datetime = booking_datetime + COALESCE(NULLIF(estimated_duration_hours, 0), %s) * INTERVAL '1 hour'
+"""
+
+# Pairs of active bookings that booking_no_overlap would reject, as the constraint sees them.
+FIND_OVERLAPPING_BOOKINGS = """
+SELECT a.provider_profile_id, a.id, a.booking_datetime, a.booking_end_datetime,
+       b.id, b.booking_datetime, b.booking_end_datetime
+FROM api_booking a
+JOIN api_booking b
+  ON b.provider_profile_id = a.provider_profile_id
+ AND b.id > a.id
+ AND tstzrange(b.booking_datetime, b.booking_end_datetime) && tstzrange(a.booking_datetime, a.booking_end_datetime)
+WHERE a.status IN ('PENDING', 'CONFIRMED', 'IN_PROGRESS')
+  AND b.status IN ('PENDING', 'CONFIRMED', 'IN_PROGRESS')
+ORDER BY a.provider_profile_id, a.booking_datetime, a.id
+"""
+
+
+def check_no_overlapping_bookings(apps, schema_editor):
+    """
+    Stops the migration with a list of the conflicting bookings instead of letting
+    the constraint fail on the first one. Bookings are not cancelled automatically:
+    which of two double-booked jobs goes ahead is the provider's call.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(FIND_OVERLAPPING_BOOKINGS)
+        overlaps = cursor.fetchall()
+    if not overlaps:
+        return
+    lines = [
+        f"  provider {provider_id}: booking {first_id} ({first_start:%Y-%m-%d %H:%M}-{first_end:%H:%M}) "
+        f"overlaps booking {second_id} ({second_start:%Y-%m-%d %H:%M}-{second_end:%H:%M})"
+        for provider_id, first_id, first_start, first_end, second_id, second_start, second_end in overlaps[:50]
+    ]
+    if len(overlaps) > 50:
+        lines.append(f"  ... and {len(overlaps) - 50} more")
+    raise RuntimeError(
+        f"{len(overlaps)} pair(s) of active bookings overlap, so the booking_no_overlap "
+        "constraint cannot be added. Cancel or reschedule one booking of each pair "
+        "(e.g. set its status to CANCELLED_BY_PROVIDER) and run the migration again:\n"
+        + "\n".join(lines)
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_provider_service_area'),
+    ]
+
+    operations = [
+        # GiST support for the provider id equality in the exclusion constraint and index.
+        django.contrib.postgres.operations.BtreeGistExtension(),
+        migrations.CreateModel(
+            name='ProviderBlockedInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField()),
+                ('reason', models.CharField(blank=True, max_length=200)),
+            ],
+            options={
+                'ordering': ['starts_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProviderWorkingHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'Provider working hours',
+                'ordering': ['weekday', 'start_time'],
+            },
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='booking_end_datetime',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            [(BACKFILL_BOOKING_END, [settings.BOOKING_CALENDAR["DEFAULT_DURATION_HOURS"]])],
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='booking_end_datetime',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.RunPython(check_no_overlapping_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('status__in', ('PENDING', 'CONFIRMED', 'IN_PROGRESS'))), expressions=[('provider_profile', '='), (api.models.TsTzRange('booking_datetime', 'booking_end_datetime', django.contrib.postgres.fields.ranges.RangeBoundary()), '&&')], name='booking_no_overlap'),
+        ),
+        migrations.AddField(
+            model_name='providerblockedinterval',
+            name='provider_profile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocked_intervals', to='api.serviceproviderprofile'),
+        ),
+        migrations.AddField(
+            model_name='providerworkinghours',
+            name='provider_profile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='working_hours', to='api.serviceproviderprofile'),
+        ),
+        migrations.AddIndex(
+            model_name='providerblockedinterval',
+            index=django.contrib.postgres.indexes.GistIndex(models.F('provider_profile'), api.models.TsTzRange('starts_at', 'ends_at', django.contrib.postgres.fields.ranges.RangeBoundary()), name='blocked_interval_span_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='providerblockedinterval',
+            constraint=models.CheckConstraint(condition=models.Q(('ends_at__gt', models.F('starts_at'))), name='blocked_interval_end_after_start'),
+        ),
+        migrations.AddConstraint(
+            model_name='providerworkinghours',
+            constraint=models.UniqueConstraint(fields=('provider_profile', 'weekday', 'start_time'), name='working_hours_unique_start'),
+        ),
+        migrations.AddConstraint(
+            model_name='providerworkinghours',
+            constraint=models.CheckConstraint(condition=models.Q(('end_time__gt', models.F('start_time'))), name='working_hours_end_after_start'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# A message flagged is_read had been seen by the room's other participants, so each
+# participant's cursor starts at the newest flagged message someone else sent.
+# Participants are the senders, the customer and provider of a booking room, and
+# the two users named in a direct room.
+BACKFILL_READ_CURSORS = r"""
+WITH participants AS (
+    SELECT DISTINCT room_identifier, sender_id AS user_id FROM api_chatmessage
+    UNION
+    SELECT DISTINCT m.room_identifier, b.customer_id FROM api_chatmessage m JOIN api_booking b ON b.id = m.booking_id
+    UNION
+    SELECT DISTINCT m.room_identifier, b.provider_profile_id FROM api_chatmessage m JOIN api_booking b ON b.id = m.booking_id
+    UNION
+    SELECT DISTINCT room_identifier, substring(room_identifier from '^chat_user_(\d+)_user_\d+$')::bigint
+    FROM api_chatmessage WHERE room_identifier ~ '^chat_user_\d+_user_\d+$'
+    UNION
+    SELECT DISTINCT room_identifier, substring(room_identifier from '^chat_user_\d+_user_(\d+)$')::bigint
+    FROM api_chatmessage WHERE room_identifier ~ '^chat_user_\d+_user_\d+$'
+)
+INSERT INTO api_chatreadcursor (user_id, room_identifier, last_read_message_id, updated_at)
+SELECT p.user_id, p.room_identifier, max(m.id), now()
+FROM participants p
+JOIN api_user u ON u.id = p.user_id
+JOIN api_chatmessage m ON m.room_identifier = p.room_identifier AND m.sender_id <> p.user_id AND m.is_read
+GROUP BY p.user_id, p.room_identifier
+"""
+
+# Reverse of the backfill: a message counts as read once another participant's cursor
+# has reached it. Reads made after this migration are carried back too.
+RESTORE_IS_READ = """
+UPDATE api_chatmessage m
+SET is_read = true
+FROM api_chatreadcursor c
+WHERE c.room_identifier = m.room_identifier AND c.user_id <> m.sender_id AND m.id <= c.last_read_message_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_user_upper_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_identifier', models.CharField(max_length=255)),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatreadcursor',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_cursors', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='chatreadcursor',
+            constraint=models.UniqueConstraint(fields=('user', 'room_identifier'), name='chat_read_cursor_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room_identifier', 'id'], name='chat_room_id_idx'),
+        ),
+        # Carry the old flags over before they go (and back when unapplied).
+        migrations.RunSQL(BACKFILL_READ_CURSORS, RESTORE_IS_READ),
+        migrations.RemoveIndex(
+            model_name='chatmessage',
+            name='chat_unread_by_booking_idx',
+        ),
+        migrations.RemoveField(
+            model_name='chatmessage',
+            name='is_read',
+        ),
+    ]
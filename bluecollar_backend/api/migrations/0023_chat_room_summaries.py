@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# One summary per existing room, from its newest message; participants as in
+# ChatRoomSummary.record_messages.
+BACKFILL_ROOM_SUMMARIES = r"""
+INSERT INTO api_chatroomsummary (
+    room_identifier, booking_id, participant_a_id, participant_b_id,
+    last_message_id, last_sender_id, last_message_preview, last_activity_at
+)
+SELECT m.room_identifier, m.booking_id, LEAST(p.first, p.second), GREATEST(p.first, p.second),
+       m.id, m.sender_id, left(m.message_content, 140), m.timestamp
+FROM (
+    SELECT DISTINCT ON (room_identifier) id, room_identifier, booking_id, sender_id, message_content, timestamp
+    FROM api_chatmessage
+    ORDER BY room_identifier, timestamp DESC, id DESC
+) m
+LEFT JOIN api_booking b ON b.id = m.booking_id
+CROSS JOIN LATERAL (
+    SELECT COALESCE(b.customer_id, substring(m.room_identifier from '^chat_user_(\d+)_user_\d+$')::bigint) AS first,
+           COALESCE(b.provider_profile_id, substring(m.room_identifier from '^chat_user_\d+_user_(\d+)$')::bigint) AS second
+) p
+WHERE EXISTS (SELECT 1 FROM api_user WHERE id = p.first)
+  AND EXISTS (SELECT 1 FROM api_user WHERE id = p.second)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_chat_read_cursors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatRoomSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_identifier', models.CharField(max_length=255, unique=True)),
+                ('last_message_id', models.BigIntegerField()),
+                ('last_message_preview', models.CharField(max_length=140)),
+                ('last_activity_at', models.DateTimeField()),
+                ('booking', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chat_summaries', to='api.booking')),
+                ('last_sender', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('participant_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('participant_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['participant_a', '-last_activity_at', 'id'], name='chat_summary_a_recent_idx'), models.Index(fields=['participant_b', '-last_activity_at', 'id'], name='chat_summary_b_recent_idx')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_ROOM_SUMMARIES, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Model options and help texts that had changed without a migration. Metadata only
+# (no SQL), so databases that recorded these changes earlier apply it as a no-op.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_chat_room_summaries'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='servicecategory',
+            options={'ordering': ['name'], 'verbose_name_plural': 'Service Categories'},
+        ),
+        migrations.AlterField(
+            model_name='servicecategory',
+            name='description',
+            field=models.TextField(blank=True, help_text='Optional: A brief description.'),
+        ),
+        migrations.AlterField(
+            model_name='servicecategory',
+            name='icon_class',
+            field=models.CharField(blank=True, help_text="Name of the React Icon component (e.g., 'FaWrench').", max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='servicecategory',
+            name='name',
+            field=models.CharField(help_text='Name of the service category (e.g., Plumbing).', max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='serviceproviderprofile',
+            name='bio',
+            field=models.TextField(blank=True, help_text='A short biography or description.'),
+        ),
+        migrations.AlterField(
+            model_name='serviceproviderprofile',
+            name='business_name',
+            field=models.CharField(blank=True, help_text='Official business name.', max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='serviceproviderprofile',
+            name='user',
+            field=models.OneToOneField(help_text='The user account associated with this profile.', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='provider_profile', serialize=False, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,9 +1,48 @@
 # File: api/models.py
-from django.db import models
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import connection, models
+from django.db.models import Avg, CharField, Count, F, Func, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Concat, Upper
 from django.conf import settings
+from django.utils import timezone
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeBoundary, RangeOperators
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import AbstractUser
 
-class User(AbstractUser):
+from .geo import encode_geohash
+
+class LoadedValuesMixin:
+    """
+    Remembers field values as loaded from the database (Django's documented `from_db`
+    pattern) so signal handlers can tell whether a save changed a given field.
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # post_save handlers have seen the old values by now; later saves of this same
+        # instance compare against what this save wrote.
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in self.get_deferred_fields()
+        }
+
+    def field_changed(self, attname):
+        # New instances and deferred fields count as changed.
+        loaded = getattr(self, "_loaded_values", {})
+        return attname not in loaded or loaded[attname] != getattr(self, attname)
+
+
+class User(LoadedValuesMixin, AbstractUser):
     """
     Custom User model. `is_provider` being True signifies an Admin-approved provider.
     """
@@ -12,10 +51,18 @@ class User(AbstractUser):
         help_text="Designates whether this user is an approved service provider.",
     )
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Case-insensitive existence checks at registration and bulk import
+            # (username__iexact / email__iexact compare UPPER() values).
+            models.Index(Upper('username'), name='user_username_upper_idx'),
+            models.Index(Upper('email'), name='user_email_upper_idx'),
+        ]
+
     def __str__(self):
         return self.username
 
-class ServiceCategory(models.Model):
+class ServiceCategory(LoadedValuesMixin, models.Model):
     """
     Represents a category of service, e.g., Plumbing, Electrical.
     """
@@ -41,6 +88,13 @@ class ServiceCategory(models.Model):
         null=True,
         help_text="An image representing the service category (for landing page, etc.).",
     )
+    # Resized WebP/JPEG copies of `category_image`, written by api.images after upload.
+    category_image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Source hash and generated derivative files of the category image.",
+    )
 
     class Meta:
         verbose_name_plural = "Service Categories"
@@ -49,7 +103,14 @@ class ServiceCategory(models.Model):
     def __str__(self):
         return self.name
 
-class ServiceProviderProfile(models.Model):
+def empty_rating_histogram():
+    """
+    Default value for `ServiceProviderProfile.rating_histogram`: one bucket per star.
+    """
+    return {str(star): 0 for star in range(1, 6)}
+
+
+class ServiceProviderProfile(LoadedValuesMixin, models.Model):
     """
     Holds detailed information for a service provider, linked to a User account.
     """
@@ -83,6 +144,13 @@ class ServiceProviderProfile(models.Model):
         null=True,
         help_text="A profile picture for the service provider."
     )
+    # Resized WebP/JPEG copies of `profile_picture`, written by api.images after upload.
+    profile_picture_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Source hash and generated derivative files of the profile picture.",
+    )
     services_offered = models.ManyToManyField(
         ServiceCategory,
         blank=True,
@@ -95,12 +163,218 @@ class ServiceProviderProfile(models.Model):
         default=ProfileStatus.PENDING,
         help_text="The approval status of this provider profile.",
     )
+    # Denormalized review aggregates, maintained by `refresh_rating_stats()` whenever a
+    # Review is written so list/detail responses never have to run Avg() per provider.
+    average_rating = models.DecimalField(
+        max_digits=3,
+        decimal_places=2,
+        default=0,
+        db_index=True,
+        help_text="Average review rating (0 when the provider has no reviews).",
+    )
+    review_count = models.PositiveIntegerField(
+        default=0, help_text="Number of reviews received."
+    )
+    rating_histogram = models.JSONField(
+        default=empty_rating_histogram,
+        help_text="Number of reviews received per star rating, keyed '1' to '5'.",
+    )
+    # Weighted full-text document (business name, username, categories, bio), rebuilt by
+    # `api.search.refresh_provider_search_documents` whenever one of its sources changes.
+    search_document = SearchVectorField(null=True, editable=False)
+    # Service area: a centre point and the distance the provider travels from it.
+    service_latitude = models.FloatField(
+        null=True, blank=True, help_text="Latitude of the service area centre."
+    )
+    service_longitude = models.FloatField(
+        null=True, blank=True, help_text="Longitude of the service area centre."
+    )
+    service_radius_km = models.PositiveIntegerField(
+        default=25, help_text="How far from the centre (km) the provider takes jobs."
+    )
+    # Geohash of the service area centre, kept in step by save(); prefix-searched by
+    # `api.geo.providers_near`. Empty when no location is set.
+    service_geohash = models.CharField(max_length=12, blank=True, default="", editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=["search_document"],
+                name="provider_search_document_gin",
+                condition=Q(status="APPROVED"),
+            ),
+            # Keyset pagination of the directory: ORDER BY business_name, user_id.
+            models.Index(
+                fields=["business_name", "user"],
+                name="provider_name_keyset_idx",
+                condition=Q(status="APPROVED"),
+            ),
+            # Geohash prefix (LIKE 'abc%') lookups for distance search.
+            models.Index(
+                fields=["service_geohash"],
+                name="provider_geohash_idx",
+                opclasses=["varchar_pattern_ops"],
+                condition=Q(status="APPROVED"),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.business_name or self.user.username} ({self.get_status_display()})"
 
+    def save(self, *args, **kwargs):
+        self.service_geohash = self.compute_service_geohash()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"service_latitude", "service_longitude"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"service_geohash"}
+        super().save(*args, **kwargs)
+
+    def compute_service_geohash(self):
+        if self.service_latitude is None or self.service_longitude is None:
+            return ""
+        return encode_geohash(self.service_latitude, self.service_longitude)
+
+    @staticmethod
+    def rating_stats_aggregates():
+        """
+        Aggregate expressions over `Review` rows that produce the denormalized rating fields.
+        """
+        aggregates = {"review_count": Count("id"), "average_rating": Avg("rating")}
+        for star in range(1, 6):
+            aggregates[f"star_{star}"] = Count("id", filter=Q(rating=star))
+        return aggregates
+
+    @staticmethod
+    def rating_stats_from_aggregates(row):
+        """
+        Converts a row produced by `rating_stats_aggregates()` into model field values.
+        """
+        average = row.get("average_rating")
+        return {
+            "review_count": row.get("review_count") or 0,
+            "average_rating": (
+                Decimal(str(average)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+                if average is not None else Decimal("0.00")
+            ),
+            "rating_histogram": {str(star): row.get(f"star_{star}") or 0 for star in range(1, 6)},
+        }
+
+    @classmethod
+    def refresh_rating_stats(cls, provider_profile_id):
+        """
+        Recomputes the rating fields of one provider from its reviews.
+        Must run inside a transaction.
+        """
+        # Lock the profile row first: a concurrent review write for the same provider
+        # waits here, and its aggregate below then sees this transaction's review.
+        cls.objects.select_for_update().filter(pk=provider_profile_id).values_list("pk", flat=True).first()
+        row = Review.objects.filter(provider_profile_id=provider_profile_id).aggregate(
+            **cls.rating_stats_aggregates()
+        )
+        cls.objects.filter(pk=provider_profile_id).update(**cls.rating_stats_from_aggregates(row))
+
+
+class TsTzRange(Func):
+    function = "TSTZRANGE"
+    output_field = DateTimeRangeField()
+
+
+def time_span(start_field, end_field):
+    """
+    The half-open [start, end) range of two timestamp columns. Range indexes and the
+    queries meant to use them must build the expression the same way.
+    """
+    return TsTzRange(start_field, end_field, RangeBoundary())
+
+
+class ProviderWorkingHours(models.Model):
+    """
+    A weekly opening window of a provider, in the site time zone. A provider without
+    any windows takes bookings at any time.
+    """
+    WEEKDAY_CHOICES = [(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')]
+    provider_profile = models.ForeignKey(ServiceProviderProfile, on_delete=models.CASCADE, related_name='working_hours')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    class Meta:
+        verbose_name_plural = "Provider working hours"
+        ordering = ['weekday', 'start_time']
+        constraints = [
+            models.UniqueConstraint(fields=['provider_profile', 'weekday', 'start_time'], name='working_hours_unique_start'),
+            models.CheckConstraint(condition=Q(end_time__gt=F('start_time')), name='working_hours_end_after_start'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider_profile_id}: {self.get_weekday_display()} {self.start_time:%H:%M}-{self.end_time:%H:%M}"
+
+
+class ProviderBlockedInterval(models.Model):
+    """
+    A period in which a provider takes no bookings (holiday, other commitments).
+    """
+    provider_profile = models.ForeignKey(ServiceProviderProfile, on_delete=models.CASCADE, related_name='blocked_intervals')
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    reason = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ['starts_at']
+        constraints = [
+            models.CheckConstraint(condition=Q(ends_at__gt=F('starts_at')), name='blocked_interval_end_after_start'),
+        ]
+        indexes = [
+            # Overlap lookups per provider: provider = ... AND span && [from, to).
+            GistIndex(F('provider_profile'), time_span('starts_at', 'ends_at'), name='blocked_interval_span_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider_profile_id}: blocked {self.starts_at:%Y-%m-%d %H:%M} to {self.ends_at:%Y-%m-%d %H:%M}"
+
+
+# Bookings in these states hold their time slot; the others free it again.
+ACTIVE_BOOKING_STATUSES = ('PENDING', 'CONFIRMED', 'IN_PROGRESS')
+
+
+def annotate_unread_message_counts(queryset, user, room):
+    """
+    Annotates `unread_messages_count` on `queryset`: chat messages in the room named
+    by the expression `room` that come after `user`'s read cursor and were sent by
+    someone else. The counts are correlated subqueries of the same SELECT, so the
+    query count does not grow with the number of rows, and each one walks the
+    (room_identifier, id) index from the cursor on, so it only visits unread messages.
+    """
+    last_read = ChatReadCursor.objects.filter(
+        user_id=user.pk, room_identifier=OuterRef("chat_room")
+    ).values("last_read_message_id")[:1]
+    unread = (
+        ChatMessage.objects.filter(room_identifier=OuterRef("chat_room"), id__gt=OuterRef("chat_last_read"))
+        .exclude(sender_id=user.pk)
+        .order_by()
+        .values("room_identifier")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    return queryset.alias(
+        chat_room=room,
+        chat_last_read=Coalesce(Subquery(last_read), 0),
+    ).annotate(
+        unread_messages_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0)
+    )
+
 
-class Booking(models.Model):
+class BookingQuerySet(models.QuerySet):
+    def with_unread_message_counts(self, user):
+        """
+        Annotates `unread_messages_count` for each booking's chat room (see
+        annotate_unread_message_counts).
+        """
+        return annotate_unread_message_counts(
+            self, user, Concat(Value("booking_"), "pk", output_field=CharField())
+        )
+
+
+class Booking(LoadedValuesMixin, models.Model):
     # ... (Your Booking model is fine, no changes needed)
     STATUS_CHOICES = [('PENDING', 'Pending Confirmation'), ('CONFIRMED', 'Confirmed by Provider'), ('IN_PROGRESS', 'In Progress'), ('COMPLETED', 'Completed'), ('CANCELLED_BY_USER', 'Cancelled by User'), ('CANCELLED_BY_PROVIDER', 'Cancelled by Provider'), ('REJECTED_BY_PROVIDER', 'Rejected by Provider')]
     customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings_as_customer', limit_choices_to={'is_provider': False})
@@ -111,16 +385,98 @@ class Booking(models.Model):
     address_for_service = models.CharField(max_length=255)
     status = models.CharField(max_length=30, choices=STATUS_CHOICES, default='PENDING')
     estimated_duration_hours = models.DecimalField(max_digits=4, decimal_places=1, null=True, blank=True)
+    # booking_datetime + estimated_duration_hours (or the default duration), kept in step by save().
+    booking_end_datetime = models.DateTimeField(editable=False)
     quoted_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     provider_notes = models.TextField(blank=True)
     customer_notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Incremented by every write; status changes only apply to the version they were read at.
+    version = models.PositiveIntegerField(default=1, editable=False)
+    objects = BookingQuerySet.as_manager()
+
+    # Allowed status changes and who may make them. Any other change is refused, and
+    # the statuses without an entry are final.
+    STATUS_TRANSITIONS = {
+        'PENDING': {'CONFIRMED': 'provider', 'REJECTED_BY_PROVIDER': 'provider', 'CANCELLED_BY_USER': 'customer'},
+        'CONFIRMED': {'IN_PROGRESS': 'provider', 'CANCELLED_BY_PROVIDER': 'provider', 'CANCELLED_BY_USER': 'customer'},
+        'IN_PROGRESS': {'COMPLETED': 'provider'},
+    }
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a user's bookings: ORDER BY created_at DESC, id.
+            models.Index(fields=['customer', '-created_at', 'id'], name='booking_customer_keyset_idx'),
+            models.Index(fields=['provider_profile', '-created_at', 'id'], name='booking_provider_keyset_idx'),
+        ]
+        constraints = [
+            # No two active bookings of a provider may overlap. Enforced by a GiST index,
+            # so concurrent requests for the same slot cannot both succeed.
+            ExclusionConstraint(
+                name='booking_no_overlap',
+                expressions=[
+                    ('provider_profile', RangeOperators.EQUAL),
+                    (time_span('booking_datetime', 'booking_end_datetime'), RangeOperators.OVERLAPS),
+                ],
+                condition=Q(status__in=ACTIVE_BOOKING_STATUSES),
+            ),
+        ]
     def __str__(self):
         return f"Booking #{self.id} for {self.customer.username} with {self.provider_profile.business_name or self.provider_profile.user.username}"
 
+    def save(self, *args, **kwargs):
+        self.booking_end_datetime = self.compute_end_datetime()
+        update_fields = kwargs.get("update_fields")
+        bump_version = not self._state.adding
+        if bump_version:
+            # Plain saves (admin, scripts) are changes too: a transition read before them must
+            # fail. Incremented in the database, so a stale instance cannot reuse a version.
+            self.version = F("version") + 1
+            if update_fields is not None:
+                update_fields = kwargs["update_fields"] = set(update_fields) | {"version"}
+        if update_fields is not None and {"booking_datetime", "estimated_duration_hours"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"booking_end_datetime"}
+        super().save(*args, **kwargs)
+        if bump_version:
+            self.refresh_from_db(fields=["version"])
+            self._loaded_values["version"] = self.version
+
+    def allowed_transitions(self, role):
+        """
+        Statuses `role` ('customer' or 'provider') may move this booking to.
+        """
+        return [status for status, actor in self.STATUS_TRANSITIONS.get(self.status, {}).items() if actor == role]
+
+    @classmethod
+    def apply_transition(cls, booking, to_status, version):
+        """
+        Moves `booking` from its current status to `to_status` if it is still at
+        `version`, as a single conditional UPDATE of the status, version and updated_at
+        columns (no row lock, nothing else rewritten). On success the instance is updated
+        and the new version returned; returns None when the booking changed since it was
+        read.
+        """
+        from_status = booking.status
+        now = timezone.now()
+        updated = cls.objects.filter(pk=booking.pk, status=from_status, version=version).update(
+            status=to_status, version=version + 1, updated_at=now
+        )
+        if not updated:
+            return None
+        booking.status, booking.version, booking.updated_at = to_status, version + 1, now
+        return booking.version
+
+    def compute_end_datetime(self):
+        return self.booking_datetime + self.duration(self.estimated_duration_hours)
+
+    @staticmethod
+    def duration(hours):
+        if not hours:
+            hours = settings.BOOKING_CALENDAR["DEFAULT_DURATION_HOURS"]
+        return timedelta(hours=float(hours))
+
 
 class Review(models.Model):
     # ... (Your Review model is fine, no changes needed)
@@ -137,9 +493,9 @@ class Review(models.Model):
     def __str__(self):
         return f"Review for Booking #{self.booking.id} by {self.reviewer.username} - {self.rating} stars"
     def save(self, *args, **kwargs):
-        if self.booking and self.reviewer != self.booking.customer:
+        if self.booking and self.reviewer_id != self.booking.customer_id:
             raise ValueError("Reviewer must be the customer of the booking.")
-        if self.booking and self.provider_profile != self.booking.provider_profile:
+        if self.booking and self.provider_profile_id != self.booking.provider_profile_id:
             raise ValueError("Reviewed provider must be the provider of the booking.")
         super().save(*args, **kwargs)
 
@@ -149,10 +505,171 @@ class ChatMessage(models.Model):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='chat_messages', null=True, blank=True)
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_chat_messages')
     message_content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
-    room_identifier = models.CharField(max_length=255, db_index=True)
+    # A default rather than auto_now_add so the write-behind writer can assign the
+    # timestamp it broadcast before the row is inserted.
+    timestamp = models.DateTimeField(default=timezone.now)
+    room_identifier = models.CharField(max_length=255)
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Room history pages: WHERE room_identifier = ... ORDER BY timestamp, id.
+            # Also serves plain lookups by room, so the column needs no index of its own.
+            models.Index(fields=['room_identifier', 'timestamp', 'id'], name='chat_room_history_idx'),
+            # Unread counts: WHERE room_identifier = ... AND id > <read cursor>.
+            models.Index(fields=['room_identifier', 'id'], name='chat_room_id_idx'),
+        ]
     def __str__(self):
-        return f"From {self.sender.username} in room '{self.room_identifier}' at {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
\ No newline at end of file
+        return f"From {self.sender.username} in room '{self.room_identifier}' at {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+class ChatReadCursor(models.Model):
+    """
+    How far one participant has read one chat room: every message with an id up to
+    `last_read_message_id` counts as read by `user`. Ids come from one sequence, so
+    they order the messages of a room; only with write-behind in several processes
+    can messages sent in the same instant get ids slightly out of order.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_read_cursors')
+    room_identifier = models.CharField(max_length=255)
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'room_identifier'], name='chat_read_cursor_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} read '{self.room_identifier}' up to {self.last_read_message_id}"
+
+    @classmethod
+    def advance(cls, user_id, room_identifier, message_id):
+        """
+        Moves the user's cursor in the room forward to `message_id`, creating it if
+        needed, in one upsert; a cursor never moves back. Ids past the room's newest
+        message are clamped to it (the room_identifier, id index answers that), so a
+        client cannot mark messages read before they exist. Returns the cursor's value.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {cls._meta.db_table} (user_id, room_identifier, last_read_message_id, updated_at)
+                VALUES (%s, %s, LEAST(%s, (
+                    SELECT COALESCE(max(id), 0) FROM {ChatMessage._meta.db_table} WHERE room_identifier = %s
+                )), now())
+                ON CONFLICT (user_id, room_identifier) DO UPDATE
+                SET last_read_message_id = GREATEST({cls._meta.db_table}.last_read_message_id, EXCLUDED.last_read_message_id),
+                    updated_at = EXCLUDED.updated_at
+                RETURNING last_read_message_id
+                """,
+                [user_id, room_identifier, message_id, room_identifier],
+            )
+            return cursor.fetchone()[0]
+
+    @classmethod
+    def unread_count(cls, user_id, room_identifier):
+        """
+        Messages in the room after the user's cursor, sent by someone else.
+        """
+        last_read = cls.objects.filter(user_id=user_id, room_identifier=room_identifier).values_list(
+            'last_read_message_id', flat=True
+        ).first() or 0
+        return ChatMessage.objects.filter(room_identifier=room_identifier, id__gt=last_read).exclude(
+            sender_id=user_id
+        ).count()
+
+
+# Characters of the last message kept in a room summary.
+CHAT_PREVIEW_LENGTH = 140
+
+
+class ChatRoomSummaryQuerySet(models.QuerySet):
+    def for_user(self, user):
+        return self.filter(Q(participant_a_id=user.pk) | Q(participant_b_id=user.pk))
+
+    def with_unread_message_counts(self, user):
+        return annotate_unread_message_counts(self, user, F("room_identifier"))
+
+
+class ChatRoomSummary(models.Model):
+    """
+    One row per chat room with its two participants and its latest message, kept up
+    to date in the transaction that inserts messages (see `record_messages`). The
+    inbox lists a user's rooms from here instead of scanning ChatMessage.
+    """
+    room_identifier = models.CharField(max_length=255, unique=True)
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='chat_summaries', null=True, blank=True)
+    # The room's two users, lower id first.
+    participant_a = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    participant_b = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_message_id = models.BigIntegerField()
+    last_sender = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    last_message_preview = models.CharField(max_length=CHAT_PREVIEW_LENGTH)
+    last_activity_at = models.DateTimeField()
+
+    objects = ChatRoomSummaryQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # A user's inbox, newest first: WHERE participant_x = ... ORDER BY last_activity_at DESC, id.
+            models.Index(fields=['participant_a', '-last_activity_at', 'id'], name='chat_summary_a_recent_idx'),
+            models.Index(fields=['participant_b', '-last_activity_at', 'id'], name='chat_summary_b_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"'{self.room_identifier}' last active {self.last_activity_at:%Y-%m-%d %H:%M}"
+
+    def other_participant(self, user):
+        return self.participant_b if self.participant_a_id == user.pk else self.participant_a
+
+    @classmethod
+    def record_messages(cls, messages):
+        """
+        Makes the newest of `messages` (saved ChatMessage instances) the last message of
+        its room, in one upsert for all rooms involved. A summary only moves forward in
+        (timestamp, id) order, so batches written out of order cannot roll it back. New
+        summaries take their participants from the booking, or from the user ids in a
+        direct room's name; rooms without two existing users are skipped.
+        """
+        newest = {}
+        for message in messages:
+            current = newest.get(message.room_identifier)
+            if current is None or (message.timestamp, message.id) > (current.timestamp, current.id):
+                newest[message.room_identifier] = message
+        if not newest:
+            return
+        rows, params = [], []
+        for message in newest.values():
+            rows.append("(%s, %s::bigint, %s::bigint, %s::bigint, %s, %s::timestamptz)")
+            params.extend([
+                message.room_identifier, message.booking_id, message.id, message.sender_id,
+                message.message_content[:CHAT_PREVIEW_LENGTH], message.timestamp,
+            ])
+        table, users = cls._meta.db_table, User._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                rf"""
+                INSERT INTO {table} (
+                    room_identifier, booking_id, participant_a_id, participant_b_id,
+                    last_message_id, last_sender_id, last_message_preview, last_activity_at
+                )
+                SELECT v.room, v.booking_id, LEAST(p.first, p.second), GREATEST(p.first, p.second),
+                       v.message_id, v.sender_id, v.preview, v.sent_at
+                FROM (VALUES {", ".join(rows)}) AS v (room, booking_id, message_id, sender_id, preview, sent_at)
+                LEFT JOIN {Booking._meta.db_table} b ON b.id = v.booking_id
+                CROSS JOIN LATERAL (
+                    SELECT COALESCE(b.customer_id, substring(v.room from '^chat_user_(\d+)_user_\d+$')::bigint) AS first,
+                           COALESCE(b.provider_profile_id, substring(v.room from '^chat_user_\d+_user_(\d+)$')::bigint) AS second
+                ) p
+                WHERE EXISTS (SELECT 1 FROM {users} WHERE id = p.first)
+                  AND EXISTS (SELECT 1 FROM {users} WHERE id = p.second)
+                ON CONFLICT (room_identifier) DO UPDATE SET
+                    last_message_id = EXCLUDED.last_message_id,
+                    last_sender_id = EXCLUDED.last_sender_id,
+                    last_message_preview = EXCLUDED.last_message_preview,
+                    last_activity_at = EXCLUDED.last_activity_at
+                WHERE ({table}.last_activity_at, {table}.last_message_id)
+                    < (EXCLUDED.last_activity_at, EXCLUDED.last_message_id)
+                """,
+                params,
+            )
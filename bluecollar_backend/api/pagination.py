@@ -0,0 +1,163 @@
+# File: api/pagination.py
+
+import base64
+import binascii
+import datetime
+import json
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _encode_value(value):
+    # Full precision on purpose: a truncated timestamp would skip or repeat rows.
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a composite, unique ordering such as ("-created_at", "id").
+
+    The cursor is the ordering values of the last row of the previous page, so every
+    page is a single index range scan (`WHERE (keys) after (cursor) ... LIMIT n`) and no
+    COUNT(*) is ever run. The view provides the ordering through `get_keyset_ordering()`;
+    every key must be a model field (or an annotation present on the queryset) and the
+    last key must make the ordering unique.
+
+    Pagination is opt-in: lists are only paginated when `page_size` or `cursor` is
+    passed, so existing clients keep getting the full list.
+
+    A view whose rows match one of several columns (`a = x OR b = x`) can list the
+    alternatives in `get_keyset_partitions()`; see merge_partitions().
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    default_page_size = 20
+    max_page_size = 100
+    opt_in = True
+    invalid_cursor_message = "Invalid cursor."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.opt_in and self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.ordering = tuple(view.get_keyset_ordering())
+        self.page_size = self.get_page_size(request)
+        model = queryset.model
+
+        encoded = params.get(self.cursor_query_param)
+        if encoded:
+            position = self.decode_cursor(encoded, model)
+            queryset = queryset.filter(self.position_filter(position))
+        if hasattr(view, "get_keyset_partitions"):
+            queryset = self.merge_partitions(queryset, view.get_keyset_partitions(), self.page_size + 1)
+
+        rows = list(queryset.order_by(*self.ordering)[: self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        self.next_position = [self.row_value(rows[-1], key) for key in self.ordering] if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.default_page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    # --- Cursor encoding ---
+
+    @staticmethod
+    def _key_name(key):
+        return key.lstrip("-")
+
+    def row_value(self, row, key):
+        return getattr(row, self._key_name(key))
+
+    def encode_cursor(self, position):
+        payload = json.dumps([_encode_value(value) for value in position], separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, encoded, model):
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [self.to_python(model, key, value) for key, value in zip(self.ordering, position)]
+        except (DjangoValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def to_python(self, model, key, value):
+        try:
+            field = model._meta.get_field(self._key_name(key))
+        except FieldDoesNotExist:
+            # Annotations (e.g. a search rank) are stored as plain JSON numbers.
+            if not isinstance(value, (int, float)):
+                raise ValueError(value)
+            return value
+        return field.to_python(value)
+
+    # --- Keyset filter ---
+
+    def merge_partitions(self, queryset, partitions, limit):
+        """
+        Narrows `queryset` to the first `limit` rows of each partition (disjoint Q
+        objects that together cover the queryset's rows), merged with UNION ALL:
+        WHERE pk IN ((... AND a = x ORDER BY keys LIMIT n) UNION ALL (... AND b = x ...)).
+        Each branch is a top-N scan of its own (a, keys) index, whereas for the OR of
+        both the planner has to collect and sort every matching row before the LIMIT.
+        """
+        branches = [
+            queryset.filter(partition).order_by(*self.ordering).values("pk")[:limit] for partition in partitions
+        ]
+        return queryset.filter(pk__in=branches[0].union(*branches[1:], all=True))
+
+    def position_filter(self, position):
+        """
+        Rows strictly after `position` in the keyset ordering:
+        (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ..., with ">" flipped for descending keys.
+        The leading key is also bounded on its own (k1 >= v1) so the planner can start
+        the index scan at the cursor instead of filtering from the first row.
+        """
+        after = Q()
+        equal_prefix = {}
+        for key, value in zip(self.ordering, position):
+            name = self._key_name(key)
+            lookup = "lt" if key.startswith("-") else "gt"
+            after |= Q(**equal_prefix, **{f"{name}__{lookup}": value})
+            equal_prefix[name] = value
+        first_key, first_value = self.ordering[0], position[0]
+        bound = "lte" if first_key.startswith("-") else "gte"
+        return Q(**{f"{self._key_name(first_key)}__{bound}": first_value}) & after
+
+
+class InboxPagination(KeysetPagination):
+    """
+    KeysetPagination for lists that are always paginated, such as the chat inbox.
+    """
+    opt_in = False
@@ -0,0 +1,42 @@
+# File: api/password_hashing.py
+#
+# Process-pool workers for hashing passwords in bulk (api/management/commands/
+# import_providers.py). Nothing Django-model related is imported at module level:
+# workers are spawned, and set Django up in `init_worker` before any task runs.
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def init_worker():
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def hash_password(job):
+    """
+    Validates a password against the configured validators and hashes it.
+    `job` is (password, user field values for the similarity check). Returns
+    (hash, None) or (None, [messages]).
+    """
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.password_validation import validate_password
+    from django.core.exceptions import ValidationError
+
+    password, user_fields = job
+    try:
+        validate_password(password, get_user_model()(**user_fields))
+    except ValidationError as e:
+        return None, list(e.messages)
+    return make_password(password), None
+
+
+def hashing_pool(workers):
+    # Spawned rather than forked, so the workers never share the parent's database connection.
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker
+    )
@@ -15,7 +15,7 @@ class CanReviewBookingPermission(permissions.BasePermission):
             self.message = "Invalid object for review permission check."
             return False
 
-        if obj.customer != request.user:
+        if obj.customer_id != request.user.id:
             self.message = "You can only review your own bookings."
             return False
 
@@ -38,30 +38,16 @@ class IsCustomerUser(permissions.BasePermission):
     message = "Only customer users are permitted to perform this action."
 
     def has_permission(self, request, view):
-        print("\n--- IsCustomerUser PERMISSION CHECK ---")
-        
         user = request.user
-        print(f"  Request User object: {user}")
-        print(f"  User Type: {type(user)}")
-        
+
         if not (user and user.is_authenticated):
-            print(f"  RESULT: FAILED - User is not authenticated.")
             self.message = "Authentication required."
             return False
 
-        # Use getattr for safe access, though it should exist
-        is_provider_flag = getattr(user, 'is_provider', 'ATTRIBUTE_NOT_FOUND')
-        
-        print(f"  User Details: username='{user.username}', id={user.id}")
-        print(f"  Checking 'is_provider' attribute: Value = {is_provider_flag}")
-        
-        if is_provider_flag is True:
-            print(f"  RESULT: FAILED - User '{user.username}' has is_provider=True.")
+        if user.is_provider:
             self.message = "Service providers cannot create bookings as customers."
             return False
-        
-        print(f"  RESULT: PASSED - User '{user.username}' is a customer.")
-        print("-------------------------------------\n")
+
         return True    
     
     class IsProfileOwner(permissions.BasePermission):
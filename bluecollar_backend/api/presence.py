@@ -0,0 +1,179 @@
+# File: api/presence.py
+
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+ONLINE = "online"
+AWAY = "away"
+OFFLINE = "offline"
+# Statuses a client may report in a heartbeat.
+CLIENT_STATUSES = (ONLINE, AWAY)
+
+
+def presence_enabled():
+    return settings.CHAT_PRESENCE.get("ENABLED", True)
+
+
+def presence_group(user_id):
+    """
+    Channel-layer group of everyone watching `user_id`'s presence.
+    """
+    return f"presence_{user_id}"
+
+
+def _key(user_id):
+    return f"presence:{user_id}"
+
+
+def _sockets_key(user_id):
+    return f"presence-sockets:{user_id}"
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat() if timestamp is not None else None
+
+
+def describe(entry, now=None):
+    """
+    The presence event for a stored `(status, heartbeat_at)` entry, or for None when
+    nothing is stored: {"status", "last_seen", "expires_in"}. An online or away entry
+    whose last heartbeat is older than EXPIRY reads as offline.
+    """
+    if entry is None:
+        return {"status": OFFLINE, "last_seen": None, "expires_in": None}
+    status, seen_at = entry
+    remaining = settings.CHAT_PRESENCE["EXPIRY"] - ((now or time.time()) - seen_at)
+    if status == OFFLINE or remaining <= 0:
+        return {"status": OFFLINE, "last_seen": _iso(seen_at), "expires_in": None}
+    return {"status": status, "last_seen": _iso(seen_at), "expires_in": round(remaining, 1)}
+
+
+def record(user_id, status):
+    """
+    Stores `user_id`'s status as of now and returns the presence event for it. An
+    online or away status also keeps the user's socket count alive for EXPIRY.
+    """
+    entry = (status, time.time())
+    cache.set(_key(user_id), entry, settings.CHAT_PRESENCE["LAST_SEEN_TTL"])
+    if status != OFFLINE:
+        cache.touch(_sockets_key(user_id), settings.CHAT_PRESENCE["EXPIRY"])
+    return describe(entry, entry[1])
+
+
+def lookup(user_ids):
+    """
+    {user_id: presence event} for `user_ids`, in one cache round trip.
+    """
+    now = time.time()
+    entries = cache.get_many([_key(user_id) for user_id in user_ids])
+    return {user_id: describe(entries.get(_key(user_id)), now) for user_id in user_ids}
+
+
+# Cache calls run on the default thread pool, not the database threads.
+arecord = sync_to_async(record, thread_sensitive=False)
+alookup = sync_to_async(lookup, thread_sensitive=False)
+
+
+# --- Open sockets per user ---
+# Counted in the shared cache, so a user going offline is only announced when their
+# last socket on any worker closes. Heartbeats (record) keep the count alive; the
+# sockets of a crashed worker stop doing so, and the count lapses EXPIRY seconds
+# later, as the presence entries themselves do.
+
+def socket_opened(user_id):
+    key, expiry = _sockets_key(user_id), settings.CHAT_PRESENCE["EXPIRY"]
+    if cache.add(key, 1, expiry):
+        return 1
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Expired since the add() above.
+        cache.add(key, 1, expiry)
+        return 1
+    if count < 1:
+        # Closes counted against an earlier, lapsed count; start over from this socket.
+        cache.set(key, 1, expiry)
+        return 1
+    cache.touch(key, expiry)
+    return count
+
+
+def socket_closed(user_id):
+    """
+    Returns how many sockets of `user_id` remain open, on any worker.
+    """
+    try:
+        return max(cache.decr(_sockets_key(user_id)), 0)
+    except ValueError:
+        # The count lapsed; nothing is known to be open.
+        return 0
+
+
+asocket_opened = sync_to_async(socket_opened, thread_sensitive=False)
+asocket_closed = sync_to_async(socket_closed, thread_sensitive=False)
+
+
+class TypingCoalescer:
+    """
+    Passes a socket's typing states to `send` at most once per `interval` seconds. A
+    state arriving inside the window replaces any pending one and goes out when the
+    window ends, so the final "stopped typing" is never dropped. A repeated "typing"
+    is only passed on again after `refresh` seconds, to keep the receivers' timeout
+    (TYPING_TTL) from running out.
+    """
+
+    def __init__(self, send, interval, refresh):
+        self.send = send
+        self.interval = interval
+        self.refresh = refresh
+        self.last_state = False
+        self.last_sent = float("-inf")
+        self.pending = None
+        self._timer = None
+
+    async def update(self, is_typing):
+        """
+        Returns True if the state went out now, False if it was coalesced.
+        """
+        loop = asyncio.get_running_loop()
+        if self._timer is not None:
+            self.pending = is_typing
+            return False
+        now = loop.time()
+        if is_typing == self.last_state and now - self.last_sent < self.refresh:
+            return False
+        wait = self.last_sent + self.interval - now
+        if wait > 0:
+            self.pending = is_typing
+            self._timer = loop.create_task(self._send_pending(wait))
+            return False
+        await self._send(is_typing)
+        return True
+
+    async def _send_pending(self, delay):
+        await asyncio.sleep(delay)
+        self._timer = None
+        state, self.pending = self.pending, None
+        if state != self.last_state or asyncio.get_running_loop().time() - self.last_sent >= self.refresh:
+            await self._send(state)
+
+    async def _send(self, is_typing):
+        self.last_state = is_typing
+        self.last_sent = asyncio.get_running_loop().time()
+        await self.send(is_typing)
+
+    async def close(self):
+        """
+        Drops any pending state; announces "stopped typing" if the last state sent was
+        "typing".
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.last_state:
+            await self._send(False)
@@ -0,0 +1,197 @@
+# File: api/response_cache.py
+
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from .caching import LRUCache, bump_version, get_version, get_versions
+from .db_routing import primary
+
+# A pre-rendered JSON response body with its validators.
+CachedPayload = namedtuple("CachedPayload", ["body", "etag", "last_modified"])
+
+PAYLOAD_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def render_payload(data, last_modified):
+    """
+    Renders `data` to JSON once and derives a strong ETag from the exact bytes.
+    """
+    body = JSONRenderer().render(data)
+    return CachedPayload(body, '"%s"' % hashlib.sha256(body).hexdigest(), last_modified)
+
+
+def payload_response(request, payload):
+    """
+    Answers `request` from a cached payload: 304 when the client's If-None-Match /
+    If-Modified-Since still match, the stored bytes otherwise. Clients may keep the
+    response but must revalidate it before reuse.
+    """
+    response = get_conditional_response(
+        request, etag=payload.etag, last_modified=int(payload.last_modified)
+    )
+    if response is None:
+        response = HttpResponse(payload.body, content_type="application/json")
+    response.headers["ETag"] = payload.etag
+    response.headers["Last-Modified"] = http_date(payload.last_modified)
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+# --- Service category catalog ---
+
+CATEGORY_LIST_VERSION = "categories"
+CATEGORY_LIST_MODIFIED_KEY = "category-list:modified"
+
+
+def category_list_modified():
+    """
+    When the catalog last changed (epoch seconds), as first seen by this cache.
+    """
+    modified = cache.get(CATEGORY_LIST_MODIFIED_KEY)
+    if modified is None:
+        cache.add(CATEGORY_LIST_MODIFIED_KEY, int(time.time()), timeout=None)
+        modified = cache.get(CATEGORY_LIST_MODIFIED_KEY, int(time.time()))
+    return modified
+
+
+def get_category_list_payload(request, build_data):
+    """
+    The rendered category list for the request's scheme and host (image URLs are
+    absolute). `build_data()` is only called on a miss, and reads from the primary;
+    the key carries the catalog version, so a change makes every process rebuild.
+    """
+    key = (
+        f"category-list:v{get_version(CATEGORY_LIST_VERSION)}:"
+        f"{request.scheme}://{request.get_host()}"
+    )
+    payload = cache.get(key)
+    if payload is None:
+        with primary():
+            data = build_data()
+        payload = render_payload(data, category_list_modified())
+        cache.set(key, tuple(payload), PAYLOAD_CACHE_TIMEOUT)
+    return CachedPayload(*payload)
+
+
+def invalidate_category_list():
+    cache.set(CATEGORY_LIST_MODIFIED_KEY, int(time.time()), timeout=None)
+    bump_version(CATEGORY_LIST_VERSION)
+    # Provider documents embed categories and include this version in their keys.
+    provider_detail_cache.discard_local(lambda key: True)
+
+
+# --- Versioned two-tier payload cache ---
+
+class VersionedPayloadCache:
+    """
+    Two-tier cache of rendered payloads. Tier one is an in-process LRU whose entries
+    live `local_ttl` seconds; tier two is the shared Django cache, keyed by the
+    versions of everything the payload was built from. Bumping one of those versions
+    makes every process rebuild; `discard_local()` also drops this process's copies
+    at once, other processes follow within `local_ttl` seconds.
+
+    Misses are single-flight. Threads of one process missing on the same key wait on
+    one lock, and across processes a `cache.add()` lock lets a single builder
+    through. The others poll the shared tier for up to `wait_timeout` seconds and
+    only build themselves if the builder has not finished by then.
+    """
+
+    LOCK_STRIPES = 64
+
+    def __init__(self, name, maxsize=1000, local_ttl=5.0, shared_ttl=3600,
+                 lock_timeout=10.0, wait_timeout=2.0, poll_interval=0.025):
+        self.name = name
+        self.local = LRUCache(maxsize=maxsize, ttl=local_ttl)
+        self.shared_ttl = shared_ttl
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    def get(self, key, version_names, build_data):
+        """
+        The payload for `key` (a tuple); `build_data()` returns the data to render on a
+        miss and may raise (e.g. Http404), in which case nothing is cached.
+        """
+        payload = self.local.get(key)
+        if payload is not None:
+            return payload
+        with self._locks[hash(key) % self.LOCK_STRIPES]:
+            payload = self.local.get(key)
+            if payload is None:
+                payload = self._get_shared(self._shared_key(key, version_names), build_data)
+                self.local.set(key, payload)
+        return payload
+
+    def discard_local(self, predicate):
+        self.local.discard_where(predicate)
+
+    def _shared_key(self, key, version_names):
+        versions = get_versions(version_names)
+        return ":".join(
+            [f"payload:{self.name}"]
+            + [str(part) for part in key]
+            + [f"{name}={versions[name]}" for name in version_names]
+        )
+
+    def _get_shared(self, shared_key, build_data):
+        cached = cache.get(shared_key)
+        if cached is not None:
+            return CachedPayload(*cached)
+        lock_key = f"{shared_key}:lock"
+        deadline = time.monotonic() + self.wait_timeout
+        locked = cache.add(lock_key, 1, self.lock_timeout)
+        while not locked and time.monotonic() < deadline:
+            # Another process is building this payload; wait for its result.
+            time.sleep(self.poll_interval)
+            cached = cache.get(shared_key)
+            if cached is not None:
+                return CachedPayload(*cached)
+            locked = cache.add(lock_key, 1, self.lock_timeout)
+        try:
+            # From the primary: a replica could still hold the data of the previous version.
+            with primary():
+                data = build_data()
+            payload = render_payload(data, int(time.time()))
+            cache.set(shared_key, tuple(payload), self.shared_ttl)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return payload
+
+
+# --- Provider detail documents ---
+
+provider_detail_cache = VersionedPayloadCache("provider-detail", **getattr(settings, "PROVIDER_DETAIL_CACHE", {}))
+
+
+def provider_version_name(provider_id):
+    return f"provider:{provider_id}"
+
+
+def get_provider_detail_payload(request, provider_id, variant, build_data):
+    """
+    The rendered detail document of one provider for the request's scheme and host;
+    `variant` tells apart different field selections of the same document. Category
+    data is embedded, so the catalog version is part of the key as well.
+    """
+    key = (provider_id, request.scheme, request.get_host(), variant)
+    return provider_detail_cache.get(
+        key, [provider_version_name(provider_id), CATEGORY_LIST_VERSION], build_data
+    )
+
+
+def invalidate_provider_details(provider_ids):
+    provider_ids = set(provider_ids)
+    for provider_id in provider_ids:
+        bump_version(provider_version_name(provider_id))
+    provider_detail_cache.discard_local(lambda key: key[0] in provider_ids)
@@ -6,4 +6,6 @@ from . import consumers
 websocket_urlpatterns = [
     # This pattern matches ws/chat/ followed by any "word" characters (alphanumeric + underscore)
     re_path(r'ws/chat/(?P<room_name>[\w\-]+)/$', consumers.ChatConsumer.as_asgi()),
+    # One socket for all of a user's rooms; rooms are subscribed with frames.
+    re_path(r'ws/chat/$', consumers.MultiplexChatConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,92 @@
+# File: api/search.py
+
+import re
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField, OuterRef, Q, Subquery
+from django.db.models.functions import Cast
+
+from .models import ServiceCategory, ServiceProviderProfile, User
+
+# Text search configuration used both for the stored documents and for the queries.
+SEARCH_CONFIG = "english"
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def provider_search_vector():
+    """
+    Weighted document for a provider: business name and username (A), the names of
+    the offered categories (B) and the bio (C).
+    The related values come from correlated subqueries so the expression can be used
+    in a plain UPDATE of the profile table.
+    """
+    username = Subquery(User.objects.filter(pk=OuterRef("user_id")).values("username")[:1])
+    category_names = Subquery(
+        ServiceCategory.objects.filter(providers=OuterRef("pk"))
+        .order_by()
+        .values("providers")
+        .annotate(names=StringAgg("name", delimiter=" "))
+        .values("names")[:1]
+    )
+    return (
+        SearchVector("business_name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector(username, weight="A", config=SEARCH_CONFIG)
+        + SearchVector(category_names, weight="B", config=SEARCH_CONFIG)
+        + SearchVector("bio", weight="C", config=SEARCH_CONFIG)
+    )
+
+
+def refresh_provider_search_documents(provider_ids=None):
+    """
+    Rebuilds the stored search document of the given providers (all providers when None).
+    Returns the number of profiles updated.
+    """
+    queryset = ServiceProviderProfile.objects.all()
+    if provider_ids is not None:
+        provider_ids = list(provider_ids)
+        if not provider_ids:
+            return 0
+        queryset = queryset.filter(pk__in=provider_ids)
+    return queryset.update(search_document=provider_search_vector())
+
+
+def build_search_query(search_term):
+    """
+    Turns free text typed in the search box into a prefix tsquery ("plumb" matches
+    "plumbing"), or returns None when the text has no searchable words.
+    """
+    terms = _TERM_RE.findall(search_term.lower())
+    if not terms:
+        return None
+    raw_query = " & ".join(f"{term}:*" for term in terms)
+    return SearchQuery(raw_query, search_type="raw", config=SEARCH_CONFIG)
+
+
+def search_providers(queryset, search_term):
+    """
+    Filters a provider queryset by the stored search document and annotates each row
+    with `search_rank`. Callers order by `-search_rank` to get the best matches first.
+    """
+    query = build_search_query(search_term)
+    if query is None:
+        return queryset.none()
+    # ts_rank() returns a float4; widen it so the value round-trips exactly through
+    # Python floats and pagination cursors can compare against it.
+    return queryset.filter(search_document=query).annotate(
+        search_rank=Cast(SearchRank(F("search_document"), query), FloatField())
+    )
+
+
+def legacy_search_providers(queryset, search_term):
+    """
+    The original `icontains` search across profile, user and category columns.
+    Kept as the baseline for `bench_provider_search`.
+    """
+    return queryset.filter(
+        Q(business_name__icontains=search_term)
+        | Q(bio__icontains=search_term)
+        | Q(user__username__icontains=search_term)
+        | Q(services_offered__name__icontains=search_term)
+    ).distinct()
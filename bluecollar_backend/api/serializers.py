@@ -3,11 +3,15 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError as DjangoValidationError
-from django.db.models import Avg
+from django.db import IntegrityError, transaction
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from .availability import is_slot_conflict, unavailable_reason
+from .fieldsets import SparseFieldsetSerializerMixin
+from .images import srcset_map
 from .models import (
-    ServiceCategory, ServiceProviderProfile, Booking, Review, ChatMessage, User
+    ServiceCategory, ServiceProviderProfile, Booking, Review, User,
+    ProviderWorkingHours, ProviderBlockedInterval, ChatReadCursor, ChatRoomSummary,
 )
 
 User = get_user_model()
@@ -21,13 +25,19 @@ class BasicUserSerializer(serializers.ModelSerializer):
         fields = ["id", "username", "first_name", "last_name", "email"]
 
 class ServiceCategorySerializer(serializers.ModelSerializer):
+    category_image_srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ServiceCategory
         # === THIS IS THE FIX ===
         # The fields now correctly match the model: icon_class and category_image
-        fields = ("id", "name", "description", "icon_class", "category_image")
+        fields = ("id", "name", "description", "icon_class", "category_image", "category_image_srcset")
         # =======================
 
+    def get_category_image_srcset(self, obj):
+        # Resized copies made by api.images; empty until they have been generated.
+        return srcset_map(self.context.get('request'), obj.category_image_variants)
+
 class ReviewSerializer(serializers.ModelSerializer):
     reviewer = BasicUserSerializer(read_only=True)
     class Meta:
@@ -125,21 +135,45 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 # --- PROFILE & BOOKING SERIALIZERS ---
 
-class ServiceProviderProfileSerializer(serializers.ModelSerializer):
+class ServiceProviderProfileSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    expandable_fields = ('user', 'services_offered', 'reviews_received')
     user = BasicUserSerializer(read_only=True)
     services_offered = ServiceCategorySerializer(many=True, read_only=True)
     services_offered_ids = serializers.PrimaryKeyRelatedField(queryset=ServiceCategory.objects.all(), many=True, write_only=True, source='services_offered')
     average_rating = serializers.SerializerMethodField(read_only=True)
     reviews_received = ReviewSerializer(many=True, read_only=True)
     status = serializers.CharField(read_only=True)
+    profile_picture_srcset = serializers.SerializerMethodField()
+    distance_km = serializers.SerializerMethodField()
     
     class Meta:
         model = ServiceProviderProfile
-        fields = ['user', 'business_name', 'bio', 'phone_number', 'profile_picture', 'services_offered', 'services_offered_ids', 'average_rating', 'reviews_received', 'status']
+        fields = ['user', 'business_name', 'bio', 'phone_number', 'profile_picture', 'profile_picture_srcset', 'services_offered', 'services_offered_ids', 'average_rating', 'review_count', 'rating_histogram', 'reviews_received', 'status', 'service_latitude', 'service_longitude', 'service_radius_km', 'distance_km']
+        read_only_fields = ['review_count', 'rating_histogram']
 
     def get_average_rating(self, obj):
-        avg_rating = obj.reviews_received.aggregate(Avg('rating'))['rating__avg']
-        return round(avg_rating, 2) if avg_rating is not None else None
+        # Read from the denormalized fields kept up to date by the Review signals.
+        if not obj.review_count:
+            return None
+        return float(obj.average_rating)
+
+    def get_distance_km(self, obj):
+        # Only present on ?near= searches (annotated by api.geo.providers_near).
+        distance = getattr(obj, 'distance_km', None)
+        return None if distance is None else round(distance, 2)
+
+    def validate(self, attrs):
+        latitude = attrs.get('service_latitude', getattr(self.instance, 'service_latitude', None))
+        longitude = attrs.get('service_longitude', getattr(self.instance, 'service_longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError("Set both service_latitude and service_longitude, or neither.")
+        if latitude is not None and not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise serializers.ValidationError("Service area coordinates are out of range.")
+        return attrs
+
+    def get_profile_picture_srcset(self, obj):
+        # Resized copies made by api.images; empty until they have been generated.
+        return srcset_map(self.context.get('request'), obj.profile_picture_variants)
 
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -150,7 +184,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
 class BookingCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Booking
-        fields = ['provider_profile', 'service_category_requested', 'service_description', 'booking_datetime', 'address_for_service', 'customer_notes']
+        fields = ['provider_profile', 'service_category_requested', 'service_description', 'booking_datetime', 'estimated_duration_hours', 'address_for_service', 'customer_notes']
         read_only_fields = ['customer', 'status']
 
     def validate_provider_profile(self, value):
@@ -164,35 +198,138 @@ class BookingCreateSerializer(serializers.ModelSerializer):
         if value < timezone.now():
             raise serializers.ValidationError("Booking date and time cannot be in the past.")
         return value
+
+    def validate_estimated_duration_hours(self, value):
+        if value is not None and not 0 < value <= 24:
+            raise serializers.ValidationError("Estimated duration must be between 0 and 24 hours.")
+        return value
+
+    def validate(self, attrs):
+        # Working hours, blocked periods and existing bookings, for a clear message.
+        start = attrs['booking_datetime']
+        end = start + Booking.duration(attrs.get('estimated_duration_hours'))
+        reason = unavailable_reason(attrs['provider_profile'].pk, start, end)
+        if reason:
+            raise serializers.ValidationError({'booking_datetime': reason})
+        return attrs
+
     def create(self, validated_data):
-        booking = Booking.objects.create(customer=self.context['request'].user, **validated_data)
+        # The exclusion constraint settles concurrent requests for the same slot.
+        try:
+            with transaction.atomic():
+                booking = Booking.objects.create(customer_id=self.context['request'].user.id, **validated_data)
+        except IntegrityError as e:
+            if not is_slot_conflict(e):
+                raise
+            # Same shape as the field errors from validate().
+            raise serializers.ValidationError({'booking_datetime': ["This time slot is already booked."]})
         return booking
 
-class BookingListSerializer(serializers.ModelSerializer):
+class BookingListSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    expandable_fields = ('customer', 'review')
     customer = BasicUserSerializer(read_only=True)
     provider_business_name = serializers.CharField(source='provider_profile.business_name', read_only=True, allow_null=True)
     provider_username = serializers.CharField(source='provider_profile.user.username', read_only=True, allow_null=True)
     service_category_requested_name = serializers.CharField(source='service_category_requested.name', read_only=True, allow_null=True)
     review = SimpleReviewForBookingSerializer(read_only=True)
+    unread_messages_count = serializers.SerializerMethodField()
     unread_chat_messages_for_provider = serializers.SerializerMethodField()
 
     class Meta:
         model = Booking
-        fields = ['id', 'customer', 'provider_profile', 'provider_business_name', 'provider_username', 'service_category_requested', 'service_category_requested_name', 'service_description', 'booking_datetime', 'address_for_service', 'status', 'estimated_duration_hours', 'quoted_price', 'provider_notes', 'customer_notes', 'created_at', 'updated_at', 'review', 'unread_chat_messages_for_provider']
-    
+        fields = ['id', 'customer', 'provider_profile', 'provider_business_name', 'provider_username', 'service_category_requested', 'service_category_requested_name', 'service_description', 'booking_datetime', 'booking_end_datetime', 'address_for_service', 'status', 'estimated_duration_hours', 'quoted_price', 'provider_notes', 'customer_notes', 'created_at', 'updated_at', 'version', 'review', 'unread_messages_count', 'unread_chat_messages_for_provider']
+
+    def get_unread_messages_count(self, obj):
+        # Annotated by BookingQuerySet.with_unread_message_counts() in the views; the
+        # per-row query is only a fallback for querysets that were not annotated.
+        count = getattr(obj, 'unread_messages_count', None)
+        if count is not None:
+            return count
+        request = self.context.get('request')
+        if not (request and request.user.is_authenticated):
+            return 0
+        return ChatReadCursor.unread_count(request.user.id, f"booking_{obj.pk}")
+
     def get_unread_chat_messages_for_provider(self, obj):
+        # Kept for existing clients: True when the requesting provider has unread messages.
         request = self.context.get('request')
-        if request and request.user.is_authenticated and request.user.is_provider and hasattr(request.user, 'provider_profile') and obj.provider_profile == request.user.provider_profile:
-            room_id = f"booking_{obj.id}"
-            return ChatMessage.objects.filter(room_identifier=room_id, is_read=False).exclude(sender=request.user).exists()
+        if request and request.user.is_authenticated and request.user.is_provider and obj.provider_profile_id == request.user.id:
+            return self.get_unread_messages_count(obj) > 0
         return False
 
-class BookingStatusUpdateSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Booking
-        fields = ['status']
+class BookingStatusUpdateSerializer(serializers.Serializer):
+    """
+    A status change of the booking in the context, checked against
+    Booking.STATUS_TRANSITIONS for the requesting side. `version` is the version the
+    client last saw; without it the change applies to the version just read.
+    """
+    status = serializers.ChoiceField(choices=Booking.STATUS_CHOICES)
+    version = serializers.IntegerField(required=False, min_value=1)
+
     def validate_status(self, value):
-        allowed_provider_statuses = ['CONFIRMED', 'IN_PROGRESS', 'COMPLETED', 'CANCELLED_BY_PROVIDER', 'REJECTED_BY_PROVIDER']
-        if value not in allowed_provider_statuses:
-            raise serializers.ValidationError(f"Invalid status. Provider can set to: {', '.join(allowed_provider_statuses)}")
-        return value
\ No newline at end of file
+        booking = self.context['booking']
+        allowed = booking.allowed_transitions(self.context['role'])
+        if value not in allowed:
+            if allowed:
+                raise serializers.ValidationError(f"Cannot change a {booking.status} booking to {value}. Allowed: {', '.join(allowed)}.")
+            raise serializers.ValidationError(f"You cannot change the status of a {booking.status} booking.")
+        return value
+
+
+# --- PROVIDER CALENDAR SERIALIZERS ---
+
+class ProviderWorkingHoursSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProviderWorkingHours
+        fields = ['id', 'weekday', 'start_time', 'end_time']
+
+    def validate(self, attrs):
+        start_time = attrs.get('start_time', getattr(self.instance, 'start_time', None))
+        end_time = attrs.get('end_time', getattr(self.instance, 'end_time', None))
+        weekday = attrs.get('weekday', getattr(self.instance, 'weekday', None))
+        if end_time <= start_time:
+            raise serializers.ValidationError({'end_time': "End time must be after start time."})
+        clashes = ProviderWorkingHours.objects.filter(
+            provider_profile_id=self.context['request'].user.id, weekday=weekday, start_time=start_time
+        )
+        if self.instance is not None:
+            clashes = clashes.exclude(pk=self.instance.pk)
+        if clashes.exists():
+            raise serializers.ValidationError({'start_time': "You already have working hours starting at this time on this day."})
+        return attrs
+
+class ProviderBlockedIntervalSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProviderBlockedInterval
+        fields = ['id', 'starts_at', 'ends_at', 'reason']
+
+    def validate(self, attrs):
+        starts_at = attrs.get('starts_at', getattr(self.instance, 'starts_at', None))
+        ends_at = attrs.get('ends_at', getattr(self.instance, 'ends_at', None))
+        if ends_at <= starts_at:
+            raise serializers.ValidationError({'ends_at': "End must be after start."})
+        return attrs
+
+class ChatRoomSummarySerializer(serializers.ModelSerializer):
+    """
+    One inbox entry: the room, the other participant, the last message and the
+    requesting user's unread count (annotated by the view).
+    """
+    room_name = serializers.CharField(source='room_identifier', read_only=True)
+    other_participant = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    unread_messages_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ChatRoomSummary
+        fields = ['room_name', 'booking', 'other_participant', 'last_message', 'last_activity_at', 'unread_messages_count']
+
+    def get_other_participant(self, obj):
+        other = obj.other_participant(self.context['request'].user)
+        return {'id': other.id, 'username': other.username}
+
+    def get_last_message(self, obj):
+        return {
+            'id': obj.last_message_id, 'sender_id': obj.last_sender_id,
+            'preview': obj.last_message_preview, 'timestamp': obj.last_activity_at,
+        }
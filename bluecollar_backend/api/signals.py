@@ -0,0 +1,186 @@
+# File: api/signals.py
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .authentication import USER_SNAPSHOT_FIELDS, invalidate_user_snapshot
+from .chat_rooms import room_access_cache
+from .images import schedule_derivatives
+from .models import Booking, Review, ServiceCategory, ServiceProviderProfile, User
+from .response_cache import invalidate_category_list, invalidate_provider_details
+from .search import refresh_provider_search_documents
+
+
+# --- Provider rating aggregates ---
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def refresh_provider_rating_stats(sender, instance, **kwargs):
+    """
+    Keeps the denormalized rating fields on the reviewed provider in step with its reviews.
+    """
+    with transaction.atomic():
+        ServiceProviderProfile.refresh_rating_stats(instance.provider_profile_id)
+
+
+# --- Provider search documents ---
+
+SEARCH_DOCUMENT_PROFILE_FIELDS = {"business_name", "bio"}
+
+
+def _touches(update_fields, fields):
+    # `update_fields` is None for a full save, which may change anything.
+    return update_fields is None or bool(fields & set(update_fields))
+
+
+@receiver(post_save, sender=ServiceProviderProfile)
+def refresh_search_document_on_profile_save(sender, instance, created, update_fields, **kwargs):
+    if created or _touches(update_fields, SEARCH_DOCUMENT_PROFILE_FIELDS):
+        refresh_provider_search_documents([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def refresh_search_document_on_username_change(sender, instance, created, update_fields, **kwargs):
+    # Updates nothing for customers, who have no provider profile.
+    if not created and _touches(update_fields, {"username"}):
+        refresh_provider_search_documents([instance.pk])
+
+
+@receiver(m2m_changed, sender=ServiceProviderProfile.services_offered.through)
+def refresh_search_document_on_services_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        # Remember which providers lose the category; pk_set is not given for clear().
+        instance._search_cleared_provider_ids = list(instance.providers.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if not reverse:
+            refresh_provider_search_documents([instance.pk])
+        elif action == "post_clear":
+            refresh_provider_search_documents(getattr(instance, "_search_cleared_provider_ids", []))
+        else:
+            refresh_provider_search_documents(pk_set)
+
+
+@receiver(post_save, sender=ServiceCategory)
+def refresh_search_documents_on_category_save(sender, instance, created, update_fields, **kwargs):
+    if not created and _touches(update_fields, {"name"}):
+        refresh_provider_search_documents(instance.providers.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=ServiceCategory)
+def remember_category_providers(sender, instance, **kwargs):
+    # The through rows are removed by the delete cascade, which sends no m2m_changed.
+    instance._search_deleted_provider_ids = list(instance.providers.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=ServiceCategory)
+def refresh_search_documents_on_category_delete(sender, instance, **kwargs):
+    refresh_provider_search_documents(getattr(instance, "_search_deleted_provider_ids", []))
+
+
+# --- Category catalog cache ---
+
+@receiver(post_save, sender=ServiceCategory)
+@receiver(post_delete, sender=ServiceCategory)
+def invalidate_category_list_on_change(sender, instance, **kwargs):
+    # After commit, so a rebuild under the new version cannot read the old rows.
+    transaction.on_commit(invalidate_category_list)
+
+
+# --- Provider detail document cache ---
+# Invalidated after commit, like the category catalog above.
+
+# User columns shown in provider documents (the provider's own user and reviewers).
+PROVIDER_DOCUMENT_USER_FIELDS = ("username", "first_name", "last_name", "email")
+
+
+def _invalidate_provider_details_on_commit(provider_ids):
+    provider_ids = list(provider_ids)
+    if provider_ids:
+        transaction.on_commit(lambda: invalidate_provider_details(provider_ids))
+
+
+@receiver(post_save, sender=ServiceProviderProfile)
+@receiver(post_delete, sender=ServiceProviderProfile)
+def invalidate_provider_detail_on_profile_change(sender, instance, **kwargs):
+    _invalidate_provider_details_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_provider_detail_on_review_change(sender, instance, **kwargs):
+    # Covers the review itself and the rating fields refreshed above.
+    _invalidate_provider_details_on_commit([instance.provider_profile_id])
+
+
+@receiver(m2m_changed, sender=ServiceProviderProfile.services_offered.through)
+def invalidate_provider_detail_on_services_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        _invalidate_provider_details_on_commit([instance.pk])
+    elif action == "post_clear":
+        # Stashed on pre_clear by the search document handler above.
+        _invalidate_provider_details_on_commit(getattr(instance, "_search_cleared_provider_ids", []))
+    else:
+        _invalidate_provider_details_on_commit(pk_set)
+
+
+@receiver(post_save, sender=User)
+def invalidate_provider_detail_on_user_change(sender, instance, created, **kwargs):
+    # Login timestamps and password changes are not part of any document.
+    if created or not any(instance.field_changed(field) for field in PROVIDER_DOCUMENT_USER_FIELDS):
+        return
+    provider_ids = set(Review.objects.filter(reviewer=instance).values_list("provider_profile_id", flat=True))
+    provider_ids.add(instance.pk)  # Their own document, if they are a provider.
+    _invalidate_provider_details_on_commit(provider_ids)
+
+
+# --- Image derivatives ---
+
+@receiver(post_save, sender=ServiceProviderProfile)
+@receiver(post_save, sender=ServiceCategory)
+def schedule_image_derivatives(sender, instance, **kwargs):
+    field_name = "profile_picture" if sender is ServiceProviderProfile else "category_image"
+    if instance.field_changed(field_name):
+        transaction.on_commit(
+            lambda: schedule_derivatives(sender._meta.label, instance.pk, field_name)
+        )
+
+
+# --- Chat room authorization cache ---
+# Invalidated after commit: a socket authorizing in between would otherwise cache
+# the old participants again from the not yet committed state.
+
+def _invalidate_room_access_on_commit(booking_id):
+    transaction.on_commit(lambda: room_access_cache.invalidate_room(f"booking_{booking_id}"))
+
+
+@receiver(post_save, sender=Booking)
+def invalidate_room_access_on_booking_save(sender, instance, created, **kwargs):
+    # A new booking may replace a cached "denied" for its room id.
+    if created or instance.field_changed("customer_id") or instance.field_changed("provider_profile_id"):
+        _invalidate_room_access_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=Booking)
+def invalidate_room_access_on_booking_delete(sender, instance, **kwargs):
+    _invalidate_room_access_on_commit(instance.pk)
+
+
+# --- User snapshots (token authentication) ---
+# Invalidated after commit, so a snapshot reloaded before the commit is not kept.
+
+def _invalidate_user_snapshot_on_commit(user_id):
+    transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_snapshot_on_save(sender, instance, created, **kwargs):
+    if not created and any(instance.field_changed(field) for field in USER_SNAPSHOT_FIELDS):
+        _invalidate_user_snapshot_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_user_snapshot_on_delete(sender, instance, **kwargs):
+    _invalidate_user_snapshot_on_commit(instance.pk)
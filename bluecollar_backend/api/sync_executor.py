@@ -0,0 +1,39 @@
+# File: api/sync_executor.py
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_sync_executor():
+    """
+    The dedicated pool for sync database work started from async code, or None when
+    SYNC_DB_EXECUTOR_WORKERS is 0.
+    """
+    global _executor
+    workers = settings.SYNC_DB_EXECUTOR_WORKERS
+    if not workers:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync-db")
+    return _executor
+
+
+def run_sync(func, *args, **kwargs):
+    """
+    Awaitable running sync code that touches the database, with connection cleanup
+    around it like database_sync_to_async. With a dedicated pool the calls run in
+    parallel on its threads (each holding its own connection, so the pool size also
+    caps the connections used); otherwise they share the thread-sensitive thread with
+    the async ORM.
+    """
+    executor = get_sync_executor()
+    if executor is None:
+        return database_sync_to_async(func)(*args, **kwargs)
+    return database_sync_to_async(func, thread_sensitive=False, executor=executor)(*args, **kwargs)
@@ -1,3 +1,1590 @@
-from django.test import TestCase
+# File: api/tests.py
 
-# Create your tests here.
+import asyncio
+import base64
+import json
+import time
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import chat_persistence, db_routing, presence, signals
+from .authentication import get_user_snapshot
+from .availability import free_intervals, unavailable_reason, working_windows
+from .checks import check_presence_cache, check_snapshot_auth_cache
+from .chat_rooms import room_access_cache
+from .channel_layers import BATCH_MESSAGE_TYPE, BatchingInMemoryChannelLayer, unpack_batch
+from .middleware import ReplicaRoutingMiddleware, TokenAuthMiddlewareStack
+from .models import (
+    Booking,
+    ChatMessage,
+    ChatReadCursor,
+    ChatRoomSummary,
+    ProviderBlockedInterval,
+    ProviderWorkingHours,
+    Review,
+    ServiceCategory,
+    ServiceProviderProfile,
+    User,
+)
+from .pagination import KeysetPagination
+from .response_cache import provider_detail_cache
+from .routing import websocket_urlpatterns
+from .search import refresh_provider_search_documents
+
+
+def make_provider(username, business_name="", **fields):
+    user = User.objects.create(username=username, is_provider=True)
+    return ServiceProviderProfile.objects.create(user=user, business_name=business_name, status="APPROVED", **fields)
+
+
+def make_booking(customer, provider, days_ahead=1, **fields):
+    return Booking.objects.create(
+        customer=customer, provider_profile=provider, service_description="test",
+        booking_datetime=timezone.now() + timedelta(days=days_ahead), address_for_service="test", **fields,
+    )
+
+
+def send_messages(booking, sender, count):
+    return [
+        ChatMessage.objects.create(
+            booking=booking, sender=sender, message_content=f"message {i}", room_identifier=f"booking_{booking.pk}",
+        )
+        for i in range(count)
+    ]
+
+
+def encode_raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+
+# --- Provider rating aggregates ---
+
+class ProviderRatingStatsTests(APITestCase):
+    """
+    The denormalized rating fields follow the provider's reviews on create, update
+    and delete.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = make_provider("provider", "Provider")
+        cls.customers = [User.objects.create(username=f"customer_{i}") for i in range(3)]
+
+    def review(self, customer, rating, days_ahead):
+        booking = make_booking(customer, self.provider, days_ahead, status="COMPLETED")
+        return Review.objects.create(booking=booking, reviewer=customer, provider_profile=self.provider, rating=rating)
+
+    def assertStats(self, count, average, histogram=None):
+        self.provider.refresh_from_db()
+        self.assertEqual(self.provider.review_count, count)
+        self.assertEqual(self.provider.average_rating, Decimal(average))
+        if histogram is not None:
+            self.assertEqual(self.provider.rating_histogram, {str(star): n for star, n in zip(range(1, 6), histogram)})
+
+    def test_stats_follow_reviews(self):
+        self.assertStats(0, "0")
+        first = self.review(self.customers[0], 5, 1)
+        self.assertStats(1, "5.00", [0, 0, 0, 0, 1])
+        self.review(self.customers[1], 4, 2)
+        third = self.review(self.customers[2], 4, 3)
+        self.assertStats(3, "4.33", [0, 0, 0, 2, 1])
+        third.rating = 1
+        third.save()
+        self.assertStats(3, "3.33", [1, 0, 0, 1, 1])
+        first.delete()
+        self.assertStats(2, "2.50", [1, 0, 0, 1, 0])
+        Review.objects.get(pk=third.pk).delete()
+        Review.objects.filter(provider_profile=self.provider).get().delete()
+        self.assertStats(0, "0", [0, 0, 0, 0, 0])
+
+
+# --- Keyset pagination ---
+
+class KeysetCursorTests(APITestCase):
+    """
+    Cursor encoding on its own: values survive the round trip at full precision and
+    anything that is not a cursor this ordering produced is rejected.
+    """
+
+    def paginator(self, ordering):
+        paginator = KeysetPagination()
+        paginator.ordering = ordering
+        return paginator
+
+    def test_round_trip_keeps_full_precision(self):
+        paginator = self.paginator(("-created_at", "id"))
+        created_at = datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        cursor = paginator.encode_cursor([created_at, 42])
+        self.assertEqual(paginator.decode_cursor(cursor, Booking), [created_at, 42])
+
+    def test_round_trip_decimal_and_annotation(self):
+        paginator = self.paginator(("-average_rating", "-search_rank", "user_id"))
+        cursor = paginator.encode_cursor([Decimal("4.35"), 0.0607927, 7])
+        self.assertEqual(paginator.decode_cursor(cursor, ServiceProviderProfile), [Decimal("4.35"), 0.0607927, 7])
+
+    def test_cursor_is_url_safe_without_padding(self):
+        cursor = self.paginator(("business_name", "user_id")).encode_cursor(["??>>~~", 1])
+        self.assertNotIn("=", cursor)
+        self.assertRegex(cursor, r"^[A-Za-z0-9_-]+$")
+
+    def test_rejects_malformed_cursors(self):
+        paginator = self.paginator(("-created_at", "id"))
+        malformed = [
+            "not base64 !",
+            base64.urlsafe_b64encode(b"\xff\xfe").decode(),  # not UTF-8
+            encode_raw_cursor({"created_at": "2026-01-01"}),  # not a list
+            encode_raw_cursor(["2026-03-01T12:00:00+00:00"]),  # too short
+            encode_raw_cursor(["2026-03-01T12:00:00+00:00", 1, 2]),  # too long
+            encode_raw_cursor(["yesterday", 1]),  # not a datetime
+            encode_raw_cursor(["2026-03-01T12:00:00+00:00", "one"]),  # not an id
+        ]
+        for cursor in malformed:
+            with self.subTest(cursor=cursor), self.assertRaises(NotFound):
+                paginator.decode_cursor(cursor, Booking)
+
+    def test_rejects_non_numeric_annotation_values(self):
+        paginator = self.paginator(("-search_rank", "business_name", "user_id"))
+        with self.assertRaises(NotFound):
+            paginator.decode_cursor(encode_raw_cursor(["high", "Acme", 1]), ServiceProviderProfile)
+
+
+class ProviderListKeysetPaginationTests(APITestCase):
+    """
+    Walks /api/providers/ page by page in every ordering. The providers share sort
+    keys on purpose, so the primary key has to break the ties for the pages to be
+    complete and free of repeats.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # (username, business name, rating, review count, (lat, lng))
+        rows = [
+            ("p1", "Acme Plumbing", "4.50", 10, (52.5200, 13.4050)),
+            ("p2", "Acme Plumbing", "4.50", 10, (52.5200, 13.4050)),
+            ("p3", "Acme Plumbing", "4.50", 3, (52.5300, 13.4050)),
+            ("p4", "Best Plumbing Berlin", "5.00", 3, (52.5200, 13.4100)),
+            ("p5", "Clean Pipes", "3.00", 10, (52.5400, 13.4050)),
+            ("p6", "Plumbing Direct", "0.00", 0, (52.5200, 13.4050)),
+            ("p7", "Zeta Electric", "4.50", 10, (52.5250, 13.4050)),
+        ]
+        cls.providers = []
+        for username, name, rating, reviews, (lat, lng) in rows:
+            provider = make_provider(
+                username, name, service_latitude=lat, service_longitude=lng, service_radius_km=50,
+            )
+            ServiceProviderProfile.objects.filter(pk=provider.pk).update(
+                average_rating=Decimal(rating), review_count=reviews,
+            )
+            cls.providers.append(ServiceProviderProfile.objects.get(pk=provider.pk))
+        refresh_provider_search_documents()
+        cls.customer = User.objects.create(username="customer")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.customer)
+
+    def walk(self, params, page_size=2):
+        """
+        User ids of every page, following `next` links until the last page.
+        """
+        url = "/api/providers/?" + urlencode({**params, "page_size": page_size})
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            results = response.data["results"]
+            self.assertLessEqual(len(results), page_size)
+            ids.extend(row["user"]["id"] for row in results)
+            url, pages = response.data["next"], pages + 1
+            self.assertLess(pages, 20, "pagination does not terminate")
+        return ids
+
+    def unpaginated(self, params):
+        response = self.client.get("/api/providers/?" + urlencode(params))
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row["user"]["id"] for row in response.data]
+
+    def expected(self, key):
+        return [provider.pk for provider in sorted(self.providers, key=key)]
+
+    def test_name_ordering(self):
+        expected = self.expected(lambda p: (p.business_name, p.pk))
+        self.assertEqual(self.walk({"ordering": "name"}), expected)
+        self.assertEqual(self.walk({}), expected)
+
+    def test_rating_ordering(self):
+        expected = self.expected(lambda p: (-p.average_rating, -p.review_count, p.business_name, p.pk))
+        self.assertEqual(self.walk({"ordering": "rating"}), expected)
+
+    def test_reviews_ordering(self):
+        expected = self.expected(lambda p: (-p.review_count, p.business_name, p.pk))
+        self.assertEqual(self.walk({"ordering": "reviews"}), expected)
+
+    def test_search_ordering(self):
+        params = {"search": "plumbing"}
+        expected = self.unpaginated(params)
+        self.assertEqual(len(expected), 5)
+        for page_size in (1, 2, 3):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.walk(params, page_size), expected)
+
+    def test_distance_ordering(self):
+        params = {"near": "52.5200,13.4050", "radius": "10"}
+        expected = self.unpaginated(params)
+        self.assertEqual(len(expected), 7)
+        # Three providers sit exactly on the search point: ties on distance.
+        self.assertEqual(sorted(expected[:3]), expected[:3])
+        for page_size in (1, 2, 3):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.walk(params, page_size), expected)
+
+    def test_single_row_pages_break_ties_by_primary_key(self):
+        acme = [p.pk for p in self.providers if p.business_name == "Acme Plumbing"]
+        self.assertEqual(self.walk({"ordering": "name"}, page_size=1)[:3], sorted(acme))
+
+    def test_page_size_is_clamped(self):
+        response = self.client.get("/api/providers/?page_size=0")
+        self.assertEqual(len(response.data["results"]), 1)
+        response = self.client.get("/api/providers/?page_size=1000")
+        self.assertEqual(len(response.data["results"]), len(self.providers))
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid_and_tampered_cursors_are_not_found(self):
+        first = self.client.get("/api/providers/?ordering=rating&page_size=2").data
+        cursor = first["next"].split("cursor=")[1].split("&")[0]
+        tampered = [
+            "garbage!",
+            cursor[:-3],  # truncated
+            encode_raw_cursor(["4.50", 10, "Acme Plumbing"]),  # one key short
+            encode_raw_cursor(["great", 10, "Acme Plumbing", 1]),  # not a decimal
+        ]
+        for value in tampered:
+            with self.subTest(cursor=value):
+                response = self.client.get(f"/api/providers/?ordering=rating&page_size=2&cursor={value}")
+                self.assertEqual(response.status_code, 404)
+
+    def test_cursor_from_another_ordering_is_rejected(self):
+        next_link = self.client.get("/api/providers/?ordering=name&page_size=2").data["next"]
+        cursor = next_link.split("cursor=")[1].split("&")[0]
+        response = self.client.get(f"/api/providers/?ordering=rating&page_size=2&cursor={cursor}")
+        self.assertEqual(response.status_code, 404)
+
+
+# --- Booking list unread counts ---
+
+class BookingUnreadCountTests(APITestCase):
+    """
+    Unread chat counts on /api/bookings/ are per participant: messages after the
+    user's read cursor, sent by the other side.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = make_provider("provider", "Provider")
+        cls.customer = User.objects.create(username="customer")
+        cls.read, cls.quiet, cls.unread = (make_booking(cls.customer, cls.provider, days) for days in (1, 2, 3))
+        provider_messages = send_messages(cls.read, cls.provider.user, 3)
+        send_messages(cls.read, cls.customer, 1)
+        send_messages(cls.unread, cls.customer, 2)
+        # The customer has read the first of the provider's three messages.
+        ChatReadCursor.advance(cls.customer.pk, f"booking_{cls.read.pk}", provider_messages[0].pk)
+
+    def setUp(self):
+        cache.clear()
+
+    def list_bookings(self, user, query=""):
+        self.client.force_authenticate(user)
+        response = self.client.get(f"/api/bookings/{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return {row["id"]: row for row in response.data}
+
+    def test_counts_for_customer(self):
+        rows = self.list_bookings(self.customer)
+        counts = {pk: row["unread_messages_count"] for pk, row in rows.items()}
+        self.assertEqual(counts, {self.read.pk: 2, self.quiet.pk: 0, self.unread.pk: 0})
+        self.assertFalse(any(row["unread_chat_messages_for_provider"] for row in rows.values()))
+
+    def test_counts_for_provider(self):
+        rows = self.list_bookings(self.provider.user)
+        counts = {pk: row["unread_messages_count"] for pk, row in rows.items()}
+        self.assertEqual(counts, {self.read.pk: 1, self.quiet.pk: 0, self.unread.pk: 2})
+        flags = {pk: row["unread_chat_messages_for_provider"] for pk, row in rows.items()}
+        self.assertEqual(flags, {self.read.pk: True, self.quiet.pk: False, self.unread.pk: True})
+
+    def test_counts_follow_the_read_cursor(self):
+        last = ChatMessage.objects.filter(room_identifier=f"booking_{self.unread.pk}").latest("id")
+        ChatReadCursor.advance(self.provider.pk, f"booking_{self.unread.pk}", last.pk)
+        rows = self.list_bookings(self.provider.user)
+        self.assertEqual(rows[self.unread.pk]["unread_messages_count"], 0)
+
+    def test_serializer_fallback_matches_annotation(self):
+        from .serializers import BookingListSerializer
+        request = APIRequestFactory().get("/api/bookings/")
+        request.user = self.customer
+        for booking in Booking.objects.filter(customer=self.customer):
+            with self.subTest(booking=booking.pk):
+                data = BookingListSerializer(booking, context={"request": request}).data
+                annotated = Booking.objects.with_unread_message_counts(self.customer).get(pk=booking.pk)
+                self.assertEqual(data["unread_messages_count"], annotated.unread_messages_count)
+
+    def test_query_count_does_not_grow_with_bookings(self):
+        def count_queries():
+            self.client.force_authenticate(self.customer)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/api/bookings/")
+            self.assertEqual(response.status_code, 200)
+            return len(queries), len(response.data)
+
+        few_queries, few_rows = count_queries()
+        # The bookings with their counts in one SELECT, plus the prefetched reviews.
+        self.assertEqual(few_queries, 2)
+        for days in range(4, 10):
+            send_messages(make_booking(self.customer, self.provider, days), self.provider.user, 2)
+        many_queries, many_rows = count_queries()
+        self.assertEqual(many_rows, few_rows + 6)
+        self.assertEqual(many_queries, few_queries)
+
+
+
+
+# --- Booking calendar ---
+
+class BookingAvailabilityTests(APITestCase):
+    """
+    Working hours, blocked intervals and active bookings decide which slots are free;
+    the booking_no_overlap constraint settles requests that pass the checks together.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = make_provider("provider", "Provider")
+        cls.customer = User.objects.create(username="customer")
+        today = timezone.localdate()
+        cls.monday = today + timedelta(days=7 - today.weekday())
+        ProviderWorkingHours.objects.create(
+            provider_profile=cls.provider, weekday=0, start_time=dt_time(9), end_time=dt_time(12),
+        )
+        ProviderWorkingHours.objects.create(
+            provider_profile=cls.provider, weekday=0, start_time=dt_time(13), end_time=dt_time(17),
+        )
+
+    def at(self, hour, days=0):
+        return datetime.combine(self.monday + timedelta(days=days), dt_time(hour), tzinfo=timezone.get_default_timezone())
+
+    def book(self, hour, hours=1, status="PENDING"):
+        return Booking.objects.create(
+            customer=self.customer, provider_profile=self.provider, service_description="test",
+            booking_datetime=self.at(hour), estimated_duration_hours=hours, address_for_service="test", status=status,
+        )
+
+    def block(self, start_hour, end_hour):
+        return ProviderBlockedInterval.objects.create(
+            provider_profile=self.provider, starts_at=self.at(start_hour), ends_at=self.at(end_hour),
+        )
+
+    def test_working_windows_are_clipped_to_the_range(self):
+        self.assertEqual(
+            working_windows(self.provider.pk, self.at(10), self.at(0, days=2)),
+            [(self.at(10), self.at(12)), (self.at(13), self.at(17))],
+        )
+        other = make_provider("other")
+        self.assertEqual(working_windows(other.pk, self.at(3), self.at(4)), [(self.at(3), self.at(4))])
+
+    def test_free_intervals_leave_out_active_bookings_and_blocked_time(self):
+        self.book(10)
+        self.book(14, status="CANCELLED_BY_USER")
+        self.block(15, 16)
+        start, end = self.at(0), self.at(0, days=1)
+        self.assertEqual(
+            free_intervals(self.provider.pk, start, end, timedelta(hours=1)),
+            [(self.at(9), self.at(10)), (self.at(11), self.at(12)), (self.at(13), self.at(15)), (self.at(16), self.at(17))],
+        )
+        self.assertEqual(free_intervals(self.provider.pk, start, end, timedelta(hours=2)), [(self.at(13), self.at(15))])
+
+    def test_unavailable_reason(self):
+        self.book(10)
+        self.book(14, status="CANCELLED_BY_USER")
+        self.block(15, 16)
+        cases = [
+            (8, 9, "The provider does not work at this time."),
+            (11, 13, "The provider does not work at this time."),
+            (15, 16, "The provider is not available at this time."),
+            (10, 11, "This time slot is already booked."),
+            (14, 15, None),
+        ]
+        for start_hour, end_hour, reason in cases:
+            with self.subTest(start=start_hour, end=end_hour):
+                self.assertEqual(unavailable_reason(self.provider.pk, self.at(start_hour), self.at(end_hour)), reason)
+
+    def create(self, hour, hours=1):
+        self.client.force_authenticate(self.customer)
+        return self.client.post("/api/bookings/create/", {
+            "provider_profile": self.provider.pk, "service_description": "test", "address_for_service": "test",
+            "booking_datetime": self.at(hour).isoformat(), "estimated_duration_hours": hours,
+        }, format="json")
+
+    def test_create_rejects_unavailable_slots(self):
+        self.block(15, 16)
+        self.book(10)
+        for hour, message in [
+            (8, "The provider does not work at this time."),
+            (15, "The provider is not available at this time."),
+            (10, "This time slot is already booked."),
+        ]:
+            with self.subTest(hour=hour):
+                response = self.create(hour)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data["booking_datetime"], [message])
+        self.assertEqual(self.create(11).status_code, 201)
+
+    def test_cancelled_bookings_free_their_slot(self):
+        self.book(10, status="CANCELLED_BY_USER")
+        self.book(10, status="REJECTED_BY_PROVIDER")
+        self.assertEqual(self.create(10).status_code, 201)
+
+    def test_overlap_constraint_rejects_concurrent_bookings(self):
+        self.book(10, hours=2)
+        # As if the other request was committed after this one ran its checks.
+        with mock.patch("api.serializers.unavailable_reason", return_value=None):
+            response = self.create(11)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["booking_datetime"], ["This time slot is already booked."])
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_working_hours_endpoints(self):
+        self.client.force_authenticate(self.provider.user)
+        response = self.client.post(
+            "/api/providers/me/working-hours/", {"weekday": 1, "start_time": "09:00", "end_time": "17:00"}, format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        for payload, field in [
+            ({"weekday": 1, "start_time": "09:00", "end_time": "12:00"}, "start_time"),
+            ({"weekday": 2, "start_time": "12:00", "end_time": "09:00"}, "end_time"),
+        ]:
+            with self.subTest(payload=payload):
+                response = self.client.post("/api/providers/me/working-hours/", payload, format="json")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.data)
+        response = self.client.get("/api/providers/me/working-hours/")
+        self.assertEqual([(row["weekday"], row["start_time"]) for row in response.data], [
+            (0, "09:00:00"), (0, "13:00:00"), (1, "09:00:00"),
+        ])
+        self.assertEqual(working_windows(self.provider.pk, self.at(0, days=1), self.at(0, days=2)), [
+            (self.at(9, days=1), self.at(17, days=1)),
+        ])
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get("/api/providers/me/working-hours/").status_code, 403)
+
+    def test_blocked_interval_endpoints(self):
+        self.client.force_authenticate(self.provider.user)
+        response = self.client.post("/api/providers/me/blocked-intervals/", {
+            "starts_at": self.at(16).isoformat(), "ends_at": self.at(15).isoformat(),
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("ends_at", response.data)
+        response = self.client.post("/api/providers/me/blocked-intervals/", {
+            "starts_at": self.at(9).isoformat(), "ends_at": self.at(12).isoformat(), "reason": "holiday",
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get(f"/api/providers/{self.provider.pk}/availability/", {
+            "start": self.monday.isoformat(), "end": self.monday.isoformat(), "duration": 2,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["free"], [{"start": self.at(13), "end": self.at(17)}])
+        interval = ProviderBlockedInterval.objects.get()
+        self.assertEqual(
+            self.client.delete(f"/api/providers/me/blocked-intervals/{interval.pk}/").status_code, 204,
+        )
+        response = self.client.get(f"/api/providers/{self.provider.pk}/availability/", {
+            "start": self.monday.isoformat(), "end": self.monday.isoformat(), "duration": 2,
+        })
+        self.assertEqual(response.data["free"], [
+            {"start": self.at(9), "end": self.at(12)}, {"start": self.at(13), "end": self.at(17)},
+        ])
+
+
+# --- Booking status transitions ---
+
+class BookingStatusTransitionTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = make_provider("provider", "Provider")
+        cls.customer = User.objects.create(username="customer")
+        cls.other_provider = make_provider("other_provider", "Other")
+        cls.other_customer = User.objects.create(username="other_customer")
+        cls.actors = {"provider": cls.provider.user, "customer": cls.customer}
+
+    def setUp(self):
+        cache.clear()
+        self.next_day = 0
+
+    def booking(self, status="PENDING"):
+        # A day apart, so active bookings do not overlap.
+        self.next_day += 1
+        return make_booking(self.customer, self.provider, self.next_day, status=status)
+
+    def patch(self, user, booking, status, version=None, query=""):
+        self.client.force_authenticate(user)
+        data = {"status": status} if version is None else {"status": status, "version": version}
+        return self.client.patch(f"/api/bookings/{booking.pk}/status/{query}", data, format="json")
+
+    def test_transition_table(self):
+        for from_status, targets in Booking.STATUS_TRANSITIONS.items():
+            for to_status, role in targets.items():
+                with self.subTest(from_status=from_status, to_status=to_status):
+                    other_role = "customer" if role == "provider" else "provider"
+                    booking = self.booking(from_status)
+                    self.assertEqual(self.patch(self.actors[other_role], booking, to_status).status_code, 400)
+                    response = self.patch(self.actors[role], booking, to_status, version=booking.version)
+                    self.assertEqual(response.status_code, 200, response.data)
+                    booking.refresh_from_db()
+                    self.assertEqual((booking.status, booking.version), (to_status, 2))
+                    self.assertEqual((response.data["status"], response.data["version"]), (to_status, 2))
+
+    def test_final_statuses_refuse_changes(self):
+        final = [code for code, _ in Booking.STATUS_CHOICES if code not in Booking.STATUS_TRANSITIONS]
+        for from_status in final:
+            booking = self.booking(from_status)
+            for user in self.actors.values():
+                response = self.patch(user, booking, "CONFIRMED")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("status", response.data)
+
+    def test_response_is_the_updated_booking(self):
+        booking = self.booking()
+        response = self.patch(self.provider.user, booking, "CONFIRMED")
+        self.assertEqual(response.data["id"], booking.pk)
+        self.assertEqual(response.data["customer"]["username"], "customer")
+        self.assertEqual(response.data["provider_business_name"], "Provider")
+        self.assertEqual(response.data["unread_messages_count"], 0)
+        response = self.patch(self.provider.user, booking, "IN_PROGRESS", query="?fields=id,status,version")
+        self.assertEqual(response.data, {"id": booking.pk, "status": "IN_PROGRESS", "version": 3})
+
+    def test_stale_version_conflicts(self):
+        booking = self.booking()
+        Booking.objects.get(pk=booking.pk).save()
+        response = self.patch(self.provider.user, booking, "CONFIRMED", version=1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual((response.data["status"], response.data["version"]), ("PENDING", 2))
+        self.assertEqual(self.patch(self.provider.user, booking, "CONFIRMED", version=2).status_code, 200)
+        self.assertEqual(self.patch(self.customer, booking, "CANCELLED_BY_USER", version=2).status_code, 409)
+
+    def test_only_participants_may_change_the_status(self):
+        booking = self.booking()
+        self.assertEqual(self.patch(self.other_customer, booking, "CANCELLED_BY_USER").status_code, 403)
+        self.assertEqual(self.patch(self.other_provider.user, booking, "CONFIRMED").status_code, 403)
+        self.client.force_authenticate(None)
+        response = self.client.patch(f"/api/bookings/{booking.pk}/status/", {"status": "CONFIRMED"}, format="json")
+        self.assertEqual(response.status_code, 401)
+        booking.refresh_from_db()
+        self.assertEqual((booking.status, booking.version), ("PENDING", 1))
+
+    def test_save_increments_the_stored_version(self):
+        booking = self.booking()
+        first, second = Booking.objects.get(pk=booking.pk), Booking.objects.get(pk=booking.pk)
+        first.save()
+        second.save(update_fields=["provider_notes"])
+        self.assertEqual((first.version, second.version), (2, 3))
+        booking.refresh_from_db()
+        self.assertEqual(booking.version, 3)
+        self.assertFalse(second.field_changed("version"))
+
+
+# --- Chat read cursors ---
+
+class ChatAckTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = make_provider("provider", "Provider")
+        cls.customer = User.objects.create(username="customer")
+        cls.booking = make_booking(cls.customer, cls.provider)
+        cls.room = f"booking_{cls.booking.pk}"
+        cls.messages = send_messages(cls.booking, cls.provider.user, 3)
+
+    def test_advance_is_clamped_to_the_newest_message(self):
+        first, newest = self.messages[0].pk, self.messages[-1].pk
+        self.assertEqual(ChatReadCursor.advance(self.customer.pk, self.room, first), first)
+        self.assertEqual(ChatReadCursor.advance(self.customer.pk, self.room, newest + 1000), newest)
+        # Never moves back.
+        self.assertEqual(ChatReadCursor.advance(self.customer.pk, self.room, first), newest)
+        self.assertEqual(ChatReadCursor.advance(self.customer.pk, "booking_0", 10), 0)
+
+
+@override_settings(SYNC_DB_EXECUTOR_WORKERS=0)
+class ChatSocketMessageIdTests(TransactionTestCase):
+    """
+    `ack` frames move the read cursor, never past the room's newest message, and
+    `load_older` frames page back from a message; ids that are not positive 64-bit
+    integers are answered with an error frame. A transaction test case: the consumers
+    close and reopen database connections.
+    """
+
+    def setUp(self):
+        cache.clear()
+        room_access_cache.local.clear()
+        self.provider = make_provider("provider", "Provider")
+        self.customer = User.objects.create(username="customer")
+        self.room = f"booking_{make_booking(self.customer, self.provider).pk}"
+        self.newest = send_messages(Booking.objects.get(), self.provider.user, 3)[-1].pk
+
+    async def connect(self, path):
+        application = TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        token = AccessToken.for_user(self.customer)
+        communicator = WebsocketCommunicator(application, f"{path}?token={token}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def next_frame(self, communicator, frame_type):
+        while True:
+            frame = json.loads(await communicator.receive_from(timeout=5))
+            if frame["type"] == frame_type:
+                return frame
+
+    async def check_acks(self, communicator, **room):
+        for invalid in ("5", 1.5, True, 0, -1, 2 ** 63, None):
+            await communicator.send_json_to({"type": "ack", "message_id": invalid, **room})
+            error = await self.next_frame(communicator, "error")
+            self.assertIn("message_id", error["message"])
+        await communicator.send_json_to({"type": "ack", "message_id": 2 ** 63 - 1, **room})
+        # Frames are handled in order: once this one is answered the ack above is stored.
+        await communicator.send_json_to({"type": "ack", "message_id": "x", **room})
+        await self.next_frame(communicator, "error")
+        await communicator.disconnect()
+
+    async def check_load_older(self, communicator, **room):
+        for invalid in ("5", 1.5, True, 0, -1, 2 ** 63, float("inf"), None):
+            await communicator.send_json_to({"type": "load_older", "before_id": invalid, **room})
+            error = await self.next_frame(communicator, "error")
+            self.assertIn("before_id", error["message"])
+        await communicator.send_json_to({"type": "load_older", "before_id": self.newest, **room})
+        page = await self.next_frame(communicator, "older_messages")
+        self.assertEqual(len(page["messages"]), 2)
+        self.assertFalse(page["has_more"])
+        await communicator.send_json_to({"type": "load_older", "before_id": 2 ** 63 - 1, **room})
+        page = await self.next_frame(communicator, "older_messages")
+        self.assertEqual(page["messages"], [])
+        await communicator.disconnect()
+
+    def cursor(self):
+        return ChatReadCursor.objects.get(user=self.customer, room_identifier=self.room).last_read_message_id
+
+    def test_room_socket_ack(self):
+        async_to_sync(self.room_socket_acks)()
+        self.assertEqual(self.cursor(), self.newest)
+
+    async def room_socket_acks(self):
+        communicator = await self.connect(f"/ws/chat/{self.room}/")
+        await self.check_acks(communicator)
+
+    def test_multiplexed_socket_ack(self):
+        async_to_sync(self.multiplexed_socket_acks)()
+        self.assertEqual(self.cursor(), self.newest)
+
+    async def multiplexed_socket_acks(self):
+        communicator = await self.connect("/ws/chat/")
+        await communicator.send_json_to({"type": "subscribe", "room_name": self.room, "history": False})
+        await self.next_frame(communicator, "subscribed")
+        await self.check_acks(communicator, room_name=self.room)
+
+    def test_room_socket_load_older(self):
+        async_to_sync(self.room_socket_load_older)()
+
+    async def room_socket_load_older(self):
+        communicator = await self.connect(f"/ws/chat/{self.room}/")
+        await self.check_load_older(communicator)
+
+    def test_multiplexed_socket_load_older(self):
+        async_to_sync(self.multiplexed_socket_load_older)()
+
+    async def multiplexed_socket_load_older(self):
+        communicator = await self.connect("/ws/chat/")
+        await communicator.send_json_to({"type": "subscribe", "room_name": self.room, "history": False})
+        await self.next_frame(communicator, "subscribed")
+        await self.check_load_older(communicator, room_name=self.room)
+
+
+# --- Chat inbox ---
+
+class ChatInboxPaginationTests(APITestCase):
+    """
+    The inbox merges the rooms where the user is participant_a with those where they
+    are participant_b (one UNION ALL branch per index) and pages through them in
+    (-last_activity_at, id) order.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        lower = [User.objects.create(username=f"lower_{i}") for i in range(3)]
+        cls.user = User.objects.create(username="inbox")
+        higher = [User.objects.create(username=f"higher_{i}") for i in range(3)]
+        base = timezone.now()
+        # (other user, minutes ago); equal times are ordered by id.
+        rooms = [(higher[0], 1), (lower[0], 2), (higher[1], 2), (lower[1], 2), (higher[2], 5), (lower[2], 3)]
+        for i, (other, minutes) in enumerate(rooms):
+            first, second = sorted([cls.user, other], key=lambda user: user.pk)
+            ChatRoomSummary.objects.create(
+                room_identifier=f"chat_user_{first.pk}_user_{second.pk}", participant_a=first, participant_b=second,
+                last_message_id=i + 1, last_sender=other, last_message_preview="hi",
+                last_activity_at=base - timedelta(minutes=minutes),
+            )
+        # Someone else's room stays out.
+        ChatRoomSummary.objects.create(
+            room_identifier="chat_user_other", participant_a=lower[0], participant_b=higher[0], last_message_id=99,
+            last_message_preview="hi", last_activity_at=base,
+        )
+        cls.expected = list(
+            ChatRoomSummary.objects.for_user(cls.user).order_by("-last_activity_at", "id").values_list("room_identifier", flat=True)
+        )
+
+    def test_pages_cover_both_sides_in_order(self):
+        self.client.force_authenticate(self.user)
+        seen, url = [], "/api/chat/inbox/?page_size=2"
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertTrue(any("UNION ALL" in query["sql"] for query in queries.captured_queries))
+            seen.extend(row["room_name"] for row in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(len(self.expected), 6)
+        self.assertEqual(seen, self.expected)
+
+
+# --- Sparse fieldsets ---
+
+class SparseFieldsetTests(APITestCase):
+    """
+    ?fields= / ?expand= shape both the response and the columns selected; columns no
+    response field shows (a user's password hash in particular) are never read.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = make_provider("provider", "Provider", bio="Fixes things")
+        cls.customer = User.objects.create(username="customer", first_name="Casey", password="secret-hash")
+        cls.booking = make_booking(cls.customer, cls.provider, status="COMPLETED")
+        Review.objects.create(
+            booking=cls.booking, reviewer=cls.customer, provider_profile=cls.provider, rating=5, comment="Great",
+        )
+        refresh_provider_search_documents([cls.provider.pk])
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, user, path):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, response.content)
+        # Cached payload views return a plain HttpResponse.
+        data = response.data if hasattr(response, "data") else json.loads(response.content)
+        return data, [query["sql"] for query in queries.captured_queries]
+
+    def assertNotSelected(self, queries, column):
+        table, name = column.split(".")
+        for sql in queries:
+            self.assertNotIn(f'"{table}"."{name}"', sql)
+
+    def booking_row(self, query=""):
+        data, queries = self.get(self.customer, f"/api/bookings/{query}")
+        (row,) = data
+        return row, queries
+
+    def test_default_booking_list_reads_no_password(self):
+        row, queries = self.booking_row()
+        self.assertEqual(row["customer"]["first_name"], "Casey")
+        self.assertEqual(row["provider_username"], "provider")
+        self.assertEqual(row["review"]["comment"], "Great")
+        self.assertNotSelected(queries, "api_user.password")
+
+    def test_fields_limit_response_and_columns(self):
+        row, queries = self.booking_row("?fields=id,status,provider_username")
+        self.assertEqual(set(row), {"id", "status", "provider_username"})
+        self.assertEqual(row["provider_username"], "provider")
+        self.assertNotSelected(queries, "api_user.password")
+        self.assertNotSelected(queries, "api_booking.service_description")
+        self.assertNotSelected(queries, "api_serviceproviderprofile.business_name")
+        self.assertNotSelected(queries, "api_user.email")
+
+    def test_booking_detail_reads_no_password(self):
+        data, queries = self.get(self.customer, f"/api/bookings/{self.booking.pk}/")
+        self.assertEqual(data["customer"]["username"], "customer")
+        self.assertEqual(data["provider_username"], "provider")
+        self.assertNotSelected(queries, "api_user.password")
+        data, queries = self.get(self.customer, f"/api/bookings/{self.booking.pk}/?fields=id")
+        self.assertEqual(data, {"id": self.booking.pk})
+        self.assertEqual(len(queries), 1)
+
+    def test_empty_expand_skips_nested_relations(self):
+        row, queries = self.booking_row("?expand=")
+        self.assertNotIn("customer", row)
+        self.assertNotIn("review", row)
+        self.assertIn("provider_business_name", row)
+        self.assertNotSelected(queries, "api_user.first_name")
+        self.assertFalse(any("api_review" in sql for sql in queries))
+
+    def test_provider_list_and_reviews_read_no_password(self):
+        data, queries = self.get(self.customer, "/api/providers/")
+        (row,) = data
+        self.assertEqual(row["user"]["username"], "provider")
+        self.assertEqual(row["reviews_received"][0]["reviewer"]["first_name"], "Casey")
+        self.assertNotSelected(queries, "api_user.password")
+
+    def test_provider_detail_reads_no_password(self):
+        data, queries = self.get(self.customer, f"/api/providers/{self.provider.pk}/")
+        self.assertEqual(data["user"]["username"], "provider")
+        self.assertEqual(data["reviews_received"][0]["reviewer"]["username"], "customer")
+        self.assertNotSelected(queries, "api_user.password")
+
+    def test_provider_fields(self):
+        data, queries = self.get(self.customer, "/api/providers/?fields=user,business_name")
+        (row,) = data
+        self.assertEqual(set(row), {"user", "business_name"})
+        self.assertEqual(set(row["user"]), {"id", "username", "first_name", "last_name", "email"})
+        self.assertNotSelected(queries, "api_user.password")
+        self.assertNotSelected(queries, "api_serviceproviderprofile.bio")
+
+    def test_unknown_fields_are_rejected(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.get("/api/bookings/?fields=id,password")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("fields", response.data)
+
+
+# --- Read replica routing ---
+
+REPLICA = "replica_1"
+
+
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    router = db_routing.PrimaryReplicaRouter()
+
+    def test_reads_use_primary_outside_a_request(self):
+        self.assertIsNone(db_routing.current_state())
+        self.assertEqual(self.router.db_for_read(User), db_routing.PRIMARY)
+        self.assertEqual(self.router.db_for_write(User), db_routing.PRIMARY)
+
+    def test_reads_use_the_chosen_replica(self):
+        state, token = db_routing.begin(REPLICA)
+        try:
+            self.assertEqual(self.router.db_for_read(User), REPLICA)
+            self.assertEqual(self.router.db_for_write(User), db_routing.PRIMARY)
+            # After a write the request reads its own writes from the primary.
+            self.assertTrue(state.wrote)
+            self.assertEqual(self.router.db_for_read(User), db_routing.PRIMARY)
+        finally:
+            db_routing.end(token)
+        self.assertIsNone(db_routing.current_state())
+
+    def test_primary_block_overrides_the_replica(self):
+        _, token = db_routing.begin(REPLICA)
+        try:
+            with db_routing.primary():
+                self.assertEqual(self.router.db_for_read(User), db_routing.PRIMARY)
+            self.assertEqual(self.router.db_for_read(User), REPLICA)
+        finally:
+            db_routing.end(token)
+
+    def test_only_the_primary_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate(db_routing.PRIMARY, "api"))
+        self.assertFalse(self.router.allow_migrate(REPLICA, "api"))
+
+    def test_choose_replica(self):
+        with mock.patch.object(db_routing, "replica_aliases", return_value=[]):
+            self.assertIsNone(db_routing.choose_replica())
+        with mock.patch.object(db_routing, "replica_aliases", return_value=[REPLICA]):
+            self.assertEqual(db_routing.choose_replica(), REPLICA)
+
+    @override_settings(DB_REPLICA={"PIN_SECONDS": 1})
+    def test_pins_expire(self):
+        cache.clear()
+        self.assertFalse(db_routing.is_pinned(7))
+        db_routing.pin_to_primary(7)
+        self.assertTrue(db_routing.is_pinned(7))
+        self.assertFalse(db_routing.is_pinned(8))
+        time.sleep(1.1)
+        self.assertFalse(db_routing.is_pinned(7))
+
+
+class ReplicaView:
+    read_from_replica = True
+
+
+class PrimaryView:
+    read_from_replica = False
+
+
+class ReplicaRoutingMiddlewareTests(SimpleTestCase):
+    """
+    Drives the middleware the way Django's handler does (process_view inside
+    __call__) and records where the view's reads would go.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        self.user = User(pk=41, username="routed")
+        patcher = mock.patch.object(db_routing, "replica_aliases", return_value=[REPLICA])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_request(self, request, view_class, writes=False):
+        seen = {}
+
+        def view_func(request):
+            return HttpResponse()
+        view_func.view_class = view_class
+
+        def get_response(request):
+            middleware.process_view(request, view_func, (), {})
+            router = db_routing.PrimaryReplicaRouter()
+            if writes:
+                router.db_for_write(User)
+                request.user = self.user
+            seen["read"] = router.db_for_read(User)
+            return view_func(request)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        middleware(request)
+        return seen["read"]
+
+    def authorized_get(self, user_id):
+        token = AccessToken()
+        token["user_id"] = user_id
+        return self.factory.get("/api/providers/", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_safe_requests_to_marked_views_read_from_a_replica(self):
+        self.assertEqual(self.run_request(self.factory.get("/api/providers/"), ReplicaView), REPLICA)
+        self.assertEqual(self.run_request(self.authorized_get(self.user.pk), ReplicaView), REPLICA)
+
+    def test_unmarked_views_and_unsafe_methods_use_the_primary(self):
+        self.assertEqual(self.run_request(self.factory.get("/api/me/"), PrimaryView), db_routing.PRIMARY)
+        self.assertEqual(self.run_request(self.factory.post("/api/providers/"), ReplicaView), db_routing.PRIMARY)
+
+    def test_a_write_pins_the_user_to_the_primary(self):
+        self.run_request(self.factory.post("/api/bookings/create/"), PrimaryView, writes=True)
+        self.assertTrue(db_routing.is_pinned(self.user.pk))
+        self.assertEqual(self.run_request(self.authorized_get(self.user.pk), ReplicaView), db_routing.PRIMARY)
+        # Other users keep reading from the replica.
+        self.assertEqual(self.run_request(self.authorized_get(self.user.pk + 1), ReplicaView), REPLICA)
+
+    def test_an_invalid_token_is_routed_like_an_anonymous_request(self):
+        db_routing.pin_to_primary(self.user.pk)
+        request = self.factory.get("/api/providers/", HTTP_AUTHORIZATION="Bearer not-a-token")
+        self.assertEqual(self.run_request(request, ReplicaView), REPLICA)
+
+    def test_removed_without_replicas(self):
+        from django.core.exceptions import MiddlewareNotUsed
+        with mock.patch.object(db_routing, "replica_aliases", return_value=[]):
+            with self.assertRaises(MiddlewareNotUsed):
+                ReplicaRoutingMiddleware(lambda request: HttpResponse())
+
+
+# --- Channel layer batching ---
+
+class GroupSendBatchingTests(SimpleTestCase):
+    """
+    Group messages sent within the batch window reach each member as one
+    "layer.batch" envelope, in order; unpack_batch() restores the messages.
+    """
+
+    def make_layer(self, **config):
+        return BatchingInMemoryChannelLayer(**{"group_send_batch_window": 0.05, **config})
+
+    async def joined(self, layer, group="room"):
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        return channel
+
+    async def receive_all(self, layer, channel):
+        messages = []
+        while True:
+            try:
+                messages.append(await asyncio.wait_for(layer.receive(channel), 0.2))
+            except asyncio.TimeoutError:
+                return messages
+
+    def test_unpack_batch(self):
+        single = {"type": "chat_message_broadcast", "id": 1}
+        self.assertEqual(unpack_batch(single), [single])
+        envelope = {"type": BATCH_MESSAGE_TYPE, "messages": [single, {"type": "typing_broadcast"}]}
+        self.assertEqual(unpack_batch(envelope), envelope["messages"])
+
+    async def test_messages_in_one_window_share_an_envelope(self):
+        layer = self.make_layer()
+        channel = await self.joined(layer)
+        sent = [{"type": "chat_message_broadcast", "id": i} for i in range(3)]
+        await asyncio.gather(*(layer.group_send("room", message) for message in sent))
+        received = await self.receive_all(layer, channel)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]["type"], BATCH_MESSAGE_TYPE)
+        self.assertEqual(unpack_batch(received[0]), sent)
+
+    async def test_a_lone_message_is_not_wrapped(self):
+        layer = self.make_layer()
+        channel = await self.joined(layer)
+        await layer.group_send("room", {"type": "chat_message_broadcast", "id": 1})
+        self.assertEqual(await self.receive_all(layer, channel), [{"type": "chat_message_broadcast", "id": 1}])
+
+    async def test_full_batches_are_flushed_early(self):
+        layer = self.make_layer(group_send_batch_window=10, group_send_batch_size=2)
+        channel = await self.joined(layer)
+        sent = [{"type": "chat_message_broadcast", "id": i} for i in range(2)]
+        # Returns well before the 10 second window would close.
+        await asyncio.wait_for(asyncio.gather(*(layer.group_send("room", m) for m in sent)), 1)
+        received = await self.receive_all(layer, channel)
+        self.assertEqual([unpack_batch(envelope) for envelope in received], [sent])
+
+    async def test_groups_are_batched_separately(self):
+        layer = self.make_layer()
+        first, second = await self.joined(layer, "one"), await self.joined(layer, "two")
+        await asyncio.gather(
+            layer.group_send("one", {"type": "chat_message_broadcast", "id": 1}),
+            layer.group_send("two", {"type": "chat_message_broadcast", "id": 2}),
+        )
+        self.assertEqual(await self.receive_all(layer, first), [{"type": "chat_message_broadcast", "id": 1}])
+        self.assertEqual(await self.receive_all(layer, second), [{"type": "chat_message_broadcast", "id": 2}])
+
+    async def test_pending_messages_are_counted_until_sent(self):
+        layer = self.make_layer()
+        await self.joined(layer)
+        send = asyncio.ensure_future(layer.group_send("room", {"type": "chat_message_broadcast", "id": 1}))
+        await asyncio.sleep(0)
+        self.assertEqual(layer.pending_group_messages, 1)
+        await send
+        self.assertEqual(layer.pending_group_messages, 0)
+        self.assertEqual(layer.queued_messages, 1)
+
+    async def test_zero_window_sends_each_message_on_its_own(self):
+        layer = self.make_layer(group_send_batch_window=0)
+        channel = await self.joined(layer)
+        for i in range(2):
+            await layer.group_send("room", {"type": "chat_message_broadcast", "id": i})
+        received = await self.receive_all(layer, channel)
+        self.assertEqual([message["id"] for message in received], [0, 1])
+
+
+# --- Write-behind chat persistence ---
+
+class ChatMessageWriterTests(SimpleTestCase):
+    """
+    The writer's database calls are replaced, so these run without a database.
+    """
+
+    def setUp(self):
+        self.written = []
+        self.failures_left = 0
+        self.failure = OperationalError("database unavailable")
+        next_id = iter(range(1, 10_000))
+        patchers = [
+            mock.patch.object(chat_persistence, "write_chat_messages", side_effect=self.fake_write),
+            mock.patch.object(
+                chat_persistence, "reserve_chat_message_ids",
+                side_effect=lambda count: [next(next_id) for _ in range(count)],
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_write(self, batch):
+        if self.failures_left:
+            self.failures_left -= 1
+            raise self.failure
+        self.written.extend(message.id for message in batch)
+        return len(batch)
+
+    def make_writer(self, **options):
+        return chat_persistence.ChatMessageWriter(
+            **{"flush_interval": 0.01, "retry_delay": 0.01, "id_block_size": 5, **options},
+        )
+
+    async def enqueue(self, writer, count):
+        return [(await writer.enqueue(ChatMessage(message_content="hi"))).id for _ in range(count)]
+
+    async def test_failed_batches_are_retried_in_order(self):
+        writer = self.make_writer(batch_size=2)
+        self.failures_left = 2
+        with self.assertLogs("api.chat_persistence", "ERROR") as logs:
+            ids = await self.enqueue(writer, 5)
+            self.assertTrue(await writer.flush())
+        self.assertEqual(self.written, ids)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(writer.pending, 0)
+
+    async def test_flush_gives_up_after_the_timeout_but_keeps_the_messages(self):
+        writer = self.make_writer(retry_delay=0.05, flush_timeout=0.1)
+        self.failures_left = 1000
+        with self.assertLogs("api.chat_persistence", "WARNING"):
+            ids = await self.enqueue(writer, 3)
+            self.assertFalse(await writer.flush())
+        self.assertEqual(self.written, [])
+        self.assertEqual(writer.pending, 3)
+        self.failures_left = 0
+        writer.flush_sync()
+        self.assertEqual(self.written, ids)
+
+    async def test_a_full_queue_pushes_back_while_writes_fail(self):
+        writer = self.make_writer(max_queue=2)
+        self.failures_left = 1000
+        with self.assertLogs("api.chat_persistence", "ERROR"):
+            await self.enqueue(writer, 2)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.enqueue(writer, 1), 0.1)
+            self.failures_left = 0
+            await asyncio.wait_for(self.enqueue(writer, 1), 1)
+
+    async def test_other_errors_drop_the_batch_instead_of_stalling_the_queue(self):
+        writer = self.make_writer(batch_size=2, flush_interval=10)
+        self.failures_left = 1
+        self.failure = ValueError("cannot be written")
+        with self.assertLogs("api.chat_persistence", "ERROR") as logs:
+            dropped = await self.enqueue(writer, 2)
+            ids = await self.enqueue(writer, 2)
+            self.assertTrue(await writer.flush())
+        self.assertEqual(self.written, ids)
+        self.assertNotIn(dropped[0], self.written)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(writer.pending, 0)
+
+    def test_each_event_loop_gets_its_own_queue(self):
+        writer = self.make_writer()
+
+        async def session():
+            ids = await self.enqueue(writer, 2)
+            await writer.flush()
+            return ids
+
+        first = asyncio.run(session())
+        second = asyncio.run(session())
+        self.assertEqual(self.written, first + second)
+
+    def test_messages_left_by_a_closed_loop_are_written_by_the_next(self):
+        writer = self.make_writer(flush_interval=10)
+        left_behind = asyncio.run(self.enqueue(writer, 2))
+        self.assertEqual(self.written, [])
+
+        async def session():
+            await writer.flush()
+
+        asyncio.run(session())
+        self.assertEqual(self.written, left_behind)
+
+
+class WriteChatMessagesTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = make_provider("provider", "Provider")
+        cls.customer = User.objects.create(username="customer")
+        cls.booking = make_booking(cls.customer, cls.provider)
+
+    def make_messages(self, *contents):
+        ids = chat_persistence.reserve_chat_message_ids(len(contents))
+        return [
+            ChatMessage(
+                id=message_id, booking=self.booking, sender=self.customer,
+                room_identifier=f"booking_{self.booking.pk}", message_content=content,
+            )
+            for message_id, content in zip(ids, contents)
+        ]
+
+    def test_a_rejected_row_does_not_lose_the_rest_of_the_batch(self):
+        messages = self.make_messages("first", "nul \x00 byte", "third")
+        with self.assertLogs("api.chat_persistence", "WARNING") as logs:
+            self.assertEqual(chat_persistence.write_chat_messages(messages), 2)
+        self.assertEqual(
+            list(ChatMessage.objects.values_list("message_content", flat=True).order_by("id")),
+            ["first", "third"],
+        )
+        self.assertIn(str(messages[1].id), logs.output[0])
+        summary = ChatRoomSummary.objects.get(room_identifier=f"booking_{self.booking.pk}")
+        self.assertEqual(summary.last_message_id, messages[2].id)
+
+    def test_transient_errors_are_raised_for_a_retry(self):
+        messages = self.make_messages("first")
+        with mock.patch.object(
+            ChatMessage.objects, "bulk_create", side_effect=OperationalError("connection lost"),
+        ):
+            with self.assertRaises(OperationalError):
+                chat_persistence.write_chat_messages(messages)
+
+
+# --- Response caches ---
+
+class CategoryListCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        ServiceCategory.objects.create(name="Plumbing")
+
+    def test_catalog_is_served_from_the_cache(self):
+        first = self.client.get("/api/categories/")
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/categories/")
+            revalidated = self.client.get("/api/categories/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_category_changes_are_invalidated_on_commit(self):
+        first = self.client.get("/api/categories/")
+        with self.captureOnCommitCallbacks(execute=True):
+            ServiceCategory.objects.create(name="Electrical")
+        second = self.client.get("/api/categories/")
+        self.assertEqual([row["name"] for row in json.loads(second.content)], ["Electrical", "Plumbing"])
+        self.assertNotEqual(second["ETag"], first["ETag"])
+        self.assertEqual(self.client.get("/api/categories/", HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 200)
+
+
+class ProviderDetailCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = make_provider("provider", "Provider")
+        cls.category = ServiceCategory.objects.create(name="Plumbing")
+        cls.provider.services_offered.add(cls.category)
+        cls.customer = User.objects.create(username="customer")
+
+    def setUp(self):
+        cache.clear()
+        provider_detail_cache.local.clear()
+        self.client.force_authenticate(self.customer)
+        self.url = f"/api/providers/{self.provider.pk}/"
+
+    def document(self, url=None):
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_document_is_served_from_the_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        # A different field selection is a document of its own.
+        self.assertEqual(self.document(self.url + "?fields=business_name"), {"business_name": "Provider"})
+        provider_detail_cache.local.clear()
+        with self.assertNumQueries(0):
+            # Still in the shared tier.
+            self.assertEqual(self.client.get(self.url).content, first.content)
+
+    def test_profile_changes_are_invalidated_on_commit(self):
+        self.document()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.provider.business_name = "Renamed"
+            self.provider.save()
+            self.assertEqual(self.document()["business_name"], "Provider")
+        self.assertTrue(callbacks)
+        self.assertEqual(self.document()["business_name"], "Renamed")
+
+    def test_reviews_and_reviewers_are_invalidated(self):
+        self.document()
+        booking = make_booking(self.customer, self.provider, status="COMPLETED")
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(booking=booking, reviewer=self.customer, provider_profile=self.provider, rating=4)
+        (review,) = self.document()["reviews_received"]
+        self.assertEqual(review["rating"], 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.first_name = "Casey"
+            self.customer.save()
+        self.assertIn("Casey", json.dumps(self.document()["reviews_received"]))
+
+    def test_category_changes_are_invalidated(self):
+        self.document()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "Pipes"
+            self.category.save()
+        self.assertEqual([row["name"] for row in self.document()["services_offered"]], ["Pipes"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider.services_offered.clear()
+        self.assertEqual(self.document()["services_offered"], [])
+
+    def test_missing_documents_are_not_cached(self):
+        ServiceProviderProfile.objects.filter(pk=self.provider.pk).update(status="PENDING")
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        ServiceProviderProfile.objects.filter(pk=self.provider.pk).update(status="APPROVED")
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+# --- Cache invalidation after commit ---
+
+class RoomAccessInvalidationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = make_provider("provider", "Provider")
+        cls.customer = User.objects.create(username="customer")
+        cls.other = User.objects.create(username="other")
+        cls.booking = make_booking(cls.customer, cls.provider)
+        cls.room = f"booking_{cls.booking.pk}"
+
+    def setUp(self):
+        cache.clear()
+        room_access_cache.local.clear()
+
+    def test_participant_change_is_invalidated_on_commit(self):
+        self.assertFalse(room_access_cache.get(self.other, self.room).authorized)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.booking.customer = self.other
+            self.booking.save()
+            # Not yet committed: the cached result still stands.
+            self.assertFalse(room_access_cache.get(self.other, self.room).authorized)
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(room_access_cache.get(self.other, self.room).authorized)
+
+    def test_delete_is_invalidated_on_commit(self):
+        self.assertTrue(room_access_cache.get(self.customer, self.room).authorized)
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.filter(pk=self.booking.pk).delete()
+            self.assertTrue(room_access_cache.get(self.customer, self.room).authorized)
+        self.assertFalse(room_access_cache.get(self.customer, self.room).authorized)
+
+
+class UserSnapshotInvalidationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="snapshot")
+
+    def test_deactivation_is_invalidated_on_commit(self):
+        self.assertTrue(get_user_snapshot(self.user.pk)["is_active"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            self.assertTrue(get_user_snapshot(self.user.pk)["is_active"])
+        self.assertFalse(get_user_snapshot(self.user.pk)["is_active"])
+
+    def test_delete_is_invalidated_on_commit(self):
+        user_id = self.user.pk
+        self.assertIsNotNone(get_user_snapshot(user_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertIsNone(get_user_snapshot(user_id))
+
+
+class SnapshotAuthCacheCheckTests(SimpleTestCase):
+    LOCAL_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    SHARED_CACHE = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://"}}
+
+    def test_snapshot_mode_needs_a_shared_cache(self):
+        with override_settings(JWT_AUTH_MODE="snapshot", CACHES=self.LOCAL_CACHE):
+            self.assertEqual([error.id for error in check_snapshot_auth_cache(None)], ["api.E001"])
+        with override_settings(JWT_AUTH_MODE="snapshot", CACHES=self.SHARED_CACHE):
+            self.assertEqual(check_snapshot_auth_cache(None), [])
+
+    def test_database_mode_works_with_any_cache(self):
+        with override_settings(JWT_AUTH_MODE="database", CACHES=self.LOCAL_CACHE):
+            self.assertEqual(check_snapshot_auth_cache(None), [])
+
+
+class PresenceCacheCheckTests(SimpleTestCase):
+    LOCAL_CACHE = SnapshotAuthCacheCheckTests.LOCAL_CACHE
+    SHARED_CACHE = SnapshotAuthCacheCheckTests.SHARED_CACHE
+
+    def test_presence_needs_a_shared_cache(self):
+        enabled = {**settings.CHAT_PRESENCE, "ENABLED": True}
+        with override_settings(CHAT_PRESENCE=enabled, CACHES=self.LOCAL_CACHE):
+            self.assertEqual([error.id for error in check_presence_cache(None)], ["api.E002"])
+        with override_settings(CHAT_PRESENCE=enabled, CACHES=self.SHARED_CACHE):
+            self.assertEqual(check_presence_cache(None), [])
+
+    def test_disabled_presence_works_with_any_cache(self):
+        with override_settings(CHAT_PRESENCE={**settings.CHAT_PRESENCE, "ENABLED": False}, CACHES=self.LOCAL_CACHE):
+            self.assertEqual(check_presence_cache(None), [])
+
+
+# --- Chat presence and typing ---
+
+class PresenceSocketCountTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_count_spans_workers(self):
+        # Every worker counts in the same cache entry.
+        self.assertEqual(presence.socket_opened(1), 1)
+        self.assertEqual(presence.socket_opened(1), 2)
+        self.assertEqual(presence.socket_closed(1), 1)
+        self.assertEqual(presence.socket_closed(1), 0)
+
+    def test_a_lapsed_count_starts_over(self):
+        presence.socket_opened(1)
+        cache.delete("presence-sockets:1")
+        self.assertEqual(presence.socket_closed(1), 0)
+        presence.socket_opened(1)
+        presence.socket_opened(1)
+        cache.delete("presence-sockets:1")
+        self.assertEqual(presence.socket_opened(1), 1)
+        self.assertEqual(presence.socket_closed(1), 0)
+        self.assertEqual(presence.socket_closed(1), 0)
+        self.assertEqual(presence.socket_opened(1), 1)
+
+
+@override_settings(SYNC_DB_EXECUTOR_WORKERS=0, CHAT_PRESENCE={**settings.CHAT_PRESENCE, "ENABLED": True})
+class PresenceSocketTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        room_access_cache.local.clear()
+        self.provider = make_provider("provider", "Provider")
+        self.customer = User.objects.create(username="customer")
+        self.room = f"booking_{make_booking(self.customer, self.provider).pk}"
+
+    async def connect(self, user, path):
+        application = TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        communicator = WebsocketCommunicator(application, f"{path}?token={AccessToken.for_user(user)}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def next_frame(self, communicator, frame_type):
+        while True:
+            frame = json.loads(await communicator.receive_from(timeout=5))
+            if frame["type"] == frame_type:
+                return frame
+
+    def test_offline_is_announced_when_the_last_socket_closes(self):
+        async_to_sync(self.online_and_offline)()
+
+    async def online_and_offline(self):
+        watcher = await self.connect(self.provider.user, f"/ws/chat/{self.room}/")
+        self.assertEqual((await self.next_frame(watcher, "presence"))["status"], "offline")
+        first = await self.connect(self.customer, f"/ws/chat/{self.room}/")
+        event = await self.next_frame(watcher, "presence")
+        self.assertEqual((event["user_id"], event["status"]), (self.customer.pk, "online"))
+        second = await self.connect(self.customer, "/ws/chat/")
+        self.assertEqual((await self.next_frame(watcher, "presence"))["status"], "online")
+        await first.disconnect()
+        # Still connected through the second socket: the next event is its heartbeat.
+        await second.send_json_to({"type": "heartbeat", "status": "away"})
+        self.assertEqual((await self.next_frame(watcher, "presence"))["status"], "away")
+        await second.disconnect()
+        event = await self.next_frame(watcher, "presence")
+        self.assertEqual(event["status"], "offline")
+        self.assertIsNotNone(event["last_seen"])
+        await watcher.disconnect()
+
+    def test_typing_is_coalesced(self):
+        async_to_sync(self.typing)()
+
+    async def typing(self):
+        watcher = await self.connect(self.provider.user, f"/ws/chat/{self.room}/")
+        typist = await self.connect(self.customer, f"/ws/chat/{self.room}/")
+        for _ in range(5):
+            await typist.send_json_to({"type": "typing", "is_typing": True})
+        await typist.send_json_to({"type": "typing", "is_typing": False})
+        first = await self.next_frame(watcher, "typing")
+        self.assertEqual((first["user_id"], first["is_typing"]), (self.customer.pk, True))
+        # The final "stopped typing" goes out when the window ends, and nothing else.
+        last = await self.next_frame(watcher, "typing")
+        self.assertFalse(last["is_typing"])
+        self.assertTrue(await watcher.receive_nothing(settings.CHAT_PRESENCE["TYPING_INTERVAL"] * 2))
+        await typist.disconnect()
+        await watcher.disconnect()
+
+
+# --- Multiplexed chat socket ---
+
+@override_settings(SYNC_DB_EXECUTOR_WORKERS=0)
+class MultiplexSubscriptionTests(TransactionTestCase):
+    """
+    One socket joins and leaves rooms with frames; each subscription is authorized on
+    its own and every room frame carries its room_name.
+    """
+
+    def setUp(self):
+        cache.clear()
+        room_access_cache.local.clear()
+        self.provider = make_provider("provider", "Provider")
+        self.customer = User.objects.create(username="customer")
+        self.stranger = User.objects.create(username="stranger")
+        self.room = f"booking_{make_booking(self.customer, self.provider).pk}"
+        self.other_room = f"booking_{make_booking(self.customer, self.provider, days_ahead=2).pk}"
+        self.foreign_room = f"booking_{make_booking(self.stranger, self.provider, days_ahead=3).pk}"
+        self.history = send_messages(Booking.objects.get(pk=self.room.split("_")[1]), self.provider.user, 2)
+
+    async def connect(self, user, path):
+        application = TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        communicator = WebsocketCommunicator(application, f"{path}?token={AccessToken.for_user(user)}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def next_frame(self, communicator, frame_type):
+        while True:
+            frame = json.loads(await communicator.receive_from(timeout=5))
+            if frame["type"] == frame_type:
+                return frame
+
+    async def provider_says(self, room, text):
+        # Returns once the provider's own socket has the broadcast.
+        provider = await self.connect(self.provider.user, f"/ws/chat/{room}/")
+        await provider.send_json_to({"message": text})
+        while (await self.next_frame(provider, "chat_message"))["message"] != text:
+            pass
+        await provider.disconnect()
+
+    def test_subscribe_and_unsubscribe(self):
+        async_to_sync(self.subscribe_and_unsubscribe)()
+        self.assertEqual(
+            ChatReadCursor.objects.get(user=self.customer, room_identifier=self.room).last_read_message_id,
+            self.history[-1].pk,
+        )
+        self.assertTrue(ChatMessage.objects.filter(room_identifier=self.other_room, message_content="hello").exists())
+
+    async def subscribe_and_unsubscribe(self):
+        socket = await self.connect(self.customer, "/ws/chat/")
+        await socket.send_json_to({"type": "subscribe", "room_name": self.room})
+        self.assertEqual(await self.next_frame(socket, "subscribed"), {"type": "subscribed", "room_name": self.room})
+        history = await self.next_frame(socket, "message_history")
+        self.assertEqual(history["room_name"], self.room)
+        self.assertEqual([message["id"] for message in history["messages"]], [message.pk for message in self.history])
+        await socket.send_json_to({"type": "subscribe", "room_name": self.other_room, "history": False})
+        await self.next_frame(socket, "subscribed")
+
+        await self.provider_says(self.room, "to the first room")
+        received = await self.next_frame(socket, "chat_message")
+        self.assertEqual((received["room_name"], received["message"]), (self.room, "to the first room"))
+        await socket.send_json_to({"type": "message", "room_name": self.other_room, "message": "hello"})
+        received = await self.next_frame(socket, "chat_message")
+        self.assertEqual((received["room_name"], received["is_self"]), (self.other_room, True))
+
+        await socket.send_json_to({"type": "unsubscribe", "room_name": self.room})
+        self.assertEqual(await self.next_frame(socket, "unsubscribed"), {"type": "unsubscribed", "room_name": self.room})
+        await self.provider_says(self.room, "after leaving")
+        self.assertTrue(await socket.receive_nothing(0.2))
+        await socket.send_json_to({"type": "message", "room_name": self.room, "message": "too late"})
+        error = await self.next_frame(socket, "error")
+        self.assertEqual(error["room_name"], self.room)
+        await socket.disconnect()
+
+    def test_rooms_of_other_users_are_denied(self):
+        async_to_sync(self.denied)()
+        self.assertFalse(ChatMessage.objects.filter(room_identifier=self.foreign_room, sender=self.customer).exists())
+
+    async def denied(self):
+        socket = await self.connect(self.customer, "/ws/chat/")
+        with self.assertLogs("api.consumers", "INFO"):
+            await socket.send_json_to({"type": "subscribe", "room_name": self.foreign_room})
+            error = await self.next_frame(socket, "error")
+        self.assertEqual((error["room_name"], error["message"]), (self.foreign_room, "Not authorized for this room."))
+        await socket.send_json_to({"type": "subscribe", "room_name": "booking_x; DROP"})
+        self.assertIn("valid 'room_name'", (await self.next_frame(socket, "error"))["message"])
+        await socket.send_json_to({"type": "message", "room_name": self.foreign_room, "message": "hi"})
+        self.assertIn("subscribed 'room_name'", (await self.next_frame(socket, "error"))["message"])
+        await self.provider_says(self.foreign_room, "not for the customer")
+        self.assertTrue(await socket.receive_nothing(0.2))
+        await socket.disconnect()
@@ -7,14 +7,21 @@ from .views import (
     ServiceProviderListView,
     ServiceProviderDetailView,
     MyProviderProfileView,
+    ProviderAvailabilityView,
+    MyWorkingHoursListView,
+    MyWorkingHoursDetailView,
+    MyBlockedIntervalListView,
+    MyBlockedIntervalDetailView,
     BookingCreateView,
     BookingListView,
     BookingDetailView,
     BookingStatusUpdateView,
     ReviewCreateAPIView,
+    ChatInboxView,
     UserProfileView,
     MyTokenObtainPairView,
     MyUserProfileEditView,
+    metrics_view,
 )
 from rest_framework_simplejwt.views import TokenRefreshView
 
@@ -35,6 +42,13 @@ urlpatterns = [
     path("providers/me/", MyProviderProfileView.as_view(), name="my-provider-profile"),
     path("providers/<int:user_id>/", ServiceProviderDetailView.as_view(), name="provider-detail"),
 
+    # Provider calendar
+    path("providers/<int:user_id>/availability/", ProviderAvailabilityView.as_view(), name="provider-availability"),
+    path("providers/me/working-hours/", MyWorkingHoursListView.as_view(), name="my-working-hours"),
+    path("providers/me/working-hours/<int:pk>/", MyWorkingHoursDetailView.as_view(), name="my-working-hours-detail"),
+    path("providers/me/blocked-intervals/", MyBlockedIntervalListView.as_view(), name="my-blocked-intervals"),
+    path("providers/me/blocked-intervals/<int:pk>/", MyBlockedIntervalDetailView.as_view(), name="my-blocked-intervals-detail"),
+
     # Bookings
     path("bookings/", BookingListView.as_view(), name="booking-list"),
     path("bookings/create/", BookingCreateView.as_view(), name="booking-create"),
@@ -43,4 +57,10 @@ urlpatterns = [
 
     # Reviews
     path("bookings/<int:booking_pk>/review/", ReviewCreateAPIView.as_view(), name="booking-review-create"),
+
+    # Chat
+    path("chat/inbox/", ChatInboxView.as_view(), name="chat-inbox"),
+
+    # Operations
+    path("metrics/", metrics_view, name="metrics"),
 ]
\ No newline at end of file
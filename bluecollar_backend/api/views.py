@@ -2,14 +2,24 @@
 
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
-from django.db.models import Q
-from django.http import Http404
+from django.db.models import Prefetch, Q
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import ServiceCategory, ServiceProviderProfile, Booking, Review
+from . import metrics
+from .availability import free_intervals, parse_availability_range
+from .fieldsets import SparseFieldsetViewMixin, nested_columns
+from .geo import parse_near, providers_near
+from .models import ServiceCategory, ServiceProviderProfile, Booking, Review, ProviderWorkingHours, ProviderBlockedInterval, ChatRoomSummary
+from .pagination import InboxPagination, KeysetPagination
 from .permissions import CanReviewBookingPermission
+from .response_cache import get_category_list_payload, get_provider_detail_payload, payload_response
+from .search import search_providers
 from .serializers import (
     BasicUserSerializer,
     UserRegistrationSerializer,
@@ -22,6 +32,9 @@ from .serializers import (
     ReviewSerializer,
     MyTokenObtainPairSerializer,
     UserProfileSerializer,
+    ProviderWorkingHoursSerializer,
+    ProviderBlockedIntervalSerializer,
+    ChatRoomSummarySerializer,
 )
 
 User = get_user_model()
@@ -41,8 +54,7 @@ class IsProviderOfBooking(permissions.BasePermission):
         return (
             request.user.is_authenticated
             and request.user.is_provider
-            and hasattr(request.user, "provider_profile")
-            and obj.provider_profile == request.user.provider_profile
+            and obj.provider_profile_id == request.user.id
         )
 
 class IsParticipantInBooking(permissions.BasePermission):
@@ -51,10 +63,18 @@ class IsParticipantInBooking(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if not request.user or not request.user.is_authenticated:
             return False
-        is_customer = request.user == obj.customer
+        is_customer = request.user.id == obj.customer_id
         is_provider = request.user.is_provider and request.user.id == obj.provider_profile_id
         return is_customer or is_provider
 
+class HasProviderProfile(permissions.BasePermission):
+    message = "Only service providers can manage a calendar."
+    def has_permission(self, request, view):
+        return (
+            request.user.is_authenticated
+            and ServiceProviderProfile.objects.filter(pk=request.user.id).exists()
+        )
+
 
 # --- VIEW CLASSES ---
 
@@ -72,14 +92,18 @@ class ProviderRegistrationView(generics.CreateAPIView):
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
+# The profile views below work on the full User row, so they authenticate against the
+# database rather than the user snapshot cache.
 class UserProfileView(generics.RetrieveAPIView):
     serializer_class = BasicUserSerializer
+    authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     def get_object(self):
         return self.request.user
     
 class MyUserProfileEditView(generics.RetrieveUpdateAPIView):
     serializer_class = UserProfileSerializer
+    authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     def get_object(self):
         return self.request.user
@@ -87,18 +111,92 @@ class MyUserProfileEditView(generics.RetrieveUpdateAPIView):
         return User.objects.filter(pk=self.request.user.pk)
 
 # --- Service & Provider Views ---
+def provider_reviews_prefetch():
+    # Reviews are serialized with their reviewer, so fetch both in the prefetch query.
+    return Prefetch("reviews_received", queryset=Review.objects.select_related("reviewer").only(
+        "id", "booking", "provider_profile", "rating", "comment", "created_at",
+        *nested_columns("reviewer", BasicUserSerializer),
+    ))
+
+
 class ServiceCategoryListView(generics.ListAPIView):
+    """
+    Public category catalog, served from a pre-rendered cached payload with ETag and
+    Last-Modified validators. A revalidation whose validators still match is answered
+    with 304 from the cache alone.
+    """
     queryset = ServiceCategory.objects.all().order_by("name")
     serializer_class = ServiceCategorySerializer
+    # The catalog is the same for everyone, so skip token checks altogether.
+    authentication_classes = []
     permission_classes = [permissions.AllowAny]
+    read_from_replica = True
+
+    def list(self, request, *args, **kwargs):
+        payload = get_category_list_payload(
+            request, lambda: self.get_serializer(self.get_queryset(), many=True).data
+        )
+        return payload_response(request, payload)
 
-class ServiceProviderListView(generics.ListAPIView):
+class ProviderFieldsetMixin(SparseFieldsetViewMixin):
+    # What each part of ServiceProviderProfileSerializer needs from the database.
+    fieldset_select_related = {"user": ["user"]}
+    fieldset_prefetch_related = {
+        "services_offered": ["services_offered"],
+        "reviews_received": [provider_reviews_prefetch],
+    }
+    fieldset_columns = {
+        "user": nested_columns("user", BasicUserSerializer),
+        "average_rating": ["average_rating", "review_count"],
+        "profile_picture_srcset": ["profile_picture_variants"],
+    }
+
+    def get_provider_queryset(self):
+        return self.apply_fieldset(
+            ServiceProviderProfile.objects.filter(status='APPROVED')
+        )
+
+
+class ServiceProviderListView(ProviderFieldsetMixin, generics.ListAPIView):
     serializer_class = ServiceProviderProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    read_from_replica = True
+    pagination_class = KeysetPagination
+    # ?ordering= values. Each ends with the primary key so it is unique, which keyset
+    # pagination needs; anything else falls back to the business name ordering.
+    orderings = {
+        "name": ("business_name", "user_id"),
+        "rating": ("-average_rating", "-review_count", "business_name", "user_id"),
+        "reviews": ("-review_count", "business_name", "user_id"),
+    }
+    search_ordering = ("-search_rank", "business_name", "user_id")
+    distance_ordering = ("distance_km", "user_id")
+
+    def get_keyset_ordering(self):
+        params = self.request.query_params
+        ordering = self.orderings.get(params.get("ordering"))
+        if ordering is None and params.get("near"):
+            # Nearest first on distance searches, unless the client asked for an ordering.
+            return self.distance_ordering
+        if ordering is None and params.get("search"):
+            # Best full-text matches first unless the client asked for an ordering.
+            return self.search_ordering
+        return ordering or self.orderings["name"]
+
+    def get_near(self):
+        """
+        (latitude, longitude, radius_km) from ?near=lat,lng&radius=km, or None.
+        """
+        near = self.request.query_params.get("near")
+        if not near:
+            return None
+        try:
+            return parse_near(near, self.request.query_params.get("radius"))
+        except ValueError as e:
+            raise ValidationError({"near": str(e)})
+
     def get_queryset(self):
-        queryset = ServiceProviderProfile.objects.filter(status='APPROVED').select_related("user").prefetch_related(
-            "services_offered", "reviews_received"
-        ).filter(user__is_active=True).all()
+        queryset = self.get_provider_queryset().filter(user__is_active=True)
         category_id = self.request.query_params.get("category", None)
         search_term = self.request.query_params.get("search", None)
         if category_id:
@@ -107,24 +205,35 @@ class ServiceProviderListView(generics.ListAPIView):
             except (ValueError, TypeError):
                 pass
         if search_term:
-            queryset = queryset.filter(
-                Q(business_name__icontains=search_term)
-                | Q(bio__icontains=search_term)
-                | Q(user__username__icontains=search_term)
-                | Q(services_offered__name__icontains=search_term)
-            ).distinct()
-        return queryset.order_by("business_name")
-
-class ServiceProviderDetailView(generics.RetrieveAPIView):
-    queryset = ServiceProviderProfile.objects.filter(status='APPROVED').select_related("user").prefetch_related(
-        "services_offered", "reviews_received"
-    ).all()
+            # Full-text match on the stored search document (annotates `search_rank`).
+            queryset = search_providers(queryset, search_term)
+        near = self.get_near()
+        if near:
+            # Geohash-cell candidates, then exact distance (annotates `distance_km`).
+            queryset = providers_near(queryset, *near)
+        return queryset.order_by(*self.get_keyset_ordering())
+
+class ServiceProviderDetailView(ProviderFieldsetMixin, generics.RetrieveAPIView):
     serializer_class = ServiceProviderProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    read_from_replica = True
     lookup_field = "user_id"
 
+    def get_queryset(self):
+        return self.get_provider_queryset()
+
+    def retrieve(self, request, *args, **kwargs):
+        # Served from the versioned provider document cache; the queryset only runs
+        # on a miss (and raises 404 there for unknown or unapproved providers).
+        payload = get_provider_detail_payload(
+            request, self.kwargs[self.lookup_field], self.get_fieldset().cache_key(),
+            lambda: self.get_serializer(self.get_object()).data,
+        )
+        return payload_response(request, payload)
+
 class MyProviderProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = ServiceProviderProfileSerializer
+    authentication_classes = [JWTAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     def get_object(self):
@@ -135,39 +244,153 @@ class MyProviderProfileView(generics.RetrieveUpdateAPIView):
     def get_queryset(self):
         return ServiceProviderProfile.objects.filter(user=self.request.user)
 
+# --- Provider Calendar Views ---
+class ProviderAvailabilityView(generics.GenericAPIView):
+    """
+    Free time of an approved provider: GET ?start=YYYY-MM-DD&end=YYYY-MM-DD&duration=<hours>
+    lists the intervals in which a booking of that duration fits.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    queryset = ServiceProviderProfile.objects.filter(status='APPROVED', user__is_active=True)
+    lookup_field = "user_id"
+
+    def get(self, request, *args, **kwargs):
+        provider = self.get_object()
+        params = request.query_params
+        try:
+            start, end, duration = parse_availability_range(params.get("start"), params.get("end"), params.get("duration"))
+        except ValueError as e:
+            raise ValidationError({"detail": str(e)})
+        free = free_intervals(provider.pk, start, end, duration)
+        return Response({
+            "provider": provider.pk,
+            "start": start,
+            "end": end,
+            "duration_hours": duration.total_seconds() / 3600,
+            "free": [{"start": free_start, "end": free_end} for free_start, free_end in free],
+        })
+
+class MyWorkingHoursListView(generics.ListCreateAPIView):
+    serializer_class = ProviderWorkingHoursSerializer
+    permission_classes = [permissions.IsAuthenticated, HasProviderProfile]
+    def get_queryset(self):
+        return ProviderWorkingHours.objects.filter(provider_profile_id=self.request.user.id)
+    def perform_create(self, serializer):
+        serializer.save(provider_profile_id=self.request.user.id)
+
+class MyWorkingHoursDetailView(generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = ProviderWorkingHoursSerializer
+    permission_classes = [permissions.IsAuthenticated, HasProviderProfile]
+    def get_queryset(self):
+        return ProviderWorkingHours.objects.filter(provider_profile_id=self.request.user.id)
+
+class MyBlockedIntervalListView(generics.ListCreateAPIView):
+    serializer_class = ProviderBlockedIntervalSerializer
+    permission_classes = [permissions.IsAuthenticated, HasProviderProfile]
+    def get_queryset(self):
+        return ProviderBlockedInterval.objects.filter(provider_profile_id=self.request.user.id)
+    def perform_create(self, serializer):
+        serializer.save(provider_profile_id=self.request.user.id)
+
+class MyBlockedIntervalDetailView(generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = ProviderBlockedIntervalSerializer
+    permission_classes = [permissions.IsAuthenticated, HasProviderProfile]
+    def get_queryset(self):
+        return ProviderBlockedInterval.objects.filter(provider_profile_id=self.request.user.id)
+
 # --- Booking & Review Views ---
 class BookingCreateView(generics.CreateAPIView):
     queryset = Booking.objects.all()
     serializer_class = BookingCreateSerializer
     permission_classes = [permissions.IsAuthenticated, IsCustomerUser]
 
-class BookingListView(generics.ListAPIView):
+class BookingFieldsetMixin(SparseFieldsetViewMixin):
+    # What each part of BookingListSerializer needs from the database.
+    fieldset_select_related = {
+        "customer": ["customer"],
+        "provider_business_name": ["provider_profile"],
+        "provider_username": ["provider_profile__user"],
+        "service_category_requested_name": ["service_category_requested"],
+    }
+    fieldset_prefetch_related = {"review": ["review"]}
+    fieldset_columns = {
+        "customer": nested_columns("customer", BasicUserSerializer),
+        "provider_business_name": ["provider_profile__business_name"],
+        "provider_username": ["provider_profile__user__username"],
+        "service_category_requested_name": ["service_category_requested__name"],
+        "unread_chat_messages_for_provider": ["provider_profile"],
+    }
+    unread_count_fields = ("unread_messages_count", "unread_chat_messages_for_provider")
+
+    def get_booking_queryset(self):
+        qs = self.apply_fieldset(Booking.objects.all())
+        if self.get_fieldset().includes_any(self.unread_count_fields):
+            qs = qs.with_unread_message_counts(self.request.user)
+        return qs
+
+
+class BookingListView(BookingFieldsetMixin, generics.ListAPIView):
     serializer_class = BookingListSerializer
     permission_classes = [permissions.IsAuthenticated]
+    read_from_replica = True
+    pagination_class = KeysetPagination
+
+    def get_keyset_ordering(self):
+        return ("-created_at", "id")
+
     def get_queryset(self):
         user = self.request.user
-        qs = Booking.objects.select_related(
-            "customer", "provider_profile__user", "service_category_requested"
-        ).prefetch_related("review")
-        if user.is_provider and hasattr(user, "provider_profile") and user.provider_profile:
-            return qs.filter(provider_profile=user.provider_profile)
-        elif not user.is_provider:
-            return qs.filter(customer=user)
-        return Booking.objects.none()
+        qs = self.get_booking_queryset().order_by(*self.get_keyset_ordering())
+        # A provider's profile shares its primary key with the user, so no profile lookup is needed.
+        if user.is_provider:
+            return qs.filter(provider_profile_id=user.pk)
+        return qs.filter(customer_id=user.pk)
 
 # === THIS IS THE VIEW TO FIX ===
-class BookingDetailView(generics.RetrieveAPIView):
-    queryset = Booking.objects.all()
+class BookingDetailView(BookingFieldsetMixin, generics.RetrieveAPIView):
     serializer_class = BookingListSerializer # <<< USE THE EXISTING LIST SERIALIZER
     permission_classes = [permissions.IsAuthenticated, IsParticipantInBooking]
+    # Read by IsParticipantInBooking.
+    fieldset_required_columns = ("customer", "provider_profile")
+
+    def get_queryset(self):
+        return self.get_booking_queryset()
 # === END OF FIX ===
 
-class BookingStatusUpdateView(generics.UpdateAPIView):
-    queryset = Booking.objects.all()
+class BookingStatusUpdateView(BookingFieldsetMixin, generics.GenericAPIView):
+    """
+    PATCH {"status": ..., "version": n}: one step of Booking.STATUS_TRANSITIONS, by the
+    booking's provider or customer. The change is a single conditional UPDATE; if the
+    booking changed since it was read (or since `version`), the answer is 409 with
+    its current status and version. On success the response is the updated booking as
+    in the booking list (?fields= / ?expand= apply).
+    """
+    queryset = Booking.objects.only("id", "customer_id", "provider_profile_id", "status", "version")
     serializer_class = BookingStatusUpdateSerializer
-    permission_classes = [permissions.IsAuthenticated, IsProviderOfBooking]
+    fieldset_serializer_class = BookingListSerializer
+    permission_classes = [permissions.IsAuthenticated, IsParticipantInBooking]
     http_method_names = ["patch"]
 
+    def patch(self, request, *args, **kwargs):
+        booking = self.get_object()
+        role = "customer" if booking.customer_id == request.user.id else "provider"
+        serializer = self.get_serializer(
+            data=request.data, context={**self.get_serializer_context(), "booking": booking, "role": role}
+        )
+        serializer.is_valid(raise_exception=True)
+        version = serializer.validated_data.get("version", booking.version)
+        new_version = None
+        if version == booking.version:
+            new_version = Booking.apply_transition(booking, serializer.validated_data["status"], version)
+        if new_version is None:
+            current = Booking.objects.filter(pk=booking.pk).values("status", "version").first() or {}
+            return Response(
+                {"detail": "The booking was changed by someone else. Reload it and try again.", **current},
+                status=status.HTTP_409_CONFLICT,
+            )
+        updated = self.get_booking_queryset().get(pk=booking.pk)
+        return Response(BookingListSerializer(updated, context=self.get_serializer_context()).data)
+
 class ReviewCreateAPIView(generics.CreateAPIView):
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -184,10 +407,55 @@ class ReviewCreateAPIView(generics.CreateAPIView):
         try:
             serializer.save(
                 booking=booking,
-                reviewer=request.user,
-                provider_profile=booking.provider_profile,
+                reviewer_id=request.user.id,
+                provider_profile_id=booking.provider_profile_id,
             )
         except ValueError as e:
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
\ No newline at end of file
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+class ChatInboxView(generics.ListAPIView):
+    """
+    The user's chat rooms, most recently active first, each with its last message and
+    unread count: one page of room summaries per request, never a ChatMessage scan.
+    Paginated with ?page_size= and the `next` cursor.
+    """
+    serializer_class = ChatRoomSummarySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = InboxPagination
+
+    def get_keyset_ordering(self):
+        return ("-last_activity_at", "id")
+
+    def get_keyset_partitions(self):
+        # A user is either participant of a room; each side pages through its own
+        # (participant, -last_activity_at, id) index.
+        user = self.request.user
+        return [Q(participant_a_id=user.pk), Q(participant_b_id=user.pk)]
+
+    def get_queryset(self):
+        user = self.request.user
+        return (
+            ChatRoomSummary.objects.for_user(user)
+            .select_related("participant_a", "participant_b")
+            .only(
+                "room_identifier", "booking_id", "last_message_id", "last_sender_id",
+                "last_message_preview", "last_activity_at",
+                "participant_a__id", "participant_a__username", "participant_b__id", "participant_b__username",
+            )
+            .with_unread_message_counts(user)
+            .order_by(*self.get_keyset_ordering())
+        )
+
+
+# --- Operations ---
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Answers 404 unless metrics are enabled and the
+    client address is in METRICS_ALLOWED_IPS.
+    """
+    if not metrics.ENABLED or request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
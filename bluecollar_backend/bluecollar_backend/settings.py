@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import copy
 from pathlib import Path
 import os
 
@@ -47,11 +48,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'api.apps.ApiConfig', 
 ]
 
 MIDDLEWARE = [
-
+    'api.middleware.MetricsMiddleware', # Outermost, so it times the whole stack; inactive unless METRICS_ENABLED
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -60,6 +62,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware', # Inactive unless DB_REPLICA_HOSTS is set
 ]
 
 ROOT_URLCONF = 'bluecollar_backend.urls'
@@ -84,13 +87,82 @@ WSGI_APPLICATION = 'bluecollar_backend.wsgi.application'
 ASGI_APPLICATION = 'bluecollar_backend.asgi.application' # Point to your project's asgi.py
 
 # Channel Layers Configuration
-# Option 1: Using Redis (Recommended for development and production)
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# Set CHANNEL_REDIS_URL (e.g. redis://127.0.0.1:6379/0) to use Redis, which delivers
+# group messages across worker processes and nodes. Without it the in-memory layer is
+# used, which only reaches sockets served by the same process (single worker only).
+# Both layers coalesce bursts of group_send() calls to the same group (see api/channel_layers.py).
+CHANNEL_REDIS_URL = os.environ.get("CHANNEL_REDIS_URL")
+CHANNEL_LAYER_CONFIG = {
+    "capacity": int(os.environ.get("CHANNEL_LAYER_CAPACITY", 1000)),  # Messages queued per channel before ChannelFull
+    "expiry": int(os.environ.get("CHANNEL_LAYER_EXPIRY", 60)),  # Seconds an undelivered message is kept
+    "group_expiry": int(os.environ.get("CHANNEL_LAYER_GROUP_EXPIRY", 86400)),  # Seconds a group membership lives
+    "group_send_batch_window": float(os.environ.get("CHANNEL_LAYER_BATCH_WINDOW", 0.005)),
+    "group_send_batch_size": int(os.environ.get("CHANNEL_LAYER_BATCH_SIZE", 50)),
+}
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "api.channel_layers.BatchingRedisChannelLayer",
+            "CONFIG": {
+                "hosts": [CHANNEL_REDIS_URL],
+                "prefix": os.environ.get("CHANNEL_LAYER_PREFIX", "bluecollar"),
+                **CHANNEL_LAYER_CONFIG,
+            },
+        }
     }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "api.channel_layers.BatchingInMemoryChannelLayer",
+            "CONFIG": CHANNEL_LAYER_CONFIG,
+        }
+    }
+
+# Chat message persistence. "sync" saves each message before broadcasting it.
+# "write_behind" broadcasts immediately and inserts messages in micro-batches
+# (api/chat_persistence.py): a batch is written after FLUSH_INTERVAL seconds or
+# BATCH_SIZE messages, and at most MAX_QUEUE messages per process wait to be written.
+# A batch that fails on a lost connection (or a similar transient error) is retried
+# after RETRY_DELAY seconds, doubling up to MAX_RETRY_DELAY; rows the database
+# rejects are dropped. A closing socket waits at most FLUSH_TIMEOUT seconds for its
+# messages to be written.
+CHAT_PERSISTENCE_MODE = os.environ.get("CHAT_PERSISTENCE_MODE", "sync")
+CHAT_WRITE_BEHIND = {
+    "BATCH_SIZE": 200,
+    "FLUSH_INTERVAL": 0.05,
+    "MAX_QUEUE": 5000,
+    "ID_BLOCK_SIZE": 20,  # Message ids reserved from the sequence per round trip
+    "RETRY_DELAY": 0.5,
+    "MAX_RETRY_DELAY": 30,
+    "FLUSH_TIMEOUT": 10,
 }
 
+# Chat presence and typing indicators (api/presence.py). They live in the cache and
+# the channel layer only, never in the database. Sockets send a heartbeat every
+# HEARTBEAT_INTERVAL seconds; a user counts as offline once EXPIRY seconds pass
+# without one, so sockets of a crashed worker lapse on their own. Last-seen times are
+# kept LAST_SEEN_TTL seconds. A socket's typing state goes out at most once per
+# TYPING_INTERVAL seconds, and clients drop it after TYPING_TTL seconds.
+# Presence needs a cache shared by every worker (CACHE_REDIS_URL), so it is off by
+# default without one and api/checks.py rejects it with a per-process cache. Typing
+# indicators go through the channel layer and work either way.
+CHAT_PRESENCE = {
+    "ENABLED": os.environ.get(
+        "CHAT_PRESENCE_ENABLED", "1" if os.environ.get("CACHE_REDIS_URL") else ""
+    ).lower() in ("1", "true", "yes"),
+    "HEARTBEAT_INTERVAL": 25,
+    "EXPIRY": 60,
+    "LAST_SEEN_TTL": 7 * 24 * 3600,
+    "TYPING_INTERVAL": 0.3,
+    "TYPING_TTL": 6,
+}
+
+# Sync database work started from async code (socket authorization, write-behind
+# batches; api/sync_executor.py). 0 runs it on the single thread-sensitive thread
+# that Django's async ORM also uses; N > 0 gives it a dedicated pool of N threads,
+# each with its own database connection.
+SYNC_DB_EXECUTOR_WORKERS = int(os.environ.get("SYNC_DB_EXECUTOR_WORKERS", 0))
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -103,7 +175,113 @@ DATABASES = {
         'PASSWORD': 'mypassword123',    # The password you set for that user in Step 2
         'HOST': 'localhost',            # Or '127.0.0.1'. Since it's local.
         'PORT': '5432',                 # The port PostgreSQL is running on (default)
+        # Checks a connection before it is reused (with the pool: whenever it is borrowed).
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Connection pooling (psycopg 3 pool). Each process keeps MIN_SIZE..MAX_SIZE open
+# connections; a thread borrows one for an HTTP request or a database_sync_to_async
+# call and hands it back when Django closes the connection, instead of connecting
+# anew every time. MAX_SIZE must cover every thread that touches the database at
+# once: the ASGI sync thread pool (ASGI_THREADS, default min(32, CPUs + 4)), the
+# thread-sensitive thread and SYNC_DB_EXECUTOR_WORKERS; a thread that finds the pool
+# exhausted waits up to TIMEOUT seconds, then fails. MAX_SIZE 0 turns pooling off.
+DB_POOL = {
+    "MIN_SIZE": int(os.environ.get("DB_POOL_MIN_SIZE", 4)),
+    "MAX_SIZE": int(os.environ.get("DB_POOL_MAX_SIZE", 40)),
+    "TIMEOUT": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+    "MAX_IDLE": 300,  # Seconds an idle connection above MIN_SIZE is kept
+    "MAX_LIFETIME": 1800,  # Seconds before a connection is replaced
+}
+if DB_POOL["MAX_SIZE"]:
+    DATABASES['default']['OPTIONS'] = {
+        "pool": {
+            "name": "default",
+            "min_size": min(DB_POOL["MIN_SIZE"], DB_POOL["MAX_SIZE"]),
+            "max_size": DB_POOL["MAX_SIZE"],
+            "timeout": DB_POOL["TIMEOUT"],
+            "max_idle": DB_POOL["MAX_IDLE"],
+            "max_lifetime": DB_POOL["MAX_LIFETIME"],
+        },
     }
+
+# Read replicas. DB_REPLICA_HOSTS (comma-separated host or host:port) adds a database
+# alias per replica, "replica_1", "replica_2", ..., otherwise configured like
+# "default". Safe requests to views with `read_from_replica` read from one of them
+# (api/db_routing.py); everything else uses the primary. A user whose request wrote
+# reads from the primary for PIN_SECONDS afterwards. Pins are kept in the cache, so
+# they only reach other processes with CACHE_REDIS_URL. To try routing locally,
+# point a replica at the primary itself, e.g. DB_REPLICA_HOSTS=localhost.
+DB_REPLICA_HOSTS = [host.strip() for host in os.environ.get("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+DB_REPLICA = {
+    "PIN_SECONDS": int(os.environ.get("DB_REPLICA_PIN_SECONDS", 5)),
+}
+for index, replica_host in enumerate(DB_REPLICA_HOSTS, start=1):
+    alias = f"replica_{index}"
+    host, _, port = replica_host.partition(":")
+    DATABASES[alias] = copy.deepcopy(DATABASES['default'])
+    DATABASES[alias].update(HOST=host, PORT=port or DATABASES['default']['PORT'], TEST={"MIRROR": "default"})
+    if "pool" in DATABASES[alias].get("OPTIONS", {}):
+        DATABASES[alias]["OPTIONS"]["pool"]["name"] = alias
+DATABASE_ROUTERS = ["api.db_routing.PrimaryReplicaRouter"]
+
+
+# Cache
+# Set CACHE_REDIS_URL to share cached data (chat room authorization, ...) between
+# worker processes; otherwise each process uses its own local-memory cache.
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+if CACHE_REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_REDIS_URL,
+            "KEY_PREFIX": "bluecollar",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Chat room authorization cache (api/chat_rooms.py): an in-process LRU of `maxsize`
+# entries living `local_ttl` seconds in front of the shared cache (`shared_ttl` seconds).
+CHAT_ROOM_ACCESS_CACHE = {
+    "maxsize": 10000,
+    "local_ttl": 30,
+    "shared_ttl": 3600,
+}
+
+# Provider detail document cache (api/response_cache.py): same two tiers. Concurrent
+# misses wait up to `wait_timeout` seconds for a single rebuild.
+PROVIDER_DETAIL_CACHE = {
+    "maxsize": 1000,
+    "local_ttl": 5,
+    "shared_ttl": 3600,
+    "lock_timeout": 10,
+    "wait_timeout": 2,
+}
+
+
+# Metrics (api/metrics.py): Prometheus text format at /api/metrics/, served only to
+# METRICS_ALLOWED_IPS. With METRICS_ENABLED off nothing is recorded.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+METRICS_ALLOWED_IPS = [
+    ip.strip() for ip in os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",") if ip.strip()
+]
+
+# Logging: the api app logs to the console at LOG_LEVEL (DEBUG shows per-socket events).
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api": {"handlers": ["console"], "level": os.environ.get("LOG_LEVEL", "INFO")},
+    },
 }
 
 
@@ -157,11 +335,40 @@ import os # if not already imported
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Resized WebP/JPEG copies of uploaded images (api/images.py), generated after upload
+# by a pool of WORKERS threads. WIDTHS overrides the default widths per field, e.g.
+# {"api.ServiceProviderProfile.profile_picture": [64, 128, 256]}.
+IMAGE_DERIVATIVES = {
+    "WORKERS": 2,
+    "QUALITY": 80,
+    "WIDTHS": {},
+}
+
+# Booking calendar (api/availability.py). Bookings without an estimated duration hold
+# DEFAULT_DURATION_HOURS; availability queries span at most MAX_RANGE_DAYS days.
+# Working hours are read in TIME_ZONE.
+BOOKING_CALENDAR = {
+    "DEFAULT_DURATION_HOURS": 1,
+    "MAX_RANGE_DAYS": 31,
+}
 # bluecollar_backend/settings.py
 
+# How an access token's user is resolved. "snapshot" reads id, username and role
+# flags from a cached user snapshot (no user-table query per request or socket
+# connect); "database" loads the User row every time, as simplejwt does by default.
+# Snapshots are invalidated through the cache, so snapshot mode needs a cache shared
+# by every worker (CACHE_REDIS_URL). With per-process caches a deactivated user would
+# stay signed in on other workers; the default is then "database" and api/checks.py
+# rejects "snapshot".
+JWT_AUTH_MODE = os.environ.get('JWT_AUTH_MODE', 'snapshot' if CACHE_REDIS_URL else 'database')
+USER_SNAPSHOT_CACHE_TIMEOUT = 300  # seconds; snapshots are also invalidated on change
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.SnapshotJWTAuthentication'
+        if JWT_AUTH_MODE == 'snapshot'
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
         # You might add other authentication classes here later if needed, e.g.,
         # 'rest_framework.authentication.SessionAuthentication', # If you also use Django sessions
         # 'rest_framework.authentication.BasicAuthentication',